@@ -0,0 +1,165 @@
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+from .models import CustomUser, Module, SubModule, UserModuleAccess
+
+PERMISSION_FIELDS = ('can_view', 'can_create', 'can_edit', 'can_delete')
+
+# Tiempo máximo (s) de una entrada en caché aunque no llegue ninguna señal
+PERMISSION_CACHE_TIMEOUT = 300
+GENERATION_KEY = 'perm:generation'
+USER_ACTIVE_CACHE_TIMEOUT = 300
+
+
+def _merge_permissions(current, row):
+    """Combina los permisos de varias filas (p. ej. distintos roles) con un OR"""
+    merged = dict(current or {field: False for field in PERMISSION_FIELDS})
+    for field in PERMISSION_FIELDS:
+        merged[field] = merged[field] or row[field]
+    return merged
+
+
+def build_permission_map(user_id):
+    """
+    Construye el mapa completo de permisos de un usuario en una sola consulta:
+    {module_code: {"permissions": {...} | None, "submodules": {submodule_code: {...}}}}
+    "permissions" del módulo corresponde al acceso general (sin submódulo).
+    """
+    rows = UserModuleAccess.objects.filter(user_id=user_id).values(
+        'module__code', 'submodule__code', *PERMISSION_FIELDS
+    )
+
+    permission_map = {}
+    for row in rows:
+        entry = permission_map.setdefault(
+            row['module__code'], {'permissions': None, 'submodules': {}}
+        )
+        submodule_code = row['submodule__code']
+        if submodule_code is None:
+            entry['permissions'] = _merge_permissions(entry['permissions'], row)
+        else:
+            entry['submodules'][submodule_code] = _merge_permissions(
+                entry['submodules'].get(submodule_code), row
+            )
+    return permission_map
+
+
+def _generation():
+    """Generación del catálogo: al cambiar un módulo o submódulo se invalida todo"""
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, 1, timeout=None)
+        generation = cache.get(GENERATION_KEY, 1)
+    return generation
+
+
+def _permission_map_key(user_id):
+    return f'perm:map:{_generation()}:{user_id}'
+
+
+def get_permission_map(user_id):
+    """Mapa de permisos del usuario desde la caché; se construye al primer uso"""
+    key = _permission_map_key(user_id)
+    permission_map = cache.get(key)
+    if permission_map is None:
+        permission_map = build_permission_map(user_id)
+        cache.set(key, permission_map, timeout=PERMISSION_CACHE_TIMEOUT)
+    return permission_map
+
+
+def get_module_catalog():
+    """
+    Códigos de módulos y submódulos existentes ({module_code: {submodule_code, ...}}),
+    en caché para no buscar Module/SubModule por código en cada verificación
+    """
+    key = f'perm:catalog:{_generation()}'
+    catalog = cache.get(key)
+    if catalog is None:
+        catalog = {code: set() for code in Module.objects.values_list('code', flat=True)}
+        for module_code, submodule_code in SubModule.objects.values_list('module__code', 'code'):
+            catalog[module_code].add(submodule_code)
+        cache.set(key, catalog, timeout=PERMISSION_CACHE_TIMEOUT)
+    return catalog
+
+
+def invalidate_user_permissions(user_id):
+    cache.delete(_permission_map_key(user_id))
+
+
+def invalidate_users_permissions(user_ids):
+    cache.delete_many([_permission_map_key(user_id) for user_id in user_ids])
+
+
+def invalidate_all_permissions():
+    """Descarta catálogo y mapas de todos los usuarios cambiando de generación"""
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 2, timeout=None)
+
+
+def _user_active_key(user_id):
+    return f'user:active:{user_id}'
+
+
+def is_user_active(user_id):
+    """Estado activo del usuario desde la caché; los inexistentes cuentan como inactivos"""
+    key = _user_active_key(user_id)
+    is_active = cache.get(key)
+    if is_active is None:
+        is_active = CustomUser.objects.filter(pk=user_id, is_active=True).exists()
+        cache.set(key, is_active, timeout=USER_ACTIVE_CACHE_TIMEOUT)
+    return is_active
+
+
+def set_user_active(user_id, is_active):
+    cache.set(_user_active_key(user_id), is_active, timeout=USER_ACTIVE_CACHE_TIMEOUT)
+
+
+def resolve_access(permission_map, module_code, submodule_code=None):
+    """
+    Permisos efectivos sobre un módulo/submódulo según el mapa de permisos.
+    Si no hay acceso directo al submódulo se usa el acceso general al módulo;
+    si no se indica submódulo basta con cualquier acceso dentro del módulo.
+    Retorna None si el usuario no tiene acceso.
+    """
+    entry = permission_map.get(module_code)
+    if not entry:
+        return None
+
+    if submodule_code:
+        return entry['submodules'].get(submodule_code, entry['permissions'])
+    if entry['permissions'] is None and entry['submodules']:
+        return next(iter(entry['submodules'].values()))
+    return entry['permissions']
+
+
+def encode_permission_claims(permission_map):
+    """
+    Codificación compacta del mapa de permisos para incluirla en el token:
+    una cadena "module_code:submodule_code:bits" por acceso, con el submódulo
+    vacío para el acceso general y bits view=1, create=2, edit=4, delete=8.
+    """
+    def bits(permissions):
+        return sum(1 << i for i, field in enumerate(PERMISSION_FIELDS) if permissions[field])
+
+    claims = []
+    for module_code, entry in permission_map.items():
+        if entry['permissions'] is not None:
+            claims.append(f"{module_code}::{bits(entry['permissions'])}")
+        for submodule_code, permissions in entry['submodules'].items():
+            claims.append(f"{module_code}:{submodule_code}:{bits(permissions)}")
+    return claims
+
+
+def bump_permissions_version(user_id):
+    """Invalida los permisos incluidos en los tokens ya emitidos para el usuario"""
+    bump_permissions_versions([user_id])
+
+
+def bump_permissions_versions(user_ids):
+    """bump_permissions_version para varios usuarios en una sola consulta"""
+    CustomUser.objects.filter(pk__in=user_ids).update(
+        permissions_version=F('permissions_version') + 1,
+        permissions_updated_at=timezone.now()
+    )
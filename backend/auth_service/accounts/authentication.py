@@ -0,0 +1,48 @@
+from django.utils.functional import cached_property
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.models import TokenUser
+from rest_framework_simplejwt.settings import api_settings
+from .access import is_user_active
+from .revocation import is_token_revoked
+
+
+class RevocationAwareJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication que además rechaza los tokens revocados (logout, desactivación, permisos)"""
+
+    def get_validated_token(self, raw_token):
+        validated_token = super().get_validated_token(raw_token)
+        if is_token_revoked(validated_token.payload):
+            raise InvalidToken({"detail": "El token ha sido revocado", "code": "token_revoked"})
+        return validated_token
+
+
+class ClaimsUser(TokenUser):
+    """
+    Usuario construido sólo con los claims del token (sin consultar
+    CustomUser). Sólo lleva datos que no cambian durante la vida del token:
+    el email y el nombre se editan y se leen de la base de datos.
+    """
+
+    @cached_property
+    def id(self):
+        return int(self.token[api_settings.USER_ID_CLAIM])
+
+
+class StatelessJWTAuthentication(RevocationAwareJWTAuthentication):
+    """
+    Para endpoints de verificación (verify-access, introspect...): el usuario
+    sale de los claims y sólo se comprueba que siga activo, con una caché que
+    las señales de CustomUser mantienen al día. La ruta habitual no consulta
+    la tabla de usuarios.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken("El token no identifica a ningún usuario")
+
+        if not is_user_active(user_id):
+            raise AuthenticationFailed("Usuario inactivo o inexistente", code="user_inactive")
+        return ClaimsUser(validated_token)
@@ -0,0 +1,58 @@
+from django.db import transaction
+from .models import ChangeEvent, CustomUser, UserModuleAccess
+
+# Máximo de eventos por página del feed de cambios
+MAX_CHANGES_PAGE = 500
+
+
+def record_changes(user_ids, kind):
+    """
+    Registra cambios de usuarios al confirmarse la transacción en curso, de
+    modo que el orden de los ids del feed siga el de los commits
+    """
+    user_ids = list(user_ids)
+    if user_ids:
+        transaction.on_commit(lambda: ChangeEvent.objects.bulk_create([
+            ChangeEvent(user_id=user_id, kind=kind) for user_id in user_ids
+        ]))
+
+
+def changes_after(cursor, limit=MAX_CHANGES_PAGE):
+    """
+    Cambios posteriores al cursor. Cada usuario afectado aparece una vez con
+    su estado actual (o `deleted`) y los códigos de los módulos a los que tiene
+    acceso. El cursor retornado permite continuar donde se quedó el lector.
+    """
+    events = list(
+        ChangeEvent.objects.filter(id__gt=cursor).order_by('id').values_list('id', 'user_id')[:limit + 1]
+    )
+    has_more = len(events) > limit
+    events = events[:limit]
+
+    user_ids = list(dict.fromkeys(user_id for _, user_id in events))
+    users = {
+        user['id']: user
+        for user in CustomUser.objects.filter(pk__in=user_ids).values(
+            'id', 'email', 'first_name', 'last_name', 'is_active'
+        )
+    }
+    modules = {}
+    for user_id, module_code in (
+        UserModuleAccess.objects.filter(user_id__in=user_ids)
+        .values_list('user_id', 'module__code').distinct().order_by()
+    ):
+        modules.setdefault(user_id, set()).add(module_code)
+
+    return {
+        "changes": [
+            {
+                "user_id": user_id,
+                "deleted": user_id not in users,
+                "user": users.get(user_id),
+                "modules": sorted(modules.get(user_id, ())),
+            }
+            for user_id in user_ids
+        ],
+        "cursor": events[-1][0] if events else cursor,
+        "has_more": has_more,
+    }
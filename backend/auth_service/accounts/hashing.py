@@ -0,0 +1,131 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
+from django.db import close_old_connections
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                workers = getattr(settings, 'PASSWORD_HASHING_WORKERS', None) or os.cpu_count() or 1
+                _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+    return _executor
+
+
+def hash_passwords(passwords):
+    """
+    Hashea una lista de contraseñas en paralelo y retorna los hashes en el
+    mismo orden. PBKDF2 (hashlib) libera el GIL, por lo que los hilos usan
+    varios núcleos. Las contraseñas None quedan como no utilizables.
+    """
+    if len(passwords) <= 1:
+        return [make_password(password) for password in passwords]
+    return list(_get_executor().map(make_password, passwords))
+
+
+class LoginPoolBusy(Exception):
+    """La cola de verificación de contraseñas de login está llena"""
+
+
+class LoginHashingPool:
+    """
+    Pool acotado para verificar contraseñas de login fuera de los hilos que
+    atienden peticiones. Limita cuántos hashes PBKDF2 corren a la vez (y
+    cuántos esperan), de modo que los picos de login no acaparen la CPU que
+    necesitan refresh, verify-access o introspect. Con workers=0 el hash se
+    calcula en el propio hilo de la petición, como antes.
+
+    Sólo acota la CPU: el servicio corre bajo WSGI y el hilo de la petición
+    espera bloqueado el resultado, así que no libera hilos del servidor.
+    """
+
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor = (
+            ThreadPoolExecutor(max_workers=workers, thread_name_prefix='login-hash') if workers else None
+        )
+        # Plazas totales: en ejecución + en cola
+        self._slots = threading.BoundedSemaphore(workers + queue_size) if workers else None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._queued = 0
+        self._max_queued = 0
+        self._completed = 0
+        self._rejected = 0
+
+    def run(self, fn, *args):
+        """Ejecuta fn en el pool y espera el resultado; LoginPoolBusy si no hay plaza"""
+        if self._executor is None:
+            return fn(*args)
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            raise LoginPoolBusy()
+
+        with self._lock:
+            self._queued += 1
+            self._max_queued = max(self._max_queued, self._queued)
+        try:
+            return self._executor.submit(self._call, fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def _call(self, fn, *args):
+        with self._lock:
+            self._queued -= 1
+            self._in_flight += 1
+        try:
+            return fn(*args)
+        finally:
+            # Los hilos del pool no pasan por el fin de petición que cierra las conexiones
+            close_old_connections()
+            with self._lock:
+                self._in_flight -= 1
+                self._completed += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'queue_size': self.queue_size,
+                'in_flight': self._in_flight,
+                'queued': self._queued,
+                'max_queued': self._max_queued,
+                'completed': self._completed,
+                'rejected': self._rejected,
+            }
+
+
+_login_pool = None
+
+
+def get_login_pool():
+    global _login_pool
+    if _login_pool is None:
+        with _executor_lock:
+            if _login_pool is None:
+                workers = getattr(settings, 'LOGIN_HASHING_WORKERS', None)
+                if workers is None:
+                    workers = max(1, (os.cpu_count() or 2) // 2)
+                _login_pool = LoginHashingPool(
+                    workers, getattr(settings, 'LOGIN_HASHING_QUEUE_SIZE', 64)
+                )
+    return _login_pool
+
+
+def authenticate_credentials(email, password, request=None):
+    """
+    authenticate() de Django (AUTHENTICATION_BACKENDS, señal user_login_failed,
+    rehash) ejecutado en el pool de login. Puede lanzar LoginPoolBusy.
+    """
+    return get_login_pool().run(lambda: authenticate(request, email=email, password=password))
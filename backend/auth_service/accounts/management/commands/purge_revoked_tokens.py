@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from accounts.models import RevokedToken
+
+
+class Command(BaseCommand):
+    help = 'Elimina las revocaciones de tokens que ya expiraron'
+
+    def handle(self, *args, **options):
+        deleted, _ = RevokedToken.objects.filter(expires_at__lte=timezone.now()).delete()
+        self.stdout.write(self.style.SUCCESS(f'{deleted} revocaciones expiradas eliminadas'))
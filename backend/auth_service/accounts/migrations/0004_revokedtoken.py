@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0003_customuser_search_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RevokedToken',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('user_id', models.BigIntegerField(db_index=True)),
+                ('jti', models.CharField(blank=True, db_index=True, max_length=255, null=True)),
+                ('issued_before', models.DateTimeField(blank=True, null=True)),
+                ('reason', models.CharField(choices=[('logout', 'Cierre de sesión'), ('deactivated', 'Usuario desactivado'), ('permissions', 'Permisos retirados')], max_length=20)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+    ]
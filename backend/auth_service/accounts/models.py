@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models.functions import Lower
 from django.contrib.auth.models import AbstractUser, BaseUserManager, Group, Permission
 from django.utils.translation import gettext_lazy as _
 
@@ -55,6 +56,11 @@ class CustomUser(AbstractUser):
     last_name = models.CharField(_('last name'), max_length=150, default='')
     is_superadmin = models.BooleanField(default=False)  # Superadmin global
 
+    # Versión de los permisos por módulo; se incrementa con cada cambio para que
+    # los servicios detecten tokens con permisos desactualizados
+    permissions_version = models.PositiveIntegerField(default=0)
+    permissions_updated_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
     # Relaciones
     modules = models.ManyToManyField(Module, through='UserModuleAccess')
     roles = models.ManyToManyField(Role, blank=True)
@@ -86,6 +92,14 @@ class CustomUser(AbstractUser):
 
     objects = UserManager()
 
+    class Meta(AbstractUser.Meta):
+        # Índices para la búsqueda por prefijo (sin distinguir mayúsculas) del listado de usuarios
+        indexes = [
+            models.Index(Lower('email'), name='user_email_lower_idx'),
+            models.Index(Lower('first_name'), name='user_first_name_lower_idx'),
+            models.Index(Lower('last_name'), name='user_last_name_lower_idx'),
+        ]
+
     def __str__(self):
         return self.email
 
@@ -110,4 +124,47 @@ class UserModuleAccess(models.Model):
     def __str__(self):
         submodule_name = self.submodule.name if self.submodule else "Todos"
         role_name = self.role.name if self.role else "Sin rol"
-        return f"{self.user.email} - {self.module.name} - {submodule_name} - {role_name}"
\ No newline at end of file
+        return f"{self.user.email} - {self.module.name} - {submodule_name} - {role_name}"
+
+class RevokedToken(models.Model):
+    """
+    Revocación de tokens antes de su expiración. Con `jti` se revoca un token
+    concreto (logout); sin `jti` se revocan todos los tokens del usuario
+    emitidos hasta `issued_before` (desactivación o retiro de permisos).
+    El id autoincremental sirve de secuencia para publicar los cambios.
+    """
+    REASON_CHOICES = [
+        ('logout', 'Cierre de sesión'),
+        ('deactivated', 'Usuario desactivado'),
+        ('permissions', 'Permisos retirados'),
+    ]
+
+    # Sin clave foránea: la revocación debe sobrevivir al borrado del usuario
+    user_id = models.BigIntegerField(db_index=True)
+    jti = models.CharField(max_length=255, null=True, blank=True, db_index=True)
+    issued_before = models.DateTimeField(null=True, blank=True)
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    # Pasada esta fecha los tokens afectados ya expiraron por sí mismos
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        target = self.jti or f"tokens hasta {self.issued_before}"
+        return f"{self.user_id} - {target} - {self.reason}"
+
+class ChangeEvent(models.Model):
+    """
+    Registro ordenado de cambios de usuarios y de sus accesos. Los demás
+    servicios lo leen por cursor (id) para mantener réplicas locales.
+    """
+    KIND_CHOICES = [
+        ('user', 'Usuario'),
+        ('access', 'Acceso a módulo'),
+    ]
+
+    user_id = models.BigIntegerField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.id} - {self.kind} - {self.user_id}"
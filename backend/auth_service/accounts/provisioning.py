@@ -0,0 +1,196 @@
+from django.db import transaction
+from .access import PERMISSION_FIELDS, bump_permissions_versions, invalidate_users_permissions
+from .changes import record_changes
+from .hashing import hash_passwords
+from .models import CustomUser, Module, SubModule, Role, UserModuleAccess
+from .serializers import BulkUserSerializer
+
+# Máximo de usuarios por carga masiva
+MAX_BULK_USERS = 1000
+
+
+def _grant_key(user_id, grant):
+    return (user_id, grant['module_id'], grant.get('submodule_id'), grant.get('role_id'))
+
+
+def _validate_rows(rows, results):
+    """Valida cada fila por separado; las inválidas quedan en `results` como error"""
+    valid = []
+    seen_emails = set()
+    for index, row in enumerate(rows):
+        serializer = BulkUserSerializer(data=row)
+        if not serializer.is_valid():
+            email = row.get('email') if isinstance(row, dict) else None
+            results[index] = {'index': index, 'email': email, 'status': 'error', 'errors': serializer.errors}
+            continue
+
+        data = serializer.validated_data
+        data['email'] = CustomUser.objects.normalize_email(data['email'])
+        if data['email'] in seen_emails:
+            results[index] = {
+                'index': index, 'email': data['email'], 'status': 'error',
+                'errors': {'email': ['Email repetido en la carga']}
+            }
+            continue
+        seen_emails.add(data['email'])
+        valid.append((index, data))
+    return valid
+
+
+def _validate_references(valid, results):
+    """Comprueba módulos, submódulos y roles de todas las filas con tres consultas"""
+    module_ids, submodule_ids, role_ids = set(), set(), set()
+    for _, data in valid:
+        role_ids.update(data['role_ids'])
+        for grant in data['modules']:
+            module_ids.add(grant['module_id'])
+            if grant.get('submodule_id'):
+                submodule_ids.add(grant['submodule_id'])
+            if grant.get('role_id'):
+                role_ids.add(grant['role_id'])
+
+    modules = set(Module.objects.filter(id__in=module_ids).values_list('id', flat=True))
+    submodules = dict(SubModule.objects.filter(id__in=submodule_ids).values_list('id', 'module_id'))
+    roles = set(Role.objects.filter(id__in=role_ids).values_list('id', flat=True))
+
+    checked = []
+    for index, data in valid:
+        errors = []
+        missing_roles = [role_id for role_id in data['role_ids'] if role_id not in roles]
+        if missing_roles:
+            errors.append(f"Roles no encontrados: {missing_roles}")
+        for grant in data['modules']:
+            if grant['module_id'] not in modules:
+                errors.append(f"Módulo no encontrado: {grant['module_id']}")
+            elif grant.get('submodule_id') and submodules.get(grant['submodule_id']) != grant['module_id']:
+                errors.append(
+                    f"Submódulo no encontrado o no pertenece al módulo especificado: {grant['submodule_id']}"
+                )
+            if grant.get('role_id') and grant['role_id'] not in roles:
+                errors.append(f"Rol no encontrado: {grant['role_id']}")
+
+        if errors:
+            results[index] = {'index': index, 'email': data['email'], 'status': 'error', 'errors': {'modules': errors}}
+        else:
+            checked.append((index, data))
+    return checked
+
+
+def provision_users(rows):
+    """
+    Alta/actualización masiva de usuarios con sus roles y accesos a módulos.
+
+    Cada fila se valida por separado y las filas válidas se aplican en una sola
+    transacción con inserciones y actualizaciones masivas: los usuarios que ya
+    existen (por email) se actualizan y sus accesos se crean o actualizan según
+    (módulo, submódulo, rol), como en assign_module. La contraseña sólo se
+    asigna a los usuarios nuevos (hasheadas en paralelo); la de un usuario
+    existente nunca se sobrescribe. Retorna un resultado por fila, en el orden
+    recibido.
+    """
+    results = [None] * len(rows)
+    valid = _validate_references(_validate_rows(rows, results), results)
+    if not valid:
+        return results
+
+    existing = {
+        user.email: user
+        for user in CustomUser.objects.filter(email__in=[data['email'] for _, data in valid])
+    }
+
+    # Sólo los usuarios nuevos reciben contraseña
+    to_hash = [(index, data) for index, data in valid if data['email'] not in existing]
+    hashes = dict(zip(
+        (index for index, _ in to_hash),
+        hash_passwords([data.get('password') for _, data in to_hash])
+    ))
+
+    new_users, updated_users, users_by_index = [], [], {}
+    for index, data in valid:
+        user = existing.get(data['email'])
+        if user is None:
+            user = CustomUser(email=data['email'])
+            new_users.append(user)
+        else:
+            updated_users.append(user)
+        for field in ('first_name', 'last_name'):
+            if field in data:
+                setattr(user, field, data[field])
+        if index in hashes:
+            user.password = hashes[index]
+        users_by_index[index] = user
+
+    with transaction.atomic():
+        CustomUser.objects.bulk_create(new_users)
+        if any(user.pk is None for user in new_users):
+            # Bases de datos que no devuelven las claves insertadas
+            ids = dict(CustomUser.objects.filter(
+                email__in=[user.email for user in new_users]
+            ).values_list('email', 'id'))
+            for user in new_users:
+                user.pk = ids[user.email]
+        if updated_users:
+            CustomUser.objects.bulk_update(updated_users, ['first_name', 'last_name'])
+
+        UserRole = CustomUser.roles.through
+        UserRole.objects.bulk_create([
+            UserRole(customuser_id=users_by_index[index].pk, role_id=role_id)
+            for index, data in valid for role_id in set(data['role_ids'])
+        ], ignore_conflicts=True)
+
+        # Accesos: la última concesión de una fila para la misma clave prevalece
+        grants = {}
+        for index, data in valid:
+            for grant in data['modules']:
+                grants[_grant_key(users_by_index[index].pk, grant)] = (index, grant)
+
+        # Las filas con submódulo o rol NULL no las detecta unique_together,
+        # así que se emparejan con las existentes antes de insertar
+        current = {}
+        if updated_users:
+            current = {
+                (access.user_id, access.module_id, access.submodule_id, access.role_id): access
+                for access in UserModuleAccess.objects.filter(
+                    user__in=updated_users,
+                    module_id__in={key[1] for key in grants}
+                )
+            }
+
+        to_create, to_update = [], []
+        access_counts = {index: {'created': 0, 'updated': 0} for index, _ in valid}
+        for key, (index, grant) in grants.items():
+            access = current.get(key)
+            if access is None:
+                access = UserModuleAccess(
+                    user_id=key[0], module_id=key[1], submodule_id=key[2], role_id=key[3]
+                )
+                to_create.append(access)
+                access_counts[index]['created'] += 1
+            else:
+                to_update.append(access)
+                access_counts[index]['updated'] += 1
+            for field in PERMISSION_FIELDS:
+                setattr(access, field, grant[field])
+
+        UserModuleAccess.objects.bulk_create(to_create)
+        if to_update:
+            UserModuleAccess.objects.bulk_update(to_update, PERMISSION_FIELDS)
+
+        # bulk_create/bulk_update no emiten señales: se invalida a mano
+        changed_user_ids = {key[0] for key in grants}
+        if changed_user_ids:
+            bump_permissions_versions(changed_user_ids)
+        record_changes([user.pk for user in users_by_index.values()], 'user')
+
+    invalidate_users_permissions(changed_user_ids)
+
+    for index, data in valid:
+        user = users_by_index[index]
+        results[index] = {
+            'index': index,
+            'email': user.email,
+            'status': 'updated' if user.email in existing else 'created',
+            'id': user.pk,
+            'access': access_counts[index],
+        }
+    return results
@@ -0,0 +1,43 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import msgpack
+except ImportError:  # msgpack es opcional: sin él sólo se habla JSON
+    msgpack = None
+
+MSGPACK_MEDIA_TYPE = 'application/x-msgpack'
+
+
+def _default(obj):
+    # Mismas conversiones que el JSONRenderer de DRF (fechas, Decimal, UUID, lazy...)
+    return JSONEncoder().default(obj)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Respuestas en MessagePack para las llamadas entre servicios, elegido con
+    `Accept: application/x-msgpack`. Los navegadores siguen recibiendo JSON.
+    """
+    media_type = MSGPACK_MEDIA_TYPE
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(data, default=_default, use_bin_type=True)
+
+
+class MessagePackParser(BaseParser):
+    """Cuerpos de petición en MessagePack (`Content-Type: application/x-msgpack`)"""
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except ValueError as exc:
+            raise ParseError(f'Error al interpretar MessagePack: {exc}')
@@ -0,0 +1,180 @@
+import base64
+import hashlib
+import math
+from datetime import datetime, timezone as dt_timezone
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from .models import RevokedToken
+
+BLOOM_FALSE_POSITIVE_RATE = 0.001
+MIN_BLOOM_BITS = 1024
+# Con más revocaciones nuevas que estas se envía el estado completo
+MAX_DELTA_ENTRIES = 1000
+SNAPSHOT_CACHE_TIMEOUT = 60
+SEQ_CACHE_KEY = 'revocations:seq'
+# La caché es local a cada proceso: acota cuánto tarda en verse una revocación hecha en otro
+SEQ_CACHE_TIMEOUT = 5
+
+# Último filtro de Bloom decodificado en este proceso: (seq, bits)
+_decoded_bloom = (None, b'')
+
+
+def _from_timestamp(value):
+    return datetime.fromtimestamp(value, tz=dt_timezone.utc)
+
+
+def bloom_positions(jti, size, hashes):
+    """Posiciones del JTI en el filtro (doble hash sobre SHA-256); igual en todos los servicios"""
+    digest = hashlib.sha256(jti.encode()).digest()
+    h1 = int.from_bytes(digest[:8], 'big')
+    h2 = int.from_bytes(digest[8:16], 'big') | 1
+    return [(h1 + i * h2) % size for i in range(hashes)]
+
+
+def build_bloom(jtis):
+    """Filtro de Bloom con los JTIs dados, serializado para el endpoint de revocaciones"""
+    count = max(len(jtis), 1)
+    size = max(MIN_BLOOM_BITS, math.ceil(-count * math.log(BLOOM_FALSE_POSITIVE_RATE) / math.log(2) ** 2))
+    size += -size % 8
+    hashes = max(1, min(16, round(size / count * math.log(2))))
+
+    bits = bytearray(size // 8)
+    for jti in jtis:
+        for position in bloom_positions(jti, size, hashes):
+            bits[position // 8] |= 1 << (position % 8)
+    return {"size": size, "hashes": hashes, "bits": base64.b64encode(bytes(bits)).decode()}
+
+
+def current_seq():
+    """Secuencia de la última revocación, en caché hasta la siguiente"""
+    seq = cache.get(SEQ_CACHE_KEY)
+    if seq is None:
+        seq = RevokedToken.objects.aggregate(seq=Max('id'))['seq'] or 0
+        cache.set(SEQ_CACHE_KEY, seq, timeout=SEQ_CACHE_TIMEOUT)
+    return seq
+
+
+def _forget_seq():
+    cache.delete(SEQ_CACHE_KEY)
+
+
+def _create_revocation(**fields):
+    revoked = RevokedToken.objects.create(**fields)
+    # También tras el commit, por si otra petición leyó la secuencia entretanto
+    _forget_seq()
+    transaction.on_commit(_forget_seq)
+    return revoked
+
+
+def revoke_token(payload, reason='logout'):
+    """Revoca un token concreto (access o refresh) hasta su expiración"""
+    return _create_revocation(
+        user_id=int(payload[jwt_settings.USER_ID_CLAIM]),
+        jti=payload[jwt_settings.JTI_CLAIM],
+        reason=reason,
+        expires_at=_from_timestamp(payload['exp']),
+    )
+
+
+def revoke_user_tokens(user_id, reason):
+    """
+    Revoca todos los access tokens del usuario emitidos antes del segundo
+    actual. Los refresh tokens siguen siendo válidos (salvo usuario inactivo),
+    de modo que el cliente obtiene un access token nuevo con los permisos
+    vigentes, aunque lo pida en el mismo segundo.
+    """
+    # El iat de los tokens va en segundos enteros: el corte también
+    now = timezone.now().replace(microsecond=0)
+    return _create_revocation(
+        user_id=user_id,
+        issued_before=now,
+        reason=reason,
+        expires_at=now + jwt_settings.ACCESS_TOKEN_LIFETIME,
+    )
+
+
+def _in_bloom(jti, bloom, seq):
+    global _decoded_bloom
+    decoded_seq, bits = _decoded_bloom
+    if decoded_seq != seq:
+        bits = base64.b64decode(bloom['bits'])
+        _decoded_bloom = (seq, bits)
+    return all(
+        bits[position // 8] & (1 << (position % 8))
+        for position in bloom_positions(jti, bloom['size'], bloom['hashes'])
+    )
+
+
+def is_token_revoked(payload, check_user_cutoffs=True):
+    """
+    True si el token está revocado por su JTI o, opcionalmente, por un corte
+    del usuario. Se resuelve con el estado completo en caché (el mismo que se
+    publica a los servicios); sólo una coincidencia del filtro de Bloom, que
+    puede ser un falso positivo, se confirma en la base de datos.
+    """
+    seq = current_seq()
+    snapshot = revocation_snapshot(seq)
+
+    user_id, issued_at = payload.get(jwt_settings.USER_ID_CLAIM), payload.get('iat')
+    if check_user_cutoffs and user_id is not None and issued_at is not None:
+        cutoff = snapshot['users'].get(str(int(user_id)))
+        if cutoff is not None and issued_at < cutoff:
+            return True
+
+    jti = payload.get(jwt_settings.JTI_CLAIM)
+    if jti is None or not _in_bloom(jti, snapshot['bloom'], seq):
+        return False
+    return RevokedToken.objects.filter(jti=jti, expires_at__gt=timezone.now()).exists()
+
+
+def _user_cutoffs(entries):
+    """{user_id: timestamp del último corte}; revocados los tokens con iat < corte"""
+    cutoffs = {}
+    for user_id, issued_before in entries:
+        cutoffs[str(user_id)] = max(cutoffs.get(str(user_id), 0), issued_before.timestamp())
+    return cutoffs
+
+
+def revocation_snapshot(seq):
+    """Estado completo vigente: Bloom con los JTIs revocados y cortes exactos por usuario"""
+    key = f'revocations:snapshot:{seq}'
+    snapshot = cache.get(key)
+    if snapshot is None:
+        live = RevokedToken.objects.filter(id__lte=seq, expires_at__gt=timezone.now())
+        snapshot = {
+            "type": "snapshot",
+            "seq": seq,
+            "bloom": build_bloom(list(live.filter(jti__isnull=False).values_list('jti', flat=True))),
+            "users": _user_cutoffs(live.filter(jti__isnull=True).values_list('user_id', 'issued_before')),
+        }
+        cache.set(key, snapshot, timeout=SNAPSHOT_CACHE_TIMEOUT)
+    return snapshot
+
+
+def revocation_changes(since=None):
+    """
+    Revocaciones posteriores a la secuencia `since` como lista exacta (delta) o,
+    si no se indica, está fuera de rango o hay demasiados cambios, el estado
+    completo. Los servicios la consultan periódicamente y verifican en local.
+    """
+    seq = current_seq()
+    if since is None or since > seq:
+        return revocation_snapshot(seq)
+
+    entries = list(
+        RevokedToken.objects.filter(id__gt=since, id__lte=seq, expires_at__gt=timezone.now())
+        .order_by('id')
+        .values_list('jti', 'user_id', 'issued_before')[:MAX_DELTA_ENTRIES + 1]
+    )
+    if len(entries) > MAX_DELTA_ENTRIES:
+        return revocation_snapshot(seq)
+
+    return {
+        "type": "delta",
+        "seq": seq,
+        "jtis": [jti for jti, _, _ in entries if jti],
+        "users": _user_cutoffs((user_id, issued_before) for jti, user_id, issued_before in entries if not jti),
+    }
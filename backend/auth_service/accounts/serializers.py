@@ -1,7 +1,11 @@
 from rest_framework import serializers
 from .models import CustomUser, Module, SubModule, UserModuleAccess
-from django.contrib.auth import authenticate
-from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework.exceptions import APIException
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
+from rest_framework_simplejwt.exceptions import InvalidToken
+from .revocation import is_token_revoked
+from .hashing import LoginPoolBusy, authenticate_credentials
+from .tokens import PermissionsRefreshToken
 
 class ModuleSerializer(serializers.ModelSerializer):
     class Meta:
@@ -33,7 +37,8 @@ class UserSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
     
     def get_module_access(self, obj):
-        user_module_access = UserModuleAccess.objects.filter(user=obj)
+        # Usa los accesos precargados por UserViewSet (prefetch_related)
+        user_module_access = obj.usermoduleaccess_set.all()
         return UserModuleAccessSerializer(user_module_access, many=True).data
 
 class UserCreateSerializer(serializers.ModelSerializer):
@@ -50,26 +55,57 @@ class UserCreateSerializer(serializers.ModelSerializer):
         user.save()
         return user
 
+class LoginUnavailable(APIException):
+    status_code = 503
+    default_detail = 'Demasiados inicios de sesión simultáneos, inténtalo de nuevo en unos segundos'
+    default_code = 'login_unavailable'
+
 class LoginSerializer(serializers.Serializer):
     email = serializers.EmailField()
     password = serializers.CharField()
     
     def validate(self, data):
-        user = authenticate(email=data['email'], password=data['password'])
+        # El hash de la contraseña se verifica en el pool acotado de login
+        try:
+            user = authenticate_credentials(data['email'], data['password'], self.context.get('request'))
+        except LoginPoolBusy:
+            raise LoginUnavailable()
         if not user or not user.is_active:
             raise serializers.ValidationError("Credenciales incorrectas o usuario inactivo")
         
-        refresh = RefreshToken.for_user(user)
+        refresh = PermissionsRefreshToken.for_user(user)
         return {
             'user': user,
             'refresh': str(refresh),
             'access': str(refresh.access_token)
         }
 
+class PermissionsTokenRefreshSerializer(TokenRefreshSerializer):
+    """Al refrescar, el nuevo access token lleva los permisos vigentes"""
+    token_class = PermissionsRefreshToken
+    
+    def validate(self, attrs):
+        # Los refresh tokens sólo se revocan por logout (su JTI)
+        if is_token_revoked(self.token_class(attrs['refresh']).payload, check_user_cutoffs=False):
+            raise InvalidToken("El refresh token ha sido revocado")
+        return super().validate(attrs)
+
 class AssignModuleSerializer(serializers.Serializer):
     module_id = serializers.IntegerField(required=True)
     submodule_id = serializers.IntegerField(required=False, allow_null=True)
     can_view = serializers.BooleanField(default=True)
     can_create = serializers.BooleanField(default=False)
     can_edit = serializers.BooleanField(default=False)
-    can_delete = serializers.BooleanField(default=False)
\ No newline at end of file
+    can_delete = serializers.BooleanField(default=False)
+
+class BulkModuleGrantSerializer(AssignModuleSerializer):
+    role_id = serializers.IntegerField(required=False, allow_null=True)
+
+class BulkUserSerializer(serializers.Serializer):
+    """Fila de la carga masiva: datos del usuario y sus accesos"""
+    email = serializers.EmailField()
+    password = serializers.CharField(required=False, allow_null=True, write_only=True)
+    first_name = serializers.CharField(required=False, allow_blank=True, max_length=150)
+    last_name = serializers.CharField(required=False, allow_blank=True, max_length=150)
+    role_ids = serializers.ListField(child=serializers.IntegerField(), required=False, default=list)
+    modules = BulkModuleGrantSerializer(many=True, required=False, default=list)
@@ -0,0 +1,90 @@
+import threading
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .access import (
+    bump_permissions_versions, invalidate_users_permissions, invalidate_all_permissions, set_user_active
+)
+from .models import CustomUser, Module, SubModule, UserModuleAccess
+from .changes import record_changes
+from .revocation import revoke_user_tokens
+
+
+class AccessChanges:
+    """
+    Usuarios cuyos accesos cambiaron en la transacción en curso. Se procesan
+    una sola vez tras el commit aunque cambien muchas filas (por ejemplo, en
+    cascada al borrar un usuario o un módulo).
+    """
+
+    def __init__(self):
+        self.changed = set()
+        self.removed = set()
+        self.done = False
+
+    def __call__(self):
+        self.done = True
+        # Tras el commit: antes, otra petición podría volver a cachear los accesos anteriores
+        invalidate_users_permissions(self.changed)
+        bump_permissions_versions(self.changed)
+        # Al retirar accesos se revocan los access tokens ya emitidos al usuario
+        for user_id in sorted(self.removed):
+            revoke_user_tokens(user_id, 'permissions')
+
+
+_pending = threading.local()
+
+
+def _access_changes():
+    """Lote de la transacción en curso; uno nuevo si el anterior ya se procesó o se descartó"""
+    batch = getattr(_pending, 'batch', None)
+    scheduled = batch is not None and not batch.done and any(
+        callback is batch for _, callback, _ in transaction.get_connection().run_on_commit
+    )
+    if not scheduled:
+        batch = _pending.batch = AccessChanges()
+    return batch, scheduled
+
+
+@receiver(post_save, sender=UserModuleAccess)
+@receiver(post_delete, sender=UserModuleAccess)
+def user_module_access_changed(sender, instance, signal, **kwargs):
+    """Cualquier cambio de accesos invalida el mapa en caché y los permisos de los tokens"""
+    batch, scheduled = _access_changes()
+    batch.changed.add(instance.user_id)
+    if signal is post_delete:
+        batch.removed.add(instance.user_id)
+    if not scheduled:
+        # Fuera de una transacción se ejecuta en el acto: después de anotar al usuario
+        transaction.on_commit(batch)
+    record_changes([instance.user_id], 'access')
+
+
+@receiver(pre_save, sender=CustomUser)
+def detect_user_deactivation(sender, instance, **kwargs):
+    instance._deactivated = (
+        instance.pk is not None and not instance.is_active
+        and CustomUser.objects.filter(pk=instance.pk, is_active=True).exists()
+    )
+
+
+@receiver(post_save, sender=CustomUser)
+def revoke_deactivated_user_tokens(sender, instance, **kwargs):
+    set_user_active(instance.pk, instance.is_active)
+    record_changes([instance.pk], 'user')
+    if getattr(instance, '_deactivated', False):
+        revoke_user_tokens(instance.pk, 'deactivated')
+
+
+@receiver(post_delete, sender=CustomUser)
+def user_deleted(sender, instance, **kwargs):
+    set_user_active(instance.pk, False)
+    record_changes([instance.pk], 'user')
+
+
+@receiver(post_save, sender=Module)
+@receiver(post_delete, sender=Module)
+@receiver(post_save, sender=SubModule)
+@receiver(post_delete, sender=SubModule)
+def module_catalog_changed(sender, instance, **kwargs):
+    invalidate_all_permissions()
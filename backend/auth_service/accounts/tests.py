@@ -1,3 +1,560 @@
-from django.test import TestCase
+import base64
+import importlib.util
+import threading
+from datetime import timedelta
+from pathlib import Path
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.contrib.auth.signals import user_login_failed
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.db import connection
+from rest_framework.test import APIClient
+
+from . import hashing
+from .renderers import MSGPACK_MEDIA_TYPE, msgpack
+from .revocation import bloom_positions, revoke_user_tokens
+from .tokens import PermissionsRefreshToken
+from .models import CustomUser, Module, SubModule, Role, RevokedToken, UserModuleAccess
+
+# Transporte con el que clinicas_service llama a este servicio
+CLINICAS_TRANSPORT = Path(settings.BASE_DIR).parent / 'clinicas_service' / 'authentication' / 'transport.py'
+
+
+class UserListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin@clinica.pe', None, first_name='Admin')
+        cls.module = Module.objects.create(name='Clínicas', code='clinicas_service')
+        cls.submodule = SubModule.objects.create(module=cls.module, name='Sede Centro', code='sede_centro')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def create_users(self, count, offset=0):
+        for i in range(offset, offset + count):
+            user = CustomUser.objects.create_user(f'usuario{i}@clinica.pe', None, first_name=f'Nombre{i}')
+            UserModuleAccess.objects.create(user=user, module=self.module)
+            UserModuleAccess.objects.create(user=user, module=self.module, submodule=self.submodule)
+
+    def list_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/users/', {'page_size': 500})
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries), response.data['results']
+
+    def test_query_count_does_not_grow_with_users(self):
+        self.create_users(3)
+        queries_small, results = self.list_queries()
+        self.assertEqual(len(results), 4)
+
+        self.create_users(40, offset=3)
+        queries_large, results = self.list_queries()
+        self.assertEqual(len(results), 44)
+
+        self.assertEqual(queries_small, queries_large)
+        self.assertEqual(queries_large, 2)
+        self.assertEqual(results[-1]['module_access'][1]['submodule_name'], 'Sede Centro')
+
+    def test_cursor_pagination(self):
+        self.create_users(5)
+        response = self.client.get('/api/users/', {'page_size': 4})
+        self.assertEqual(len(response.data['results']), 4)
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNone(response.data['next'])
+
+    def test_batch_lookup_by_ids(self):
+        self.create_users(5)
+        ids = list(CustomUser.objects.order_by('id').values_list('id', flat=True))
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/users/batch/', {'ids': f'{ids[3]},{ids[1]},999999'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(context.captured_queries), 2)
+        self.assertEqual([u['id'] for u in response.data['results']], [ids[1], ids[3]])
+        self.assertEqual(len(response.data['results'][0]['module_access']), 2)
+
+        self.assertEqual(self.client.get('/api/users/batch/', {'ids': 'uno'}).status_code, 400)
+
+    @skipUnless(msgpack, 'msgpack no está instalado')
+    def test_batch_lookup_negotiates_messagepack(self):
+        self.create_users(2)
+        ids = ','.join(str(pk) for pk in CustomUser.objects.values_list('id', flat=True))
+
+        response = self.client.get('/api/users/batch/', {'ids': ids}, HTTP_ACCEPT=MSGPACK_MEDIA_TYPE)
+        self.assertEqual(response['Content-Type'], MSGPACK_MEDIA_TYPE)
+        results = msgpack.unpackb(response.content, raw=False)['results']
+        self.assertEqual(len(results), 3)
+        self.assertEqual(results[0]['email'], 'admin@clinica.pe')
+
+        # Sin Accept explícito se mantiene JSON
+        response = self.client.get('/api/users/batch/', {'ids': ids})
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+    def test_search_by_prefix_of_email_or_name(self):
+        CustomUser.objects.create_user('lucia.rojas@clinica.pe', None, first_name='Lucía', last_name='Rojas')
+        CustomUser.objects.create_user('pedro@clinica.pe', None, first_name='Pedro', last_name='Quispe')
+
+        emails = lambda term: [u['email'] for u in self.client.get('/api/users/', {'search': term}).data['results']]
+        self.assertEqual(emails('LUCIA.'), ['lucia.rojas@clinica.pe'])
+        self.assertEqual(emails('quis'), ['pedro@clinica.pe'])
+        self.assertEqual(emails('rojas'), ['lucia.rojas@clinica.pe'])
+        self.assertEqual(emails('ojas'), [])
+
+
+class VerifyModuleAccessCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('medico@clinica.pe', None)
+        cls.module = Module.objects.create(name='Clínicas', code='clinicas_service')
+        cls.submodule = SubModule.objects.create(module=cls.module, name='Sede Centro', code='sede_centro')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def verify(self, module_code='clinicas_service', submodule_code=None):
+        data = {'module_code': module_code}
+        if submodule_code:
+            data['submodule_code'] = submodule_code
+        return self.client.post('/api/verify-access/', data, format='json').data
+
+    def test_warm_cache_needs_no_queries(self):
+        UserModuleAccess.objects.create(user=self.user, module=self.module, can_view=True)
+        # Token real: también la autenticación y la lista de revocación salen de la caché
+        self.client.force_authenticate(None)
+        access = PermissionsRefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        self.verify()
+
+        with self.assertNumQueries(0):
+            data = self.verify(submodule_code='sede_centro')
+        self.assertTrue(data['has_access'])
+        self.assertTrue(data['permissions']['can_view'])
+
+    def test_access_changes_invalidate_cache(self):
+        self.assertFalse(self.verify()['has_access'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            access = UserModuleAccess.objects.create(user=self.user, module=self.module, can_view=True)
+        self.assertTrue(self.verify()['has_access'])
+
+        access.can_edit = True
+        with self.captureOnCommitCallbacks(execute=True):
+            access.save()
+        self.assertTrue(self.verify()['permissions']['can_edit'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            access.delete()
+        self.assertFalse(self.verify()['has_access'])
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.permissions_version, 3)
+
+    def test_invalidates_only_after_commit(self):
+        self.assertFalse(self.verify()['has_access'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            UserModuleAccess.objects.create(user=self.user, module=self.module, can_view=True)
+            # Aún sin confirmar: la caché y la versión siguen como estaban
+            self.assertFalse(self.verify()['has_access'])
+            self.assertEqual(CustomUser.objects.get(pk=self.user.pk).permissions_version, 0)
+
+        self.assertTrue(self.verify()['has_access'])
+        self.assertEqual(CustomUser.objects.get(pk=self.user.pk).permissions_version, 1)
+
+    def test_catalog_changes_invalidate_cache(self):
+        self.assertEqual(self.verify('historias')['error'], 'Módulo no encontrado')
+        self.assertEqual(self.verify(submodule_code='sede_norte')['error'], 'Submódulo no encontrado')
+
+        module = Module.objects.create(name='Historias', code='historias')
+        SubModule.objects.create(module=self.module, name='Sede Norte', code='sede_norte')
+        self.assertNotIn('error', self.verify('historias'))
+        self.assertNotIn('error', self.verify(submodule_code='sede_norte'))
+
+        module.delete()
+        self.assertEqual(self.verify('historias')['error'], 'Módulo no encontrado')
+
+
+class BulkProvisioningTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_user('admin@clinica.pe', None, is_superadmin=True)
+        cls.module = Module.objects.create(name='Clínicas', code='clinicas_service')
+        cls.submodule = SubModule.objects.create(module=cls.module, name='Sede Centro', code='sede_centro')
+        cls.role = Role.objects.create(name='doctor')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def test_provisions_users_and_grants_with_per_row_report(self):
+        existing = CustomUser.objects.create_user('recepcion@clinica.pe', None)
+        UserModuleAccess.objects.create(user=existing, module=self.module, can_view=True)
+        version = CustomUser.objects.get(pk=existing.pk).permissions_version
+
+        grant = {'module_id': self.module.id, 'submodule_id': self.submodule.id, 'role_id': self.role.id}
+        users = [
+            {'email': f'medico{i}@clinica.pe', 'first_name': f'Medico{i}', 'role_ids': [self.role.id], 'modules': [grant]}
+            for i in range(20)
+        ]
+        users += [
+            {'email': 'recepcion@clinica.pe', 'first_name': 'Rosa', 'modules': [
+                {'module_id': self.module.id, 'can_edit': True},
+                {'module_id': self.module.id, 'submodule_id': self.submodule.id},
+            ]},
+            {'email': 'medico0@clinica.pe'},
+            {'email': 'sin-modulo@clinica.pe', 'modules': [{'module_id': 999}]},
+            {'email': 'no-es-un-email'},
+        ]
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.post('/api/users/bulk/', {'users': users}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertLess(len(context.captured_queries), 20)
+        self.assertEqual((response.data['created'], response.data['updated'], response.data['error']), (20, 1, 3))
+
+        results = response.data['results']
+        self.assertEqual(results[0]['access'], {'created': 1, 'updated': 0})
+        self.assertEqual(results[20]['access'], {'created': 1, 'updated': 1})
+        self.assertEqual([r['status'] for r in results[21:]], ['error'] * 3)
+
+        medico = CustomUser.objects.get(email='medico5@clinica.pe')
+        self.assertEqual(medico.first_name, 'Medico5')
+        self.assertFalse(medico.has_usable_password())
+        self.assertEqual(list(medico.roles.all()), [self.role])
+        self.assertTrue(UserModuleAccess.objects.filter(user=medico, submodule=self.submodule, role=self.role).exists())
+
+        existing.refresh_from_db()
+        self.assertEqual(existing.first_name, 'Rosa')
+        self.assertEqual(UserModuleAccess.objects.filter(user=existing).count(), 2)
+        self.assertTrue(UserModuleAccess.objects.get(user=existing, submodule=None).can_edit)
+        self.assertEqual(existing.permissions_version, version + 1)
+        self.assertFalse(CustomUser.objects.filter(email='sin-modulo@clinica.pe').exists())
+
+    def test_hashes_passwords(self):
+        users = [{'email': f'clave{i}@clinica.pe', 'password': f'Secreta-{i}'} for i in range(3)]
+        self.client.post('/api/users/bulk/', users, format='json')
+
+        self.assertTrue(CustomUser.objects.get(email='clave2@clinica.pe').check_password('Secreta-2'))
+
+    def test_never_overwrites_existing_passwords(self):
+        existing = CustomUser.objects.create_user('recepcion@clinica.pe', 'Clave-Original-1')
+        self.client.post('/api/users/bulk/', [{'email': existing.email, 'password': 'Robada-1'}], format='json')
+
+        existing.refresh_from_db()
+        self.assertTrue(existing.check_password('Clave-Original-1'))
+
+    def test_requires_admin(self):
+        victim = CustomUser.objects.create_user('recepcion@clinica.pe', 'Clave-Original-1')
+        client = APIClient()
+        client.force_authenticate(CustomUser.objects.create_user('paciente@clinica.pe', None))
+
+        response = client.post('/api/users/bulk/', [{
+            'email': victim.email, 'password': 'Robada-1', 'modules': [{'module_id': self.module.id}]
+        }], format='json')
+        self.assertEqual(response.status_code, 403)
+        victim.refresh_from_db()
+        self.assertTrue(victim.check_password('Clave-Original-1'))
+        self.assertFalse(UserModuleAccess.objects.filter(user=victim).exists())
+
+
+class LoginHashingPoolTests(TransactionTestCase):
+    # authenticate() consulta el usuario desde los hilos del pool: los datos deben estar confirmados
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('recepcion@clinica.pe', 'Clave-Segura-1')
+        self.pool = hashing.LoginHashingPool(workers=1, queue_size=0)
+        patcher = mock.patch.object(hashing, '_login_pool', self.pool)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def login(self, password='Clave-Segura-1'):
+        return APIClient().post('/api/login/', {'email': 'recepcion@clinica.pe', 'password': password}, format='json')
+
+    def test_login_hashes_on_pool(self):
+        self.assertEqual(self.login().status_code, 200)
+        self.assertEqual(self.login('otra').status_code, 401)
+        self.assertEqual(self.pool.stats()['completed'], 2)
+
+    def test_login_goes_through_authentication_backends(self):
+        failures = []
+
+        def on_failure(sender, credentials, request, **kwargs):
+            failures.append(credentials['email'])
+
+        user_login_failed.connect(on_failure)
+        self.addCleanup(user_login_failed.disconnect, on_failure)
+        self.assertEqual(self.login('otra').status_code, 401)
+        self.assertEqual(failures, ['recepcion@clinica.pe'])
+
+    def test_rejects_logins_when_pool_is_full(self):
+        release = threading.Event()
+        started = threading.Event()
+
+        def busy():
+            started.set()
+            release.wait(5)
+
+        worker = threading.Thread(target=self.pool.run, args=(busy,))
+        worker.start()
+        started.wait(5)
+        try:
+            response = self.login()
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(self.pool.stats()['in_flight'], 1)
+            self.assertEqual(self.pool.stats()['rejected'], 1)
+        finally:
+            release.set()
+            worker.join()
+        self.assertEqual(self.login().status_code, 200)
+
+
+class TokenRevocationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('medico@clinica.pe', None)
+        cls.service = CustomUser.objects.create_user('clinicas@servicios.pe', None, is_staff=True)
+        cls.module = Module.objects.create(name='Clínicas', code='clinicas_service')
+
+    def setUp(self):
+        cache.clear()
+
+    def tokens(self):
+        refresh = PermissionsRefreshToken.for_user(self.user)
+        return refresh, refresh.access_token
+
+    def client_for(self, access):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {access}')
+        return client
+
+    def revocations(self, since=None):
+        client = APIClient()
+        client.force_authenticate(self.service)
+        params = {} if since is None else {'since': since}
+        return client.get('/api/revocations/', params).data
+
+    def test_logout_revokes_access_and_refresh_tokens(self):
+        refresh, access = self.tokens()
+        _, other_access = self.tokens()
+        client = self.client_for(access)
+
+        self.assertEqual(client.get('/api/introspect/').status_code, 200)
+        response = client.post('/api/logout/', {'refresh': str(refresh)}, format='json')
+        self.assertEqual(response.status_code, 204)
+
+        self.assertEqual(client.get('/api/introspect/').status_code, 401)
+        response = APIClient().post('/api/token/refresh/', {'refresh': str(refresh)}, format='json')
+        self.assertEqual(response.status_code, 401)
+        # Los demás tokens del usuario siguen siendo válidos
+        self.assertEqual(self.client_for(other_access).get('/api/introspect/').status_code, 200)
+
+    def test_deactivation_and_permission_removal_revoke_issued_tokens(self):
+        _, access = self.tokens()
+        # Los cortes van en segundos enteros: el token es de un segundo anterior
+        access.set_iat(at_time=timezone.now() - timedelta(seconds=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            UserModuleAccess.objects.create(user=self.user, module=self.module).delete()
+        self.assertEqual(self.client_for(access).get('/api/introspect/').status_code, 401)
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(list(RevokedToken.objects.values_list('reason', flat=True)), ['permissions', 'deactivated'])
+
+    def test_cascaded_access_removal_revokes_each_user_once(self):
+        other = CustomUser.objects.create_user('recepcion@clinica.pe', None)
+        module = Module.objects.create(name='Historias', code='historias')
+        submodules = [SubModule.objects.create(module=module, name=f'Sede {i}', code=f'sede_{i}') for i in range(3)]
+        with self.captureOnCommitCallbacks(execute=True):
+            for user in (self.user, other):
+                UserModuleAccess.objects.create(user=user, module=module)
+                for submodule in submodules:
+                    UserModuleAccess.objects.create(user=user, module=module, submodule=submodule)
+
+        # Borrar el módulo borra en cascada las ocho filas de acceso
+        with self.captureOnCommitCallbacks(execute=True):
+            module.delete()
+        self.assertEqual(
+            sorted(RevokedToken.objects.values_list('user_id', 'reason')),
+            [(self.user.pk, 'permissions'), (other.pk, 'permissions')]
+        )
+        # Una sola subida de versión por transacción
+        self.user.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual([self.user.permissions_version, other.permissions_version], [2, 2])
+
+    def test_token_refreshed_in_the_revocation_second_stays_valid(self):
+        refresh, old_access = self.tokens()
+        # Revocación al final del segundo en curso: el refresh cae en ese segundo
+        revoked_at = timezone.now().replace(microsecond=999999)
+        old_access.set_iat(at_time=revoked_at - timedelta(seconds=1))
+        with mock.patch('accounts.revocation.timezone.now', return_value=revoked_at):
+            revoke_user_tokens(self.user.pk, 'permissions')
+
+        response = APIClient().post('/api/token/refresh/', {'refresh': str(refresh)}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client_for(response.data['access']).get('/api/introspect/').status_code, 200)
+        self.assertEqual(self.client_for(old_access).get('/api/introspect/').status_code, 401)
+
+    def test_publishes_bloom_snapshot_and_exact_delta(self):
+        _, revoked = self.tokens()
+        self.client_for(revoked).post('/api/logout/')
+
+        snapshot = self.revocations()
+        self.assertEqual(snapshot['type'], 'snapshot')
+        bloom = snapshot['bloom']
+        bits = base64.b64decode(bloom['bits'])
+        self.assertTrue(all(
+            bits[p // 8] & (1 << (p % 8))
+            for p in bloom_positions(revoked['jti'], bloom['size'], bloom['hashes'])
+        ))
+
+        self.user.is_active = False
+        self.user.save()
+        delta = self.revocations(since=snapshot['seq'])
+        self.assertEqual(delta['type'], 'delta')
+        self.assertEqual(delta['jtis'], [])
+        self.assertEqual(list(delta['users']), [str(self.user.pk)])
+
+
+class StatelessAuthenticationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('medico@clinica.pe', None, first_name='Ana')
+        cls.module = Module.objects.create(name='Clínicas', code='clinicas_service')
+        UserModuleAccess.objects.create(user=cls.user, module=cls.module)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {PermissionsRefreshToken.for_user(self.user).access_token}')
+
+    def user_queries(self, path, method='get', data=None):
+        with CaptureQueriesContext(connection) as context:
+            response = getattr(self.client, method)(path, data, format='json')
+        return response, [q['sql'] for q in context.captured_queries if 'accounts_customuser' in q['sql']]
+
+    def test_token_only_endpoints_skip_user_query(self):
+        self.client.get('/api/introspect/')
+
+        response, queries = self.user_queries('/api/introspect/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['user'], {'id': self.user.id})
+        self.assertEqual(queries, [])
+
+        response, queries = self.user_queries('/api/verify-access/', 'post', {'module_code': 'clinicas_service'})
+        self.assertTrue(response.data['has_access'])
+        self.assertEqual(queries, [])
+
+    @skipUnless(msgpack and CLINICAS_TRANSPORT.exists(), 'msgpack o clinicas_service no disponibles')
+    def test_clinicas_client_accept_header_gets_messagepack(self):
+        spec = importlib.util.spec_from_file_location('clinicas_transport', CLINICAS_TRANSPORT)
+        transport = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(transport)
+
+        response = self.client.get('/api/introspect/', HTTP_ACCEPT=transport.ACCEPT)
+        self.assertEqual(response['Content-Type'], MSGPACK_MEDIA_TYPE)
+        self.assertEqual(msgpack.unpackb(response.content, raw=False)['user']['id'], self.user.id)
+
+        response = self.client.post(
+            '/api/verify-access/', {'module_code': 'clinicas_service'}, format='json', HTTP_ACCEPT=transport.ACCEPT
+        )
+        self.assertEqual(response['Content-Type'], MSGPACK_MEDIA_TYPE)
+        self.assertTrue(msgpack.unpackb(response.content, raw=False)['has_access'])
+
+    def test_rejects_deactivated_user(self):
+        self.assertEqual(self.client.get('/api/introspect/').status_code, 200)
+
+        self.user.is_active = False
+        self.user.save(update_fields=['is_active'])
+        self.assertEqual(self.client.get('/api/introspect/').status_code, 401)
+
+
+class PermissionClaimsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user('medico@clinica.pe', None, first_name='Ana')
+        cls.module = Module.objects.create(name='Clínicas', code='clinicas_service')
+        cls.submodule = SubModule.objects.create(module=cls.module, name='Sede Centro', code='sede_centro')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_access_tokens_carry_current_permissions_and_version(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            UserModuleAccess.objects.create(user=self.user, module=self.module, can_view=True, can_edit=True)
+        refresh = PermissionsRefreshToken.for_user(self.user)
+
+        access = refresh.access_token
+        self.assertEqual(access['perms'], ['clinicas_service::5'])
+        self.assertEqual(access['pv'], 1)
+        # El email y el nombre se editan: no viajan en el token
+        self.assertNotIn('email', access)
+        self.assertNotIn('perms', refresh.payload)
+
+        # Un refresh posterior emite los permisos vigentes con la versión nueva
+        with self.captureOnCommitCallbacks(execute=True):
+            UserModuleAccess.objects.create(user=self.user, module=self.module, submodule=self.submodule)
+        access = refresh.access_token
+        self.assertEqual(sorted(access['perms']), ['clinicas_service::5', 'clinicas_service:sede_centro:1'])
+        self.assertEqual(access['pv'], 2)
+
+    def test_permissions_versions_feed_reports_bumped_users(self):
+        since = timezone.now().timestamp()
+        with self.captureOnCommitCallbacks(execute=True):
+            UserModuleAccess.objects.create(user=self.user, module=self.module)
+
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {PermissionsRefreshToken.for_user(self.user).access_token}')
+        # Los feeds internos son sólo para cuentas de servicio o administradores
+        self.assertEqual(client.get('/api/permissions-versions/').status_code, 403)
+
+        service = CustomUser.objects.create_user('clinicas@servicios.pe', None, is_staff=True)
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {PermissionsRefreshToken.for_user(service).access_token}')
+        response = client.get('/api/permissions-versions/', {'since': since - 1})
+        self.assertEqual(response.data['versions'], {str(self.user.pk): 1})
+
+
+class ChangeFeedTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create_user('clinicas@servicios.pe', None, is_staff=True))
+        self.module = Module.objects.create(name='Clínicas', code='clinicas_service')
+
+    def changes(self, after):
+        return self.client.get('/api/changes/', {'after': after, 'limit': 2}).data
+
+    def test_feed_is_resumable_from_cursor(self):
+        cursor = self.changes(0)['cursor']
+        with self.captureOnCommitCallbacks(execute=True):
+            ana = CustomUser.objects.create_user('ana@clinica.pe', None, first_name='Ana')
+        with self.captureOnCommitCallbacks(execute=True):
+            UserModuleAccess.objects.create(user=ana, module=self.module)
+        with self.captureOnCommitCallbacks(execute=True):
+            luis = CustomUser.objects.create_user('luis@clinica.pe', None)
+        with self.captureOnCommitCallbacks(execute=True):
+            luis.delete()
+
+        page = self.changes(cursor)
+        self.assertTrue(page['has_more'])
+        self.assertEqual(len(page['changes']), 1)
+        self.assertEqual(page['changes'][0]['user']['first_name'], 'Ana')
+        self.assertEqual(page['changes'][0]['modules'], ['clinicas_service'])
+
+        page = self.changes(page['cursor'])
+        self.assertFalse(page['has_more'])
+        self.assertEqual([c['deleted'] for c in page['changes']], [True])
+        self.assertEqual(self.changes(page['cursor'])['changes'], [])
+
+    def test_internal_feeds_are_forbidden_to_regular_users(self):
+        client = APIClient()
+        user = CustomUser.objects.create_user('paciente@clinica.pe', None)
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {PermissionsRefreshToken.for_user(user).access_token}')
+        for url in ('/api/changes/', '/api/revocations/', '/api/permissions-versions/'):
+            self.assertEqual(client.get(url).status_code, 403, url)
@@ -0,0 +1,28 @@
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from .access import get_permission_map, encode_permission_claims
+from .models import CustomUser
+
+PERMISSIONS_CLAIM = 'perms'
+PERMISSIONS_VERSION_CLAIM = 'pv'
+
+
+class PermissionsRefreshToken(RefreshToken):
+    """
+    Refresh token cuyos access tokens incluyen los permisos por módulo del
+    usuario y la versión de esos permisos. Los permisos se leen al emitir cada
+    access token (login y refresh), nunca se copian del refresh token.
+    """
+
+    @property
+    def access_token(self):
+        access = super().access_token
+        user_id = self.payload.get(api_settings.USER_ID_CLAIM)
+
+        version = CustomUser.objects.filter(pk=user_id).values_list(
+            'permissions_version', flat=True
+        ).first()
+        if version is not None:
+            access[PERMISSIONS_VERSION_CLAIM] = version
+            access[PERMISSIONS_CLAIM] = encode_permission_claims(get_permission_map(user_id))
+        return access
@@ -15,9 +15,16 @@ urlpatterns = [
     # Autenticación
     path('register/', views.register_user, name='register'),
     path('login/', views.login, name='login'),
+    path('logout/', views.logout, name='logout'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('token/public-key/', views.token_public_key, name='token_public_key'),
     path('profile/', views.user_profile, name='user_profile'),
+    path('internal/login-pool/', views.login_pool_stats, name='login_pool_stats'),
     
     # Verificación de acceso
     path('verify-access/', views.verify_module_access, name='verify_access'),
+    path('introspect/', views.introspect, name='introspect'),
+    path('permissions-versions/', views.permissions_versions, name='permissions_versions'),
+    path('revocations/', views.revocations, name='revocations'),
+    path('changes/', views.changes, name='changes'),
 ]
\ No newline at end of file
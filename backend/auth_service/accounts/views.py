@@ -1,8 +1,15 @@
 from rest_framework import viewsets, status, permissions
 from rest_framework.response import Response
-from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.decorators import action, api_view, authentication_classes, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.shortcuts import get_object_or_404
+from django.db.models import Prefetch, Q
+from django.db.models.functions import Lower
+from django.utils import timezone
+from datetime import datetime, timezone as dt_timezone
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+from rest_framework_simplejwt.exceptions import TokenError
 
 from .models import CustomUser, Module, SubModule, UserModuleAccess
 from .serializers import (
@@ -10,6 +17,43 @@ from .serializers import (
     SubModuleSerializer, UserModuleAccessSerializer, LoginSerializer,
     AssignModuleSerializer
 )
+from .access import get_permission_map, get_module_catalog, resolve_access
+from .pagination import UserCursorPagination
+from .authentication import StatelessJWTAuthentication
+from .provisioning import MAX_BULK_USERS, provision_users
+from .hashing import get_login_pool
+from .revocation import revoke_token, revocation_changes
+from .changes import MAX_CHANGES_PAGE, changes_after
+
+# Máximo de usuarios por consulta en users/batch/
+MAX_BATCH_USERS = 500
+
+def prefix_filter(field, prefix):
+    """
+    Filtro "empieza por" expresado además como rango, para que pueda
+    resolverse con los índices sobre Lower(...) en lugar de recorrer la tabla
+    """
+    upper_bound = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return Q(**{
+        f'{field}__gte': prefix,
+        f'{field}__lt': upper_bound,
+        f'{field}__startswith': prefix,
+    })
+
+class IsSuperAdmin(permissions.BasePermission):
+    """
+    Sólo superadministradores (o staff) gestionan usuarios y accesos de otros
+    y leen los feeds internos; las cuentas de servicio son staff
+    """
+    
+    def has_permission(self, request, view):
+        user = request.user
+        if not (user and user.is_authenticated):
+            return False
+        if isinstance(user, CustomUser):
+            return user.is_superadmin or user.is_staff
+        # Usuario de StatelessJWTAuthentication: el rol no viaja en el token
+        return CustomUser.objects.filter(Q(is_superadmin=True) | Q(is_staff=True), pk=user.id).exists()
 
 class ModuleViewSet(viewsets.ModelViewSet):
     queryset = Module.objects.all()
@@ -32,12 +76,84 @@ class UserViewSet(viewsets.ModelViewSet):
     queryset = CustomUser.objects.all()
     serializer_class = UserSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = UserCursorPagination
+    
+    def get_queryset(self):
+        # Accesos con su módulo y submódulo en dos consultas para toda la página
+        queryset = CustomUser.objects.prefetch_related(
+            Prefetch(
+                'usermoduleaccess_set',
+                queryset=UserModuleAccess.objects.select_related('module', 'submodule')
+            )
+        )
+        
+        # Búsqueda por prefijo de email, nombre o apellidos
+        search = self.request.query_params.get('search', '').strip().lower()
+        if search:
+            queryset = queryset.annotate(
+                email_lower=Lower('email'),
+                first_name_lower=Lower('first_name'),
+                last_name_lower=Lower('last_name'),
+            ).filter(
+                prefix_filter('email_lower', search) |
+                prefix_filter('first_name_lower', search) |
+                prefix_filter('last_name_lower', search)
+            )
+        
+        return queryset
     
     def get_serializer_class(self):
         if self.action == 'create':
             return UserCreateSerializer
         return UserSerializer
     
+    @action(detail=False, methods=['get'])
+    def batch(self, request):
+        """Varios usuarios por id en una sola respuesta (?ids=1,2,3); los inexistentes se omiten"""
+        try:
+            ids = {int(value) for value in request.query_params.get('ids', '').split(',') if value.strip()}
+        except ValueError:
+            return Response(
+                {"error": "El parámetro 'ids' debe ser una lista de ids separados por comas"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if not ids or len(ids) > MAX_BATCH_USERS:
+            return Response(
+                {"error": f"Se requieren entre 1 y {MAX_BATCH_USERS} ids"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        users = self.get_queryset().filter(pk__in=ids).order_by('id')
+        return Response({"results": UserSerializer(users, many=True).data})
+    
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated, IsSuperAdmin])
+    def bulk(self, request):
+        """
+        Alta masiva de usuarios con sus roles y accesos; resultado por fila.
+        Sólo para administradores: concede accesos a módulos.
+        """
+        rows = request.data.get('users') if isinstance(request.data, dict) else request.data
+        
+        if not isinstance(rows, list) or not rows:
+            return Response(
+                {"error": "Se requiere una lista de usuarios"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if len(rows) > MAX_BULK_USERS:
+            return Response(
+                {"error": f"Máximo {MAX_BULK_USERS} usuarios por carga"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        results = provision_users(rows)
+        summary = {
+            outcome: sum(1 for result in results if result['status'] == outcome)
+            for outcome in ('created', 'updated', 'error')
+        }
+        return Response({**summary, "results": results})
+    
     @action(detail=True, methods=['post'])
     def assign_module(self, request, pk=None):
         user = self.get_object()
@@ -130,7 +246,7 @@ def register_user(request):
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def login(request):
-    serializer = LoginSerializer(data=request.data)
+    serializer = LoginSerializer(data=request.data, context={'request': request})
     if serializer.is_valid():
         data = serializer.validated_data
         return Response({
@@ -140,16 +256,108 @@ def login(request):
         })
     return Response(serializer.errors, status=status.HTTP_401_UNAUTHORIZED)
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def logout(request):
+    """Revoca el access token de la petición y, si se envía, también el refresh token"""
+    refresh = None
+    if request.data.get('refresh'):
+        try:
+            refresh = RefreshToken(request.data['refresh'])
+        except TokenError:
+            return Response(
+                {"error": "Refresh token inválido o expirado"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if str(refresh[jwt_settings.USER_ID_CLAIM]) != str(request.user.pk):
+            return Response(
+                {"error": "El refresh token no pertenece al usuario"}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    
+    revoke_token(request.auth.payload)
+    if refresh is not None:
+        revoke_token(refresh.payload)
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def login_pool_stats(request):
+    """Ocupación del pool de verificación de contraseñas de login en este proceso"""
+    return Response(get_login_pool().stats())
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def token_public_key(request):
+    """Publica la clave pública con la que otros servicios verifican los access tokens"""
+    if jwt_settings.ALGORITHM.startswith('HS') or not jwt_settings.VERIFYING_KEY:
+        return Response(
+            {"error": "Los tokens se firman con una clave compartida que no se publica"},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    return Response({
+        "algorithm": jwt_settings.ALGORITHM,
+        "verifying_key": jwt_settings.VERIFYING_KEY
+    })
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def user_profile(request):
     return Response(UserSerializer(request.user).data)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@authentication_classes([StatelessJWTAuthentication])
+def introspect(request):
+    """
+    Retorna en una sola llamada el id del usuario del token y su mapa completo
+    de permisos por módulo y submódulo. Un token inválido responde 401. El
+    email y el nombre no salen del token porque pueden haber cambiado desde
+    que se emitió: los servicios los piden a users/batch/ o a su réplica.
+    """
+    return Response({
+        "active": True,
+        "user": {"id": request.user.id},
+        "permissions": get_permission_map(request.user.id)
+    })
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsSuperAdmin])
+@authentication_classes([StatelessJWTAuthentication])
+def permissions_versions(request):
+    """
+    Versión actual de los permisos de los usuarios modificados desde `since`
+    (timestamp UNIX). Los servicios la consultan periódicamente para detectar
+    access tokens con permisos desactualizados.
+    """
+    server_time = timezone.now()
+    users = CustomUser.objects.filter(permissions_version__gt=0)
+    
+    since = request.query_params.get('since')
+    if since:
+        try:
+            since = datetime.fromtimestamp(float(since), tz=dt_timezone.utc)
+        except (ValueError, OverflowError):
+            return Response(
+                {"error": "El parámetro 'since' debe ser un timestamp UNIX"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        users = users.filter(permissions_updated_at__gte=since)
+    
+    return Response({
+        "versions": {
+            str(user_id): version
+            for user_id, version in users.values_list('id', 'permissions_version')
+        },
+        "server_time": server_time.timestamp()
+    })
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@authentication_classes([StatelessJWTAuthentication])
 def verify_module_access(request):
     """Verifica si el usuario tiene acceso a un módulo/submódulo específico"""
-    user = request.user
     module_code = request.data.get('module_code')
     submodule_code = request.data.get('submodule_code')
     
@@ -159,43 +367,64 @@ def verify_module_access(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    try:
-        module = Module.objects.get(code=module_code)
-        filters = {
-            'user': user,
-            'module': module,
-        }
-        
-        if submodule_code:
-            try:
-                submodule = SubModule.objects.get(code=submodule_code, module=module)
-                filters['submodule'] = submodule
-            except SubModule.DoesNotExist:
-                return Response(
-                    {"has_access": False, "error": "Submódulo no encontrado"}
-                )
-        
-        # Verificar acceso directo
-        access = UserModuleAccess.objects.filter(**filters).first()
-        
-        # Si no hay acceso directo, verificar acceso general al módulo (sin submódulo específico)
-        if not access and submodule_code:
-            access = UserModuleAccess.objects.filter(user=user, module=module, submodule=None).first()
-        
-        if access:
-            return Response({
-                "has_access": True,
-                "permissions": {
-                    "can_view": access.can_view,
-                    "can_create": access.can_create,
-                    "can_edit": access.can_edit,
-                    "can_delete": access.can_delete
-                }
-            })
-        
-        return Response({"has_access": False})
-    
-    except Module.DoesNotExist:
+    # Catálogo y permisos salen de la caché (invalidada por señales), sin consultas
+    catalog = get_module_catalog()
+    if module_code not in catalog:
         return Response(
             {"has_access": False, "error": "Módulo no encontrado"}
-        )
\ No newline at end of file
+        )
+    
+    if submodule_code and submodule_code not in catalog[module_code]:
+        return Response(
+            {"has_access": False, "error": "Submódulo no encontrado"}
+        )
+    
+    # Acceso directo al submódulo o, en su defecto, acceso general al módulo
+    access = resolve_access(get_permission_map(request.user.id), module_code, submodule_code)
+    
+    if access is not None:
+        return Response({
+            "has_access": True,
+            "permissions": access
+        })
+    
+    return Response({"has_access": False})
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsSuperAdmin])
+@authentication_classes([StatelessJWTAuthentication])
+def revocations(request):
+    """
+    Lista de revocación para verificar tokens en local: estado completo (Bloom
+    de JTIs y cortes por usuario) o sólo los cambios desde la secuencia `since`
+    """
+    since = request.query_params.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            return Response(
+                {"error": "El parámetro 'since' debe ser un número de secuencia"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    
+    return Response({**revocation_changes(since), "server_time": timezone.now().timestamp()})
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsSuperAdmin])
+@authentication_classes([StatelessJWTAuthentication])
+def changes(request):
+    """
+    Feed ordenado de cambios de usuarios y accesos a partir del cursor `after`.
+    Los servicios lo recorren para mantener su réplica local de usuarios.
+    """
+    try:
+        after = int(request.query_params.get('after', 0))
+        limit = min(int(request.query_params.get('limit', MAX_CHANGES_PAGE)), MAX_CHANGES_PAGE)
+    except ValueError:
+        return Response(
+            {"error": "Los parámetros 'after' y 'limit' deben ser números enteros"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    return Response(changes_after(after, max(limit, 1)))
@@ -12,6 +12,8 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 from datetime import timedelta
+import os
+from importlib.util import find_spec
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -139,16 +141,59 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # JWT Settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'accounts.authentication.RevocationAwareJWTAuthentication',
     ),
+    # JSON por defecto; MessagePack para los servicios que lo pidan con Accept
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
+# MessagePack sólo se anuncia si el paquete opcional msgpack está instalado
+if find_spec('msgpack'):
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].append('accounts.renderers.MessagePackRenderer')
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'].append('accounts.renderers.MessagePackParser')
+
 
 # JWT Configuration
 SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(hours=1),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=7),
+    # Los demás servicios verifican los tokens localmente: con HS256 comparten
+    # JWT_SIGNING_KEY; con RS256/ES256 sólo necesitan la clave pública que se
+    # publica en /api/token/public-key/
+    'ALGORITHM': os.environ.get('JWT_ALGORITHM', 'HS256'),
+    'SIGNING_KEY': os.environ.get('JWT_SIGNING_KEY', SECRET_KEY),
+    'VERIFYING_KEY': os.environ.get('JWT_VERIFYING_KEY', ''),
+    # Los access tokens renovados incluyen los permisos por módulo vigentes
+    'TOKEN_REFRESH_SERIALIZER': 'accounts.serializers.PermissionsTokenRefreshSerializer',
 }
 
 SESSION_COOKIE_NAME = "sessionid_auth"
-CSRF_COOKIE_NAME = "csrftoken_auth"
\ No newline at end of file
+CSRF_COOKIE_NAME = "csrftoken_auth"
+# Caché de permisos (mapa por usuario y catálogo de módulos). LocMemCache es
+# por proceso; con varios workers usar Redis/Memcached para que la
+# invalidación por señales llegue a todos
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'auth-permissions',
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    }
+}
+
+# Hilos para hashear contraseñas en las cargas masivas (None = núcleos disponibles)
+PASSWORD_HASHING_WORKERS = None
+
+# Pool de verificación de contraseñas en el login: hilos (None = mitad de los
+# núcleos, 0 = en el hilo de la petición) y peticiones en espera antes de
+# responder 503. Sólo limita la CPU dedicada a los hashes: bajo WSGI el hilo de
+# la petición queda esperando el resultado
+LOGIN_HASHING_WORKERS = None
+LOGIN_HASHING_QUEUE_SIZE = 64
@@ -1,14 +1,36 @@
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, permission_classes, throttle_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
+from rest_framework.throttling import AnonRateThrottle
 from rest_framework import status
-from clinicas.models import Especialidad, Doctor, Horario, Cita, Paciente
+from clinicas.availability import duracion_doctor, proximos_slots, slots_disponibles, slots_en_cache
+from clinicas.booking import (
+    LimiteReservas, ReservaAjena, TurnoOcupado, agenda_bloqueada, liberar_turnos, ocupar_turnos,
+    reserva_propia, retener_turno, verificar_turno_libre
+)
+from clinicas.models import Especialidad, Doctor, Cita, Paciente
 from clinicas.serializers import (
     EspecialidadSerializer, DoctorSerializer, CitaSerializer
 )
+from django.conf import settings
+from django.utils import timezone
 from datetime import datetime, timedelta
 import json
 
+# Búsqueda del próximo turno libre: ventana por defecto/máxima (días) y turnos por defecto/máximos
+DIAS_BUSQUEDA = 30
+MAX_DIAS_BUSQUEDA = 90
+TURNOS_PROXIMOS = 5
+
+
+class ReservaTemporalThrottle(AnonRateThrottle):
+    """Peticiones anónimas por IP a los endpoints de reservas temporales (CLINICAS_HOLD_THROTTLE_RATE)"""
+    scope = 'reservas_temporales'
+
+    def get_rate(self):
+        return getattr(settings, 'CLINICAS_HOLD_THROTTLE_RATE', '20/min')
+MAX_TURNOS_PROXIMOS = 50
+
 # Estos endpoints son públicos para ser consumidos por el chatbot
 @api_view(['GET'])
 @permission_classes([AllowAny])
@@ -49,56 +71,146 @@ def get_horarios_disponibles(request, doctor_id):
             status=status.HTTP_400_BAD_REQUEST
         )
     
+    # Los días en caché sólo existen para doctores activos: un acierto no necesita cargar el doctor
+    encontrado, disponibles = slots_en_cache(doctor_id, fecha)
+    if not encontrado:
+        try:
+            doctor = Doctor.objects.select_related('especialidad').get(id=doctor_id, activo=True)
+        except Doctor.DoesNotExist:
+            return Response(
+                {"error": "Doctor no encontrado"},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        disponibles = slots_disponibles(doctor, fecha)
+    
+    if disponibles is None:
+        return Response({"disponible": [], "mensaje": "El doctor no atiende este día"})
+    
+    return Response({
+        "disponible": disponibles,
+        "mensaje": f"{len(disponibles)} horarios disponibles"
+    })
+
+@api_view(['GET'])
+@permission_classes([AllowAny])
+def get_proximos_disponibles(request, especialidad_id):
+    """
+    Retorna los primeros turnos libres de todos los doctores activos de una
+    especialidad (opcional: clínica, rango de fechas y cantidad de turnos)
+    """
     try:
-        doctor = Doctor.objects.get(id=doctor_id, activo=True)
-    except Doctor.DoesNotExist:
+        desde = request.query_params.get('desde')
+        desde = datetime.strptime(desde, '%Y-%m-%d').date() if desde else timezone.localdate()
+        hasta = request.query_params.get('hasta')
+        hasta = datetime.strptime(hasta, '%Y-%m-%d').date() if hasta else desde + timedelta(days=DIAS_BUSQUEDA - 1)
+    except ValueError:
         return Response(
-            {"error": "Doctor no encontrado"},
-            status=status.HTTP_404_NOT_FOUND
+            {"error": "Formato de fecha inválido. Use YYYY-MM-DD"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    if hasta < desde or (hasta - desde).days >= MAX_DIAS_BUSQUEDA:
+        return Response(
+            {"error": f"El rango de fechas debe ser de 1 a {MAX_DIAS_BUSQUEDA} días"},
+            status=status.HTTP_400_BAD_REQUEST
         )
     
-    # Obtener el día de la semana (0=Lunes, 6=Domingo)
-    dia_semana = fecha.weekday()
-    
-    # Obtener horarios del doctor para ese día
-    horarios = Horario.objects.filter(
-        doctor=doctor,
-        dia_semana=dia_semana,
-        activo=True
-    )
-    
-    if not horarios:
-        return Response({"disponible": [], "mensaje": "El doctor no atiende este día"})
-    
-    # Obtener citas ya programadas para ese día
-    citas_ocupadas = Cita.objects.filter(
-        doctor=doctor,
-        fecha=fecha,
-        estado__in=['programada', 'confirmada', 'reprogramada']
-    ).values_list('hora_inicio', flat=True)
+    try:
+        limite = min(int(request.query_params.get('limite', TURNOS_PROXIMOS)), MAX_TURNOS_PROXIMOS)
+    except ValueError:
+        limite = 0
+    if limite < 1:
+        return Response(
+            {"error": "El parámetro 'limite' debe ser un entero positivo"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
     
-    # Generar horarios disponibles
-    disponibles = []
+    doctores = Doctor.objects.filter(especialidad_id=especialidad_id, activo=True).select_related('especialidad')
+    clinica_id = request.query_params.get('clinica')
+    if clinica_id:
+        doctores = doctores.filter(clinica_id=clinica_id)
+    doctores = {doctor.id: doctor for doctor in doctores.order_by('id')}
     
-    for horario in horarios:
-        hora_actual = horario.hora_inicio
-        while hora_actual < horario.hora_fin:
-            # Verificar si este horario ya está ocupado
-            if hora_actual not in citas_ocupadas:
-                hora_fin = (datetime.combine(fecha, hora_actual) + timedelta(minutes=30)).time()
-                disponibles.append({
-                    "hora_inicio": hora_actual.strftime('%H:%M'),
-                    "hora_fin": hora_fin.strftime('%H:%M')
-                })
-            
-            # Avanzar 30 minutos
-            hora_actual = (datetime.combine(fecha, hora_actual) + timedelta(minutes=30)).time()
+    disponibles = [
+        {
+            "doctor_id": doctor_id,
+            "doctor": str(doctores[doctor_id]),
+            "fecha": fecha.isoformat(),
+            **slot,
+        }
+        for fecha, doctor_id, slot in proximos_slots(list(doctores.values()), desde, hasta, limite)
+    ] if doctores else []
     
     return Response({
         "disponible": disponibles,
         "mensaje": f"{len(disponibles)} horarios disponibles"
     })
 
+@api_view(['POST'])
+@permission_classes([AllowAny])
+@throttle_classes([ReservaTemporalThrottle])
+def crear_reserva_temporal(request):
+    """
+    Retiene un turno para la conversación mientras el paciente completa sus
+    datos. La respuesta incluye `reserva_token`: hace falta para cambiar de
+    turno, liberarlo o convertirlo en cita con crear_cita_chatbot
+    """
+    for field in ['doctor_id', 'fecha', 'hora_inicio', 'chat_session_id']:
+        if not request.data.get(field):
+            return Response(
+                {"error": f"El campo '{field}' es requerido"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+    
+    try:
+        fecha = datetime.strptime(request.data['fecha'], '%Y-%m-%d').date()
+        hora_inicio = datetime.strptime(request.data['hora_inicio'], '%H:%M').time()
+    except ValueError:
+        return Response(
+            {"error": "Formato inválido. Use YYYY-MM-DD para la fecha y HH:MM para la hora"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    doctor = Doctor.objects.select_related('especialidad').filter(id=request.data['doctor_id'], activo=True).first()
+    if doctor is None:
+        return Response(
+            {"error": "Doctor no encontrado"},
+            status=status.HTTP_404_NOT_FOUND
+        )
+    
+    hora_fin = (datetime.combine(fecha, hora_inicio) + timedelta(seconds=duracion_doctor(doctor))).time()
+    try:
+        reserva = retener_turno(
+            doctor, fecha, hora_inicio, hora_fin, request.data['chat_session_id'],
+            token=request.data.get('reserva_token'), ip=ReservaTemporalThrottle().get_ident(request)
+        )
+    except (TurnoOcupado, ReservaAjena, LimiteReservas) as exc:
+        return Response(
+            {"error": exc.detail},
+            status=exc.status_code
+        )
+    
+    return Response({
+        "id": reserva.id,
+        "doctor_id": reserva.doctor_id,
+        "fecha": fecha.isoformat(),
+        "hora_inicio": hora_inicio.strftime('%H:%M'),
+        "hora_fin": hora_fin.strftime('%H:%M'),
+        "expira": reserva.expira.isoformat(),
+        "reserva_token": reserva.token,
+    }, status=status.HTTP_201_CREATED)
+
+@api_view(['DELETE'])
+@permission_classes([AllowAny])
+@throttle_classes([ReservaTemporalThrottle])
+def liberar_reserva_temporal(request, chat_session_id):
+    """
+    Libera el turno retenido por la conversación (por ejemplo, si el paciente
+    abandona la reserva). Requiere el token de la reserva en X-Reserva-Token;
+    sin él no se libera nada
+    """
+    liberar_turnos(chat_session_id, request.headers.get('X-Reserva-Token'))
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def crear_cita_chatbot(request):
@@ -117,7 +229,7 @@ def crear_cita_chatbot(request):
         
         # Obtener doctor
         try:
-            doctor = Doctor.objects.get(id=request.data['doctor_id'], activo=True)
+            doctor = Doctor.objects.select_related('especialidad').get(id=request.data['doctor_id'], activo=True)
         except Doctor.DoesNotExist:
             return Response(
                 {"error": "Doctor no encontrado"},
@@ -128,54 +240,61 @@ def crear_cita_chatbot(request):
         fecha = datetime.strptime(request.data['fecha'], '%Y-%m-%d').date()
         hora_inicio = datetime.strptime(request.data['hora_inicio'], '%H:%M').time()
         
-        # Calcular hora_fin (30 minutos después)
-        hora_fin = (datetime.combine(fecha, hora_inicio) + timedelta(minutes=30)).time()
+        # Calcular hora_fin con la duración de las citas del doctor
+        hora_fin = (datetime.combine(fecha, hora_inicio) + timedelta(seconds=duracion_doctor(doctor))).time()
         
-        # Verificar si la hora está disponible
-        if Cita.objects.filter(
-            doctor=doctor,
-            fecha=fecha,
-            hora_inicio=hora_inicio,
-            estado__in=['programada', 'confirmada', 'reprogramada']
-        ).exists():
+        try:
+            # Con la agenda del doctor bloqueada: dos reservas del mismo turno no pueden pasar ambas
+            with agenda_bloqueada(doctor.id):
+                chat_session_id = request.data.get('chat_session_id')
+                # La reserva de la conversación sólo cuenta como propia con su token
+                reserva_token = request.data.get('reserva_token')
+                propia = chat_session_id if reserva_propia(chat_session_id, reserva_token) else None
+                verificar_turno_libre(doctor.id, fecha, hora_inicio, hora_fin, chat_session_id=propia)
+                
+                # Buscar o crear paciente
+                paciente, created = Paciente.objects.get_or_create(
+                    email=request.data['email'],
+                    defaults={
+                        'nombre': request.data['nombre'],
+                        'apellidos': request.data['apellidos'],
+                        'telefono': request.data['telefono'],
+                        'fecha_nacimiento': request.data.get('fecha_nacimiento', '1900-01-01'),
+                        'genero': request.data.get('genero', 'O'),
+                        'clinica': doctor.clinica
+                    }
+                )
+                
+                # Si el paciente ya existía, actualizar sus datos
+                if not created:
+                    paciente.nombre = request.data['nombre']
+                    paciente.apellidos = request.data['apellidos']
+                    paciente.telefono = request.data['telefono']
+                    paciente.save()
+                
+                # Crear la cita
+                cita = Cita.objects.create(
+                    paciente=paciente,
+                    doctor=doctor,
+                    fecha=fecha,
+                    hora_inicio=hora_inicio,
+                    hora_fin=hora_fin,
+                    motivo=request.data['motivo'],
+                    notas=request.data.get('notas', ''),
+                    estado='programada',
+                    chat_session_id=chat_session_id
+                )
+                ocupar_turnos(cita, nueva=True)
+                
+                # La reserva temporal de la conversación pasa a ser la cita
+                if propia:
+                    liberar_turnos(propia, reserva_token)
+        except TurnoOcupado:
             return Response(
                 {"error": "La hora seleccionada ya no está disponible"},
                 status=status.HTTP_409_CONFLICT
             )
         
-        # Buscar o crear paciente
-        paciente, created = Paciente.objects.get_or_create(
-            email=request.data['email'],
-            defaults={
-                'nombre': request.data['nombre'],
-                'apellidos': request.data['apellidos'],
-                'telefono': request.data['telefono'],
-                'fecha_nacimiento': request.data.get('fecha_nacimiento', '1900-01-01'),
-                'genero': request.data.get('genero', 'O'),
-                'clinica': doctor.clinica
-            }
-        )
-        
-        # Si el paciente ya existía, actualizar sus datos
-        if not created:
-            paciente.nombre = request.data['nombre']
-            paciente.apellidos = request.data['apellidos']
-            paciente.telefono = request.data['telefono']
-            paciente.save()
-        
-        # Crear la cita
-        cita = Cita.objects.create(
-            paciente=paciente,
-            doctor=doctor,
-            fecha=fecha,
-            hora_inicio=hora_inicio,
-            hora_fin=hora_fin,
-            motivo=request.data['motivo'],
-            notas=request.data.get('notas', ''),
-            estado='programada',
-            chat_session_id=request.data.get('chat_session_id')
-        )
-        
         return Response({
             "success": True,
             "message": "Cita creada exitosamente",
@@ -1,3 +1,215 @@
-from django.test import TestCase
+import threading
+from datetime import time, timedelta
+from django.core.cache import cache
+from django.db import IntegrityError, connection, transaction
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from clinicas.models import Cita, Clinica, Doctor, Especialidad, Horario, ReservaTemporal
+from clinicas.tests import FECHA, ClinicaTestData
+
+
+class ProximosDisponiblesTests(ClinicaTestData):
+    def setUp(self):
+        super().setUp()
+        self.otro = self.crear_doctor('luis@clinica.pe')
+        # Ana atiende lunes por la tarde; Luis, miércoles por la mañana
+        Horario.objects.create(doctor=self.doctor, dia_semana=0, hora_inicio=time(15), hora_fin=time(16))
+        Horario.objects.create(doctor=self.otro, dia_semana=2, hora_inicio=time(9), hora_fin=time(10))
+
+    def proximos(self, **params):
+        params.setdefault('desde', FECHA.isoformat())
+        return self.client.get(f'/api/clinicas/public/proximos-disponibles/especialidad/{self.especialidad.id}/', params)
+
+    def test_returns_earliest_slots_across_doctors(self):
+        self.crear_cita(time(15), time(15, 30))
+
+        response = self.proximos(limite=3)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(d['fecha'], d['doctor_id'], d['hora_inicio']) for d in response.data['disponible']],
+            [('2030-01-07', self.doctor.id, '15:30'), ('2030-01-09', self.otro.id, '09:00'),
+             ('2030-01-09', self.otro.id, '09:30')]
+        )
+
+        response = self.proximos(limite=1, clinica=self.clinica.id + 1)
+        self.assertEqual(response.data['disponible'], [])
+        self.assertEqual(self.proximos(hasta='2029-12-31').status_code, 400)
+
+    def test_stops_loading_once_enough_slots_are_found(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.proximos(limite=2, hasta='2030-03-31')
+        self.assertEqual(len(response.data['disponible']), 2)
+        # Doctores, horarios y un solo lote de excepciones y citas
+        self.assertEqual(len(context.captured_queries), 4)
+
+
+class ConcurrentBookingTests(TransactionTestCase):
+    """Reservas simultáneas del mismo turno desde varios hilos (conexiones distintas)"""
+
+    def setUp(self):
+        cache.clear()
+        clinica = Clinica.objects.create(
+            nombre='Clínica Central', direccion='Av. Principal 123', telefono='999888777',
+            horario_apertura=time(8), horario_cierre=time(20), auth_module_id=1, auth_submodule_id=1,
+        )
+        especialidad = Especialidad.objects.create(nombre='Cardiología', clinica=clinica)
+        self.doctor = Doctor.objects.create(
+            nombre='Ana', apellidos='Rojas', email='ana@clinica.pe', especialidad=especialidad,
+            clinica=clinica, auth_user_id=1,
+        )
+
+    def reservar(self, paciente, hora_inicio):
+        return APIClient().post('/api/clinicas/public/crear-cita/', {
+            'doctor_id': self.doctor.id, 'fecha': FECHA.isoformat(), 'hora_inicio': hora_inicio,
+            'nombre': 'Paciente', 'apellidos': str(paciente), 'email': f'paciente{paciente}@example.com',
+            'telefono': '987654321', 'motivo': 'Control',
+        }, format='json')
+
+    def test_concurrent_bookings_never_double_book(self):
+        pacientes = 12
+        barrier = threading.Barrier(pacientes)
+        statuses = []
+
+        def reservar(paciente):
+            try:
+                barrier.wait()
+                # Dos turnos disputados por seis pacientes cada uno
+                statuses.append(self.reservar(paciente, '09:00' if paciente % 2 else '09:30').status_code)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=reservar, args=(i,)) for i in range(pacientes)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(statuses), [201] * 2 + [409] * (pacientes - 2))
+        self.assertEqual(
+            sorted(Cita.objects.values_list('hora_inicio', flat=True)), [time(9), time(9, 30)]
+        )
+
+    def test_constraint_rejects_a_second_active_cita(self):
+        self.assertEqual(self.reservar(1, '09:00').status_code, 201)
+        cita = Cita.objects.get()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Cita.objects.create(
+                paciente=cita.paciente, doctor=self.doctor, fecha=FECHA, hora_inicio=time(9),
+                hora_fin=time(9, 30), motivo='Duplicada'
+            )
+
+        # Una cita cancelada libera el turno
+        cita.estado = 'cancelada'
+        cita.save()
+        self.assertEqual(self.reservar(2, '09:00').status_code, 201)
+
+
+class ReservaTemporalTests(ClinicaTestData):
+    def setUp(self):
+        super().setUp()
+        Horario.objects.create(doctor=self.doctor, dia_semana=0, hora_inicio=time(9), hora_fin=time(10))
+        self.tokens = {}
+
+    def retener(self, chat_session_id, hora_inicio='09:00', **extra):
+        # Cada conversación presenta el token de su reserva anterior, si tiene
+        response = self.client.post('/api/clinicas/public/reservas-temporales/', {
+            'doctor_id': self.doctor.id, 'fecha': FECHA.isoformat(), 'hora_inicio': hora_inicio,
+            'chat_session_id': chat_session_id, 'reserva_token': self.tokens.get(chat_session_id, ''),
+        }, format='json', **extra)
+        if response.status_code == 201:
+            self.tokens[chat_session_id] = response.data['reserva_token']
+        return response
+
+    def reservar(self, chat_session_id, reserva_token=None):
+        return self.client.post('/api/clinicas/public/crear-cita/', {
+            'doctor_id': self.doctor.id, 'fecha': FECHA.isoformat(), 'hora_inicio': '09:00',
+            'nombre': 'Luis', 'apellidos': 'Quispe', 'email': 'luis@example.com',
+            'telefono': '987654321', 'motivo': 'Control', 'chat_session_id': chat_session_id,
+            'reserva_token': self.tokens.get(chat_session_id, '') if reserva_token is None else reserva_token,
+        }, format='json')
+
+    def liberar(self, chat_session_id, reserva_token):
+        return self.client.delete(
+            f'/api/clinicas/public/reservas-temporales/{chat_session_id}/', HTTP_X_RESERVA_TOKEN=reserva_token
+        )
+
+    def disponibles(self):
+        response = self.client.get(
+            f'/api/clinicas/public/horarios-disponibles/doctor/{self.doctor.id}/', {'fecha': FECHA.isoformat()}
+        )
+        return [slot['hora_inicio'] for slot in response.data['disponible']]
+
+    def test_held_slot_is_busy_for_others_until_converted(self):
+        self.assertEqual(self.disponibles(), ['09:00', '09:30'])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.retener('chat-1').status_code, 201)
+        self.assertEqual(self.disponibles(), ['09:30'])
+        self.assertEqual(self.retener('chat-2').status_code, 409)
+        self.assertEqual(self.reservar('chat-2').status_code, 409)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.reservar('chat-1').status_code, 201)
+        self.assertFalse(ReservaTemporal.objects.exists())
+        self.assertEqual(Cita.objects.get().chat_session_id, 'chat-1')
+        self.assertEqual(self.disponibles(), ['09:30'])
+
+    def test_expired_holds_free_the_slot(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.retener('chat-1')
+        self.assertEqual(self.disponibles(), ['09:30'])
+
+        ReservaTemporal.objects.update(expira=timezone.now() - timedelta(seconds=1))
+        # Como si hubiera pasado el tiempo: la entrada en caché vence con la reserva
+        cache.clear()
+        self.assertEqual(self.disponibles(), ['09:00', '09:30'])
+        self.assertEqual(self.retener('chat-2').status_code, 201)
+        self.assertEqual(ReservaTemporal.objects.get().chat_session_id, 'chat-2')
+
+    def test_session_keeps_a_single_hold(self):
+        self.retener('chat-1')
+        self.retener('chat-1', hora_inicio='09:30')
+        self.assertEqual(list(ReservaTemporal.objects.values_list('hora_inicio', flat=True)), [time(9, 30)])
+
+        self.assertEqual(self.liberar('chat-1', self.tokens['chat-1']).status_code, 204)
+        self.assertFalse(ReservaTemporal.objects.exists())
+
+    def test_session_id_alone_does_not_prove_ownership(self):
+        self.assertEqual(self.retener('chat-1').status_code, 201)
+        token = self.tokens.pop('chat-1')
+
+        # Quien sólo conoce el chat_session_id no puede cambiar, liberar ni usar la reserva
+        self.assertEqual(self.retener('chat-1', hora_inicio='09:30').status_code, 403)
+        self.assertEqual(self.liberar('chat-1', 'adivinado').status_code, 204)
+        self.assertEqual(self.reservar('chat-1', reserva_token='adivinado').status_code, 409)
+        self.assertEqual(list(ReservaTemporal.objects.values_list('hora_inicio', flat=True)), [time(9)])
+
+        self.assertEqual(self.liberar('chat-1', token).status_code, 204)
+        self.assertFalse(ReservaTemporal.objects.exists())
+
+    @override_settings(CLINICAS_MAX_HOLDS_PER_IP=1)
+    def test_holds_are_capped_per_ip(self):
+        self.assertEqual(self.retener('chat-1').status_code, 201)
+        self.assertEqual(self.retener('chat-2', hora_inicio='09:30').status_code, 429)
+        # La misma conversación puede cambiar de turno; otra IP, retener el libre
+        self.assertEqual(self.retener('chat-1', hora_inicio='09:30').status_code, 201)
+        self.assertEqual(self.retener('chat-2', REMOTE_ADDR='10.0.0.2').status_code, 201)
+
+    @override_settings(CLINICAS_HOLD_THROTTLE_RATE='2/min')
+    def test_hold_endpoints_are_throttled(self):
+        self.assertEqual(self.retener('chat-1').status_code, 201)
+        self.assertEqual(self.liberar('chat-1', self.tokens['chat-1']).status_code, 204)
+        self.assertEqual(self.retener('chat-1').status_code, 429)
+
+    def test_only_offered_slots_can_be_held(self):
+        # Fuera del horario y desalineado con los turnos
+        self.assertEqual(self.retener('chat-1', hora_inicio='11:00').status_code, 409)
+        self.assertEqual(self.retener('chat-1', hora_inicio='09:15').status_code, 409)
+        # Un lunes que ya pasó
+        response = self.client.post('/api/clinicas/public/reservas-temporales/', {
+            'doctor_id': self.doctor.id, 'fecha': '2020-01-06', 'hora_inicio': '09:00', 'chat_session_id': 'chat-1',
+        }, format='json')
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(ReservaTemporal.objects.exists())
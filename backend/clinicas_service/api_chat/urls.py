@@ -1,7 +1,8 @@
 from django.urls import path
 from .chat_endpoints import (
     get_especialidades, get_doctores_por_especialidad,
-    get_horarios_disponibles, crear_cita_chatbot
+    get_horarios_disponibles, get_proximos_disponibles, crear_cita_chatbot,
+    crear_reserva_temporal, liberar_reserva_temporal
 )
 
 urlpatterns = [
@@ -9,5 +10,8 @@ urlpatterns = [
     path('public/especialidades/', get_especialidades, name='get-especialidades'),
     path('public/doctores/especialidad/<int:especialidad_id>/', get_doctores_por_especialidad, name='get-doctores-por-especialidad'),
     path('public/horarios-disponibles/doctor/<int:doctor_id>/', get_horarios_disponibles, name='get-horarios-disponibles'),
+    path('public/proximos-disponibles/especialidad/<int:especialidad_id>/', get_proximos_disponibles, name='get-proximos-disponibles'),
+    path('public/reservas-temporales/', crear_reserva_temporal, name='crear-reserva-temporal'),
+    path('public/reservas-temporales/<str:chat_session_id>/', liberar_reserva_temporal, name='liberar-reserva-temporal'),
     path('public/crear-cita/', crear_cita_chatbot, name='crear-cita-chatbot'),
 ]
\ No newline at end of file
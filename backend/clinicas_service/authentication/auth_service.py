@@ -1,59 +1,346 @@
 import requests
-import os
+import hashlib
+import time
 import jwt
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from datetime import datetime
+from .cache import TTLCache, SingleFlight, AsyncSingleFlight
+from .transport import CircuitOpenError, decode_response, get_transport, get_async_transport, httpx
 
-class AuthServiceClient:
-    """Cliente para interactuar con el servicio de autenticación (auth_service)"""
-    
-    def __init__(self):
+# Marca para los tokens rechazados por auth_service (caché negativa)
+INVALID_TOKEN = 'invalid'
+# Marca para los usuarios que no existen en auth_service
+USER_NOT_FOUND = 'not_found'
+# Máximo de ids por llamada a /api/users/batch/
+USER_BATCH_SIZE = 100
+
+# Compartidas por todas las instancias del cliente en el proceso
+_introspection_cache = TTLCache(maxsize=getattr(settings, 'AUTH_INTROSPECTION_CACHE_SIZE', 10000))
+_introspection_flight = SingleFlight()
+_async_introspection_flight = AsyncSingleFlight()
+_user_cache = TTLCache(
+    maxsize=getattr(settings, 'AUTH_USER_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'AUTH_USER_CACHE_TTL', 10)
+)
+
+
+def token_cache_key(token):
+    """Clave de caché de un token: nunca se guarda el token en claro"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def resolve_access(permission_map, module_code, submodule_code=None):
+    """
+    Permisos efectivos sobre un módulo/submódulo según el mapa de permisos de
+    auth_service. Mismas reglas que verify-access: si no hay acceso directo al
+    submódulo se usa el acceso general al módulo. Retorna None si no hay acceso.
+    """
+    entry = permission_map.get(module_code)
+    if not entry:
+        return None
+
+    if submodule_code:
+        return entry['submodules'].get(submodule_code, entry['permissions'])
+    if entry['permissions'] is None and entry['submodules']:
+        return next(iter(entry['submodules'].values()))
+    return entry['permissions']
+
+
+class IntrospectionCacheMixin:
+    """Reglas de caché de introspección compartidas por los clientes síncrono y asíncrono"""
+
+    def _load_settings(self):
         self.base_url = settings.AUTH_SERVICE_URL
         self.service_token = settings.AUTH_SERVICE_TOKEN
-    
+        self.cache_ttl = getattr(settings, 'AUTH_INTROSPECTION_CACHE_TTL', 30)
+        self.negative_cache_ttl = getattr(settings, 'AUTH_INTROSPECTION_NEGATIVE_TTL', 5)
+        self.stale_ttl = getattr(settings, 'AUTH_INTROSPECTION_STALE_TTL', 300)
+
+    def _seconds_to_expiry(self, token):
+        try:
+            exp = jwt.decode(token, options={'verify_signature': False}).get('exp')
+        except jwt.InvalidTokenError:
+            return 0
+        return None if exp is None else exp - time.time()
+
+    def _cached_introspection(self, key):
+        """Retorna (encontrado, datos) según la caché"""
+        cached = _introspection_cache.get(key)
+        if cached is None:
+            return False, None
+        return True, None if cached == INVALID_TOKEN else cached
+
+    def _store_introspection(self, key, token, response):
+        """
+        Guarda en caché la respuesta de auth_service y retorna los datos. Si
+        auth_service no respondió (response None) o falló (5xx) se sirve el
+        último resultado conocido mientras el token no haya expirado.
+        """
+        if response is None or response.status_code >= 500:
+            stale = _introspection_cache.get(key, allow_stale=True)
+            return None if stale in (None, INVALID_TOKEN) else stale
+
+        if response.status_code == 200:
+            data = decode_response(response)
+            remaining = self._seconds_to_expiry(token)
+            ttl, stale_ttl = self.cache_ttl, self.stale_ttl
+            if remaining is not None:
+                ttl, stale_ttl = min(ttl, remaining), min(stale_ttl, remaining)
+            _introspection_cache.set(key, data, ttl=ttl, stale_ttl=stale_ttl)
+            return data
+
+        if response.status_code in (401, 403):
+            _introspection_cache.set(key, INVALID_TOKEN, ttl=self.negative_cache_ttl)
+        return None
+
+    @staticmethod
+    def _cached_users(user_ids):
+        """Retorna ({id: datos} en caché, ids a consultar)"""
+        users, missing = {}, []
+        for user_id in set(user_ids):
+            cached = _user_cache.get(user_id)
+            if cached is None:
+                missing.append(user_id)
+            elif cached != USER_NOT_FOUND:
+                users[user_id] = cached
+        return users, sorted(missing)
+
+    @staticmethod
+    def _store_users(users, requested_ids, results):
+        found = {user['id']: user for user in results}
+        for user_id in requested_ids:
+            _user_cache.set(user_id, found.get(user_id, USER_NOT_FOUND))
+        users.update(found)
+
+    @staticmethod
+    def _batches(user_ids):
+        for start in range(0, len(user_ids), USER_BATCH_SIZE):
+            yield user_ids[start:start + USER_BATCH_SIZE]
+
+    def forget(self, token):
+        """Descarta la introspección en caché de un token (p. ej. posiblemente revocado)"""
+        _introspection_cache.delete(token_cache_key(token))
+
+    @staticmethod
+    def _module_access(data, module_code, submodule_code=None):
+        if not data:
+            return {"has_access": False, "error": "Token inválido o error de comunicación con auth_service"}
+
+        permissions = resolve_access(data['permissions'], module_code, submodule_code)
+        if permissions is None:
+            return {"has_access": False}
+        return {"has_access": True, "permissions": permissions}
+
+
+class AuthServiceClient(IntrospectionCacheMixin):
+    """Cliente para interactuar con el servicio de autenticación (auth_service)"""
+
+    def __init__(self):
+        self._load_settings()
+
+    @property
+    def transport(self):
+        return get_transport()
+
+    def introspect(self, token):
+        """
+        Obtiene el usuario y su mapa completo de permisos en una sola llamada.
+        Los resultados se guardan en caché por hash del token (también los
+        tokens rechazados) y las peticiones concurrentes con el mismo token
+        comparten una única consulta a auth_service. Si auth_service no está
+        disponible se sirve el último resultado conocido mientras el token no
+        haya expirado.
+        """
+        key = token_cache_key(token)
+        found, data = self._cached_introspection(key)
+        if found:
+            return data
+
+        return _introspection_flight.do(key, lambda: self._fetch_introspection(key, token))
+
+    def _fetch_introspection(self, key, token):
+        # Otra petición pudo completar la consulta mientras se esperaba turno
+        found, data = self._cached_introspection(key)
+        if found:
+            return data
+
+        try:
+            headers = {'Authorization': f'Bearer {token}'}
+            response = self.transport.get("/api/introspect/", headers=headers)
+        except requests.RequestException as e:
+            print(f"Error consultando auth_service: {str(e)}")
+            response = None
+
+        return self._store_introspection(key, token, response)
+
     def verify_token(self, token):
         """Verifica si un token de usuario es válido"""
+        data = self.introspect(token)
+        return data['user'] if data else None
+
+    def verify_module_access(self, token, module_code, submodule_code=None):
+        """Verifica si un usuario tiene acceso a un módulo/submódulo específico"""
+        return self._module_access(self.introspect(token), module_code, submodule_code)
+
+    def get_user_info(self, user_id):
+        """Obtiene información detallada de un usuario"""
+        return self.get_users([user_id]).get(user_id)
+
+    def get_users(self, user_ids):
+        """
+        Información de varios usuarios ({id: datos}; los inexistentes se
+        omiten). Se sirve de una caché de pocos segundos y lo que falta se
+        pide a auth_service en lotes, no con una llamada por usuario.
+        """
+        users, missing = self._cached_users(user_ids)
+        headers = {'Authorization': f'Bearer {self.service_token}'}
+        for batch in self._batches(missing):
+            try:
+                response = self.transport.get(
+                    "/api/users/batch/",
+                    params={'ids': ','.join(map(str, batch))},
+                    headers=headers
+                )
+                if response.status_code == 200:
+                    self._store_users(users, batch, decode_response(response)['results'])
+            except Exception as e:
+                print(f"Error obteniendo información de usuarios: {str(e)}")
+        return users
+
+    def get_permission_versions(self, since=None):
+        """Versiones de permisos de los usuarios modificados desde `since` (timestamp UNIX)"""
         try:
-            headers = {'Authorization': f'Bearer {token}'}
-            response = requests.get(f"{self.base_url}/api/auth/verify-token/", headers=headers)
+            headers = {'Authorization': f'Bearer {self.service_token}'}
+            params = {'since': since} if since is not None else {}
+            response = self.transport.get(
+                "/api/permissions-versions/", params=params, headers=headers
+            )
+
             if response.status_code == 200:
-                return response.json()
+                return decode_response(response)
             return None
         except Exception as e:
-            print(f"Error verificando token: {str(e)}")
+            print(f"Error obteniendo versiones de permisos: {str(e)}")
             return None
-    
-    def verify_module_access(self, token, module_code, submodule_code=None):
-        """Verifica si un usuario tiene acceso a un módulo/submódulo específico"""
+
+    def get_changes(self, after=0, limit=None):
+        """Página del feed de cambios de usuarios posterior al cursor `after`"""
         try:
-            headers = {'Authorization': f'Bearer {token}'}
-            data = {
-                'module_code': module_code,
-                'submodule_code': submodule_code
-            }
-            
-            response = requests.post(
-                f"{self.base_url}/api/auth/verify-access/",
-                json=data,
-                headers=headers
-            )
-            
+            headers = {'Authorization': f'Bearer {self.service_token}'}
+            params = {'after': after}
+            if limit is not None:
+                params['limit'] = limit
+            response = self.transport.get("/api/changes/", params=params, headers=headers)
+
             if response.status_code == 200:
-                return response.json()
-            return {"has_access": False, "error": "Error de comunicación con auth_service"}
+                return decode_response(response)
+            return None
         except Exception as e:
-            print(f"Error verificando acceso a módulo: {str(e)}")
-            return {"has_access": False, "error": str(e)}
-    
-    def get_user_info(self, user_id):
-        """Obtiene información detallada de un usuario"""
+            print(f"Error obteniendo el feed de cambios: {str(e)}")
+            return None
+
+    def get_revocations(self, since=None):
+        """Lista de revocación completa o cambios desde la secuencia `since`"""
         try:
             headers = {'Authorization': f'Bearer {self.service_token}'}
-            response = requests.get(f"{self.base_url}/api/auth/users/{user_id}/", headers=headers)
-            
+            params = {'since': since} if since is not None else {}
+            response = self.transport.get("/api/revocations/", params=params, headers=headers)
+
             if response.status_code == 200:
-                return response.json()
+                return decode_response(response)
             return None
         except Exception as e:
-            print(f"Error obteniendo información de usuario: {str(e)}")
-            return None
\ No newline at end of file
+            print(f"Error obteniendo la lista de revocación: {str(e)}")
+            return None
+
+
+class AsyncAuthServiceClient(IntrospectionCacheMixin):
+    """
+    Cliente asíncrono de auth_service para despliegues ASGI. Comparte caché y
+    circuit breaker con AuthServiceClient. Sin httpx instalado delega en el
+    cliente síncrono ejecutándolo fuera del event loop.
+    """
+
+    def __init__(self):
+        self._load_settings()
+        self._sync_client = None if httpx else AuthServiceClient()
+
+    async def introspect(self, token):
+        """Igual que AuthServiceClient.introspect, sin bloquear el event loop"""
+        if self._sync_client:
+            return await sync_to_async(self._sync_client.introspect, thread_sensitive=False)(token)
+
+        key = token_cache_key(token)
+        found, data = self._cached_introspection(key)
+        if found:
+            return data
+
+        return await _async_introspection_flight.do(key, lambda: self._fetch_introspection(key, token))
+
+    async def _fetch_introspection(self, key, token):
+        found, data = self._cached_introspection(key)
+        if found:
+            return data
+
+        try:
+            headers = {'Authorization': f'Bearer {token}'}
+            response = await get_async_transport().get("/api/introspect/", headers=headers)
+        except (httpx.HTTPError, CircuitOpenError) as e:
+            print(f"Error consultando auth_service: {str(e)}")
+            response = None
+
+        return self._store_introspection(key, token, response)
+
+    async def verify_token(self, token):
+        """Verifica si un token de usuario es válido"""
+        data = await self.introspect(token)
+        return data['user'] if data else None
+
+    async def verify_module_access(self, token, module_code, submodule_code=None):
+        """Verifica si un usuario tiene acceso a un módulo/submódulo específico"""
+        return self._module_access(await self.introspect(token), module_code, submodule_code)
+
+    async def _get_json(self, path, params=None):
+        try:
+            headers = {'Authorization': f'Bearer {self.service_token}'}
+            response = await get_async_transport().get(path, params=params, headers=headers)
+            if response.status_code == 200:
+                return decode_response(response)
+            return None
+        except (httpx.HTTPError, CircuitOpenError) as e:
+            print(f"Error consultando auth_service: {str(e)}")
+            return None
+
+    async def get_user_info(self, user_id):
+        """Obtiene información detallada de un usuario"""
+        return (await self.get_users([user_id])).get(user_id)
+
+    async def get_users(self, user_ids):
+        """Igual que AuthServiceClient.get_users, sin bloquear el event loop"""
+        if self._sync_client:
+            return await sync_to_async(self._sync_client.get_users, thread_sensitive=False)(user_ids)
+
+        users, missing = self._cached_users(user_ids)
+        for batch in self._batches(missing):
+            data = await self._get_json("/api/users/batch/", params={'ids': ','.join(map(str, batch))})
+            if data is not None:
+                self._store_users(users, batch, data['results'])
+        return users
+
+    async def get_permission_versions(self, since=None):
+        """Versiones de permisos de los usuarios modificados desde `since` (timestamp UNIX)"""
+        if self._sync_client:
+            return await sync_to_async(
+                self._sync_client.get_permission_versions, thread_sensitive=False
+            )(since)
+        return await self._get_json(
+            "/api/permissions-versions/", params={'since': since} if since is not None else None
+        )
+
+    async def get_revocations(self, since=None):
+        """Lista de revocación completa o cambios desde la secuencia `since`"""
+        if self._sync_client:
+            return await sync_to_async(self._sync_client.get_revocations, thread_sensitive=False)(since)
+        return await self._get_json(
+            "/api/revocations/", params={'since': since} if since is not None else None
+        )
@@ -0,0 +1,128 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    Caché en memoria, acotada (LRU) y con expiración por entrada. Segura entre
+    hilos. Una entrada expirada puede conservarse hasta `stale_ttl` para
+    servirla como último recurso cuando el origen no está disponible.
+    """
+
+    def __init__(self, maxsize=10000, ttl=30):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None, allow_stale=False):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at, stale_until = item
+            now = time.monotonic()
+            if stale_until <= now:
+                del self._data[key]
+                return default
+            if expires_at <= now and not allow_stale:
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None, stale_ttl=None):
+        ttl = self.ttl if ttl is None else ttl
+        stale_ttl = ttl if stale_ttl is None else max(ttl, stale_ttl)
+        if stale_ttl <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._data[key] = (value, now + ttl, now + stale_ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SingleFlight:
+    """
+    Agrupa llamadas concurrentes con la misma clave: sólo la primera ejecuta
+    la función y las demás esperan y reciben su mismo resultado.
+    """
+
+    class _Call:
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+
+class AsyncSingleFlight:
+    """Versión asíncrona de SingleFlight: las corrutinas con la misma clave esperan un único resultado"""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, fn):
+        loop = asyncio.get_running_loop()
+        future = self._calls.get(key)
+        if future is not None and future.get_loop() is loop:
+            return await asyncio.shield(future)
+
+        future = self._calls[key] = loop.create_future()
+        try:
+            result = await fn()
+        except BaseException as e:
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                # Evita el aviso de excepción no recuperada si nadie esperaba
+                future.exception()
+            else:
+                future.cancel()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._calls.get(key) is future:
+                del self._calls[key]
@@ -0,0 +1,142 @@
+import threading
+import time
+from django.conf import settings
+
+PERMISSIONS_CLAIM = 'perms'
+PERMISSIONS_VERSION_CLAIM = 'pv'
+PERMISSION_FIELDS = ('can_view', 'can_create', 'can_edit', 'can_delete')
+
+
+def decode_permission_claims(claims):
+    """
+    Reconstruye el mapa de permisos de auth_service a partir de la codificación
+    compacta del token ("module_code:submodule_code:bits").
+    """
+    permission_map = {}
+    for claim in claims:
+        module_code, submodule_code, bits = claim.split(':')
+        permissions = {
+            field: bool(int(bits) & (1 << i)) for i, field in enumerate(PERMISSION_FIELDS)
+        }
+        entry = permission_map.setdefault(module_code, {'permissions': None, 'submodules': {}})
+        if submodule_code:
+            entry['submodules'][submodule_code] = permissions
+        else:
+            entry['permissions'] = permissions
+    return permission_map
+
+
+class PolledReplica:
+    """
+    Réplica local de un estado de auth_service que se sincroniza
+    periódicamente. Sólo un hilo sincroniza a la vez; los demás siguen usando
+    la réplica actual. Las subclases implementan _fetch/_afetch y _apply.
+    """
+
+    def __init__(self, auth_client, async_auth_client, poll_interval, max_staleness):
+        self.auth_client = auth_client
+        self.async_auth_client = async_auth_client
+        self.poll_interval = poll_interval
+        # Pasado este tiempo sin sincronizar no se confía en la réplica
+        self.max_staleness = max_staleness
+        self._synced_at = None
+        self._last_attempt = None
+        self._lock = threading.Lock()
+
+    def _begin_refresh(self):
+        """True si toca sincronizar y este llamador se encarga (debe llamar a _end_refresh)"""
+        def due():
+            return self._last_attempt is None or now - self._last_attempt >= self.poll_interval
+
+        now = time.monotonic()
+        if not due() or not self._lock.acquire(blocking=False):
+            return False
+        if not due():
+            self._lock.release()
+            return False
+        self._last_attempt = now
+        return True
+
+    def _end_refresh(self, data):
+        try:
+            if data is None:
+                return
+            self._apply(data)
+            self._synced_at = self._last_attempt
+        finally:
+            self._lock.release()
+
+    def _is_fresh(self):
+        return self._synced_at is not None and time.monotonic() - self._synced_at <= self.max_staleness
+
+    def _sync(self):
+        if self._begin_refresh():
+            data = None
+            try:
+                data = self._fetch()
+            finally:
+                self._end_refresh(data)
+
+    async def _async_sync(self):
+        if self._begin_refresh():
+            data = None
+            try:
+                data = await self._afetch()
+            finally:
+                self._end_refresh(data)
+
+
+class PermissionVersionRegistry(PolledReplica):
+    """
+    Réplica local de la versión de permisos de cada usuario, actualizada
+    periódicamente desde auth_service. Permite decidir si los permisos incluidos
+    en un token siguen vigentes sin consultar a auth_service en cada petición.
+    """
+
+    def __init__(self, auth_client, async_auth_client=None):
+        super().__init__(
+            auth_client, async_auth_client,
+            poll_interval=getattr(settings, 'AUTH_PERMISSIONS_POLL_INTERVAL', 15),
+            max_staleness=getattr(settings, 'AUTH_PERMISSIONS_MAX_STALENESS', 120),
+        )
+        self._versions = {}
+        self._since = None
+
+    def _fetch(self):
+        return self.auth_client.get_permission_versions(self._since)
+
+    async def _afetch(self):
+        return await self.async_auth_client.get_permission_versions(self._since)
+
+    def _apply(self, data):
+        for user_id, version in data['versions'].items():
+            self._versions[int(user_id)] = version
+        # Margen para cambios confirmados mientras se respondía la consulta
+        self._since = data['server_time'] - self.poll_interval
+
+    def _check(self, claims):
+        if not self._is_fresh():
+            return False
+
+        current = self._versions.get(int(claims['user_id']), 0)
+        return claims[PERMISSIONS_VERSION_CLAIM] >= current
+
+    @staticmethod
+    def _has_permission_claims(claims):
+        return PERMISSIONS_CLAIM in claims and PERMISSIONS_VERSION_CLAIM in claims
+
+    def is_current(self, claims):
+        """True si el token trae permisos y su versión es la vigente"""
+        if not self._has_permission_claims(claims):
+            return False
+
+        self._sync()
+        return self._check(claims)
+
+    async def ais_current(self, claims):
+        """Versión asíncrona de is_current"""
+        if not self._has_permission_claims(claims):
+            return False
+
+        await self._async_sync()
+        return self._check(claims)
@@ -0,0 +1,92 @@
+import time
+import jwt
+import requests
+from django.conf import settings
+from .transport import decode_response, get_transport
+
+
+class LocalVerificationUnavailable(Exception):
+    """El token no puede verificarse localmente y debe consultarse a auth_service"""
+
+
+class LocalTokenVerifier:
+    """Verifica localmente la firma y expiración de los access tokens de auth_service"""
+
+    # Segundos de espera antes de reintentar la descarga de la clave pública
+    KEY_RETRY_INTERVAL = 60
+
+    def __init__(self):
+        self.enabled = getattr(settings, 'AUTH_JWT_LOCAL_VERIFICATION', True)
+        self.algorithm = getattr(settings, 'AUTH_JWT_ALGORITHM', 'HS256')
+        self.verifying_key = getattr(settings, 'AUTH_JWT_VERIFYING_KEY', '') or None
+        self._last_key_attempt = None
+
+    @property
+    def is_asymmetric(self):
+        return not self.algorithm.startswith('HS')
+
+    def _get_key(self):
+        """Retorna la clave de verificación, descargándola de auth_service si es pública"""
+        if self.verifying_key:
+            return self.verifying_key
+
+        # Una clave compartida nunca se publica: debe venir de la configuración
+        if not self.is_asymmetric:
+            raise LocalVerificationUnavailable("No hay clave compartida configurada")
+
+        now = time.monotonic()
+        if self._last_key_attempt and now - self._last_key_attempt < self.KEY_RETRY_INTERVAL:
+            raise LocalVerificationUnavailable("Clave pública no disponible")
+        self._last_key_attempt = now
+
+        try:
+            response = get_transport().get("/api/token/public-key/")
+            data = decode_response(response) if response.status_code == 200 else {}
+        except (requests.RequestException, ValueError) as e:
+            raise LocalVerificationUnavailable(f"Error descargando la clave pública: {e}")
+
+        if data.get('algorithm') != self.algorithm or not data.get('verifying_key'):
+            raise LocalVerificationUnavailable("auth_service no publica una clave compatible")
+
+        self.verifying_key = data['verifying_key']
+        return self.verifying_key
+
+    def verify(self, token):
+        """
+        Retorna los claims del token si es un access token válido y None si es
+        inválido o ha expirado. Lanza LocalVerificationUnavailable cuando no es
+        posible decidir sin consultar a auth_service (sin clave, algoritmo
+        distinto o firma que no coincide, p. ej. tras una rotación de claves).
+        """
+        if not self.enabled:
+            raise LocalVerificationUnavailable("Verificación local desactivada")
+
+        key = self._get_key()
+
+        try:
+            claims = jwt.decode(
+                token,
+                key,
+                algorithms=[self.algorithm],
+                options={'require': ['exp', 'user_id', 'token_type']}
+            )
+        except jwt.ExpiredSignatureError:
+            return None
+        except (jwt.InvalidSignatureError, jwt.InvalidAlgorithmError,
+                jwt.InvalidKeyError) as e:
+            raise LocalVerificationUnavailable(str(e))
+        except jwt.InvalidTokenError:
+            return None
+
+        if claims['token_type'] != 'access':
+            return None
+
+        return claims
+
+    @staticmethod
+    def user_data_from_claims(claims):
+        """Datos del usuario equivalentes a los que devuelve auth_service"""
+        return {
+            'id': int(claims['user_id']),
+            'jti': claims.get('jti'),
+        }
@@ -0,0 +1,43 @@
+from .auth_service import AuthServiceClient
+
+
+class UserLoader:
+    """
+    Agrupa las búsquedas de usuarios de auth_service hechas durante una
+    petición (al estilo de un DataLoader): los ids se acumulan con prime() y
+    el primer load() los pide todos juntos en una sola llamada batch.
+    """
+
+    def __init__(self, auth_client):
+        self.auth_client = auth_client
+        self._pending = set()
+        self._loaded = {}
+
+    def prime(self, user_ids):
+        """Anota ids que se van a necesitar, sin consultar todavía"""
+        self._pending.update(
+            user_id for user_id in user_ids if user_id is not None and user_id not in self._loaded
+        )
+
+    def load(self, user_id):
+        """Datos del usuario o None si no existe; consulta los pendientes si hace falta"""
+        if user_id is None:
+            return None
+        if user_id not in self._loaded:
+            self._pending.add(user_id)
+            self._dispatch()
+        return self._loaded.get(user_id)
+
+    def _dispatch(self):
+        user_ids, self._pending = self._pending, set()
+        users = self.auth_client.get_users(user_ids)
+        for user_id in user_ids:
+            self._loaded[user_id] = users.get(user_id)
+
+
+def get_user_loader(request):
+    """UserLoader de la petición, creado al primer uso"""
+    loader = getattr(request, 'user_loader', None)
+    if loader is None:
+        loader = request.user_loader = UserLoader(AuthServiceClient())
+    return loader
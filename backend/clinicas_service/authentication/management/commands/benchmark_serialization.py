@@ -0,0 +1,72 @@
+import json
+import time
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.test import APIRequestFactory
+from rest_framework.utils.encoders import JSONEncoder
+from authentication.renderers import MessagePackRenderer, msgpack
+from authentication.transport import get_transport
+from clinicas.views import DoctorViewSet
+
+
+def _doctor_list():
+    """Respuesta real del listado de doctores, obtenida a través de DoctorViewSet"""
+    response = DoctorViewSet.as_view({'get': 'list'})(APIRequestFactory().get('/api/doctores/'))
+    return response.data
+
+
+def _verify_access(token, module_code):
+    """Respuesta real de verify-access de auth_service, pedida en JSON"""
+    try:
+        response = get_transport().post(
+            '/api/verify-access/',
+            json={'module_code': module_code},
+            headers={'Authorization': f'Bearer {token}', 'Accept': 'application/json'},
+        )
+    except requests.RequestException as exc:
+        raise CommandError(f'auth_service no disponible: {exc}')
+    if response.status_code != 200:
+        raise CommandError(f'verify-access respondió {response.status_code}')
+    return response.json()
+
+
+def _timed(fn, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        result = fn()
+    return result, (time.perf_counter() - start) / iterations * 1000
+
+
+class Command(BaseCommand):
+    help = 'Compara tamaño y tiempo de codificación de JSON y MessagePack en respuestas entre servicios'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=200, help='Repeticiones por medición')
+        parser.add_argument('--token', help='Access token para medir también verify-access de auth_service')
+        parser.add_argument('--module', default='clinicas_service', help='Módulo consultado en verify-access')
+
+    def handle(self, *args, **options):
+        if msgpack is None:
+            raise CommandError('msgpack no está instalado')
+
+        payloads = {'doctores': _doctor_list()}
+        if options['token']:
+            payloads['verify-access'] = _verify_access(options['token'], options['module'])
+        else:
+            self.stdout.write('Sin --token: se omite verify-access')
+
+        iterations = options['iterations']
+        renderer = MessagePackRenderer()
+        self.stdout.write(f"{'respuesta':<15}{'formato':<12}{'bytes':>10}{'codificar ms':>15}{'decodificar ms':>17}")
+        for name, payload in payloads.items():
+            json_body, json_encode = _timed(lambda: json.dumps(payload, cls=JSONEncoder).encode(), iterations)
+            _, json_decode = _timed(lambda: json.loads(json_body), iterations)
+            msgpack_body, msgpack_encode = _timed(lambda: renderer.render(payload), iterations)
+            _, msgpack_decode = _timed(lambda: msgpack.unpackb(msgpack_body, raw=False), iterations)
+
+            self.stdout.write(
+                f"{name:<15}{'json':<12}{len(json_body):>10}{json_encode:>15.3f}{json_decode:>17.3f}"
+            )
+            self.stdout.write(
+                f"{name:<15}{'msgpack':<12}{len(msgpack_body):>10}{msgpack_encode:>15.3f}{msgpack_decode:>17.3f}"
+            )
@@ -0,0 +1,27 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from authentication.auth_service import AuthServiceClient
+from authentication.replica import SyncError, sync_auth_users
+
+
+class Command(BaseCommand):
+    help = 'Sincroniza la réplica local de usuarios con el feed de cambios de auth_service'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--follow', action='store_true', help='Seguir sincronizando periódicamente')
+        parser.add_argument('--interval', type=float, default=5, help='Segundos entre sincronizaciones con --follow')
+
+    def handle(self, *args, **options):
+        auth_client = AuthServiceClient()
+        while True:
+            try:
+                applied = sync_auth_users(auth_client)
+                self.stdout.write(f'{applied} usuarios sincronizados')
+            except SyncError as e:
+                if not options['follow']:
+                    raise CommandError(str(e))
+                self.stderr.write(str(e))
+
+            if not options['follow']:
+                return
+            time.sleep(options['interval'])
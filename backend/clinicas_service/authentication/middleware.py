@@ -1,11 +1,27 @@
+import asyncio
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.http import JsonResponse
-from .auth_service import AuthServiceClient
+from .auth_service import AuthServiceClient, AsyncAuthServiceClient, resolve_access
+from .claims import PermissionVersionRegistry, decode_permission_claims, PERMISSIONS_CLAIM
+from .jwt_verifier import LocalTokenVerifier, LocalVerificationUnavailable
+from .revocation import RevocationList, REVOKED, SUSPECTED, UNKNOWN
 
 class AuthMiddleware:
+    # Funciona tanto en WSGI como en ASGI; en ASGI no ocupa un hilo por petición
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
         self.auth_client = AuthServiceClient()
-        
+        self.async_auth_client = AsyncAuthServiceClient()
+        self.token_verifier = LocalTokenVerifier()
+        self.permission_versions = PermissionVersionRegistry(self.auth_client, self.async_auth_client)
+        self.revocations = RevocationList(self.auth_client, self.async_auth_client)
+
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
         # Rutas que no requieren autenticación
         self.public_paths = [
             '/api/docs',
@@ -13,37 +29,130 @@ class AuthMiddleware:
             '/admin',
             '/api/clinicas/public'
         ]
-    
+
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
         # Verificar si es una ruta pública
-        if any(request.path_info.startswith(path) for path in self.public_paths):
+        if self._is_public(request):
             return self.get_response(request)
-        
-        # Verificar si hay un token de autenticación
+
+        token, error_response = self._get_token(request)
+        if error_response:
+            return error_response
+
+        # Verificar el token localmente; sólo se consulta a auth_service
+        # cuando no es posible decidir con la clave disponible
+        claims = self._verify_locally(token)
+        if claims:
+            claims = self._apply_revocation(token, claims, self.revocations.check(claims))
+        if claims is None:
+            user_data = self.auth_client.verify_token(token)
+        else:
+            user_data = self.token_verifier.user_data_from_claims(claims) if claims else None
+        if not user_data:
+            return self._invalid_token_response()
+
+        # Verificar acceso al módulo clinicas_service con los permisos del token
+        # si siguen vigentes; si no, se consultan a auth_service
+        if claims and self.permission_versions.is_current(claims):
+            access_data = self._access_from_claims(claims)
+        else:
+            access_data = self.auth_client.verify_module_access(token, 'clinicas_service')
+
+        error_response = self._attach_user(request, user_data, access_data)
+        if error_response:
+            return error_response
+
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        if self._is_public(request):
+            return await self.get_response(request)
+
+        token, error_response = self._get_token(request)
+        if error_response:
+            return error_response
+
+        claims = self._verify_locally(token)
+        if claims:
+            claims = self._apply_revocation(token, claims, await self.revocations.acheck(claims))
+        if claims is None:
+            # Sin verificación local: token y acceso al módulo se resuelven a la
+            # vez (ambos comparten una única introspección en auth_service)
+            user_data, access_data = await asyncio.gather(
+                self.async_auth_client.verify_token(token),
+                self.async_auth_client.verify_module_access(token, 'clinicas_service'),
+            )
+        else:
+            user_data = self.token_verifier.user_data_from_claims(claims) if claims else None
+            access_data = None
+        if not user_data:
+            return self._invalid_token_response()
+
+        if access_data is None:
+            if await self.permission_versions.ais_current(claims):
+                access_data = self._access_from_claims(claims)
+            else:
+                access_data = await self.async_auth_client.verify_module_access(token, 'clinicas_service')
+
+        error_response = self._attach_user(request, user_data, access_data)
+        if error_response:
+            return error_response
+
+        return await self.get_response(request)
+
+    def _is_public(self, request):
+        return any(request.path_info.startswith(path) for path in self.public_paths)
+
+    def _get_token(self, request):
+        """Retorna (token, None) o (None, respuesta de error)"""
         auth_header = request.headers.get('Authorization', '')
         if not auth_header.startswith('Bearer '):
-            return JsonResponse({
+            return None, JsonResponse({
                 'error': 'No se proporcionó un token de autenticación válido'
             }, status=401)
-        
-        token = auth_header.replace('Bearer ', '')
-        
-        # Verificar el token con auth_service
-        user_data = self.auth_client.verify_token(token)
-        if not user_data:
-            return JsonResponse({
-                'error': 'Token inválido o expirado'
-            }, status=401)
-        
-        # Verificar acceso al módulo clinicas_service
-        access_data = self.auth_client.verify_module_access(token, 'clinicas_service')
+
+        return auth_header.replace('Bearer ', ''), None
+
+    def _verify_locally(self, token):
+        """Claims del token, False si es inválido o None si debe verificarlo auth_service"""
+        try:
+            return self.token_verifier.verify(token) or False
+        except LocalVerificationUnavailable:
+            return None
+
+    def _apply_revocation(self, token, claims, state):
+        """Claims si el token no está revocado, False si lo está o None si debe decidirlo auth_service"""
+        if state == REVOKED:
+            return False
+        if state == SUSPECTED:
+            # Posible falso positivo del filtro: auth_service decide, sin usar
+            # una introspección en caché anterior a la revocación
+            self.auth_client.forget(token)
+            return None
+        if state == UNKNOWN:
+            return None
+        return claims
+
+    def _invalid_token_response(self):
+        return JsonResponse({
+            'error': 'Token inválido o expirado'
+        }, status=401)
+
+    def _access_from_claims(self, claims):
+        permissions = resolve_access(
+            decode_permission_claims(claims[PERMISSIONS_CLAIM]), 'clinicas_service'
+        )
+        return {'has_access': permissions is not None, 'permissions': permissions}
+
+    def _attach_user(self, request, user_data, access_data):
         if not access_data.get('has_access', False):
             return JsonResponse({
                 'error': 'No tienes acceso al módulo de clínicas'
             }, status=403)
-        
+
         # Agregar los datos del usuario a la solicitud
         request.user_data = user_data
         request.user_permissions = access_data.get('permissions', {})
-        
-        return self.get_response(request)
\ No newline at end of file
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AuthUserReplica',
+            fields=[
+                ('id', models.BigIntegerField(help_text='ID del usuario en auth_service', primary_key=True, serialize=False)),
+                ('email', models.EmailField(db_index=True, max_length=254)),
+                ('first_name', models.CharField(blank=True, default='', max_length=150)),
+                ('last_name', models.CharField(blank=True, default='', max_length=150)),
+                ('is_active', models.BooleanField(default=True)),
+                ('modules', models.JSONField(default=list)),
+                ('has_module_access', models.BooleanField(default=False, help_text='Acceso al módulo clinicas_service')),
+                ('synced_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SyncCursor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('position', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,32 @@
+from django.db import models
+
+
+class AuthUserReplica(models.Model):
+    """
+    Copia local de los usuarios de auth_service (Doctor.auth_user_id,
+    Paciente.auth_user_id), mantenida por el comando sync_auth_users a partir
+    del feed de cambios. Permite mostrar y filtrar por datos del usuario sin
+    llamar a auth_service.
+    """
+    id = models.BigIntegerField(primary_key=True, help_text="ID del usuario en auth_service")
+    email = models.EmailField(db_index=True)
+    first_name = models.CharField(max_length=150, blank=True, default='')
+    last_name = models.CharField(max_length=150, blank=True, default='')
+    is_active = models.BooleanField(default=True)
+    # Códigos de los módulos a los que el usuario tiene acceso
+    modules = models.JSONField(default=list)
+    has_module_access = models.BooleanField(default=False, help_text="Acceso al módulo clinicas_service")
+    synced_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.email
+
+
+class SyncCursor(models.Model):
+    """Posición hasta la que se ha aplicado un feed de auth_service"""
+    name = models.CharField(max_length=50, unique=True)
+    position = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name}: {self.position}"
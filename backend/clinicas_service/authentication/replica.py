@@ -0,0 +1,68 @@
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from .models import AuthUserReplica, SyncCursor
+
+MODULE_CODE = 'clinicas_service'
+CURSOR_NAME = 'auth_users'
+REPLICA_FIELDS = ('email', 'first_name', 'last_name', 'is_active')
+
+
+class SyncError(Exception):
+    """auth_service no respondió al pedir el feed de cambios"""
+
+
+def apply_changes(page):
+    """Aplica una página del feed de cambios y avanza el cursor en la misma transacción"""
+    changes = page['changes']
+    replicas = [
+        AuthUserReplica(
+            id=change['user_id'],
+            modules=change['modules'],
+            has_module_access=MODULE_CODE in change['modules'],
+            **{field: change['user'][field] for field in REPLICA_FIELDS}
+        )
+        for change in changes if not change['deleted']
+    ]
+
+    with transaction.atomic():
+        AuthUserReplica.objects.filter(
+            pk__in=[change['user_id'] for change in changes if change['deleted']]
+        ).delete()
+        AuthUserReplica.objects.bulk_create(
+            replicas,
+            update_conflicts=True,
+            unique_fields=['id'],
+            update_fields=[*REPLICA_FIELDS, 'modules', 'has_module_access', 'synced_at'],
+        )
+        SyncCursor.objects.update_or_create(name=CURSOR_NAME, defaults={'position': page['cursor']})
+
+
+def sync_auth_users(auth_client):
+    """
+    Recorre el feed de cambios de auth_service desde el último cursor guardado
+    hasta ponerse al día. Si se interrumpe, la siguiente ejecución continúa
+    desde la última página aplicada. Retorna el número de usuarios aplicados.
+    """
+    cursor = SyncCursor.objects.filter(name=CURSOR_NAME).values_list('position', flat=True).first() or 0
+    applied = 0
+    while True:
+        page = auth_client.get_changes(cursor)
+        if page is None:
+            raise SyncError("No se pudo obtener el feed de cambios de auth_service")
+        apply_changes(page)
+        applied += len(page['changes'])
+        cursor = page['cursor']
+        if not page['has_more']:
+            return applied
+
+
+def with_auth_user(queryset, field='auth_user_id'):
+    """
+    Anota en el queryset (Doctor, Paciente...) los datos del usuario desde la
+    réplica local (auth_email, auth_first_name, auth_last_name, auth_is_active)
+    para mostrarlos o filtrar por ellos sin llamar a auth_service
+    """
+    replica = AuthUserReplica.objects.filter(pk=OuterRef(field))
+    return queryset.annotate(**{
+        f'auth_{name}': Subquery(replica.values(name)[:1]) for name in REPLICA_FIELDS
+    })
@@ -0,0 +1,113 @@
+import base64
+import hashlib
+import time
+from django.conf import settings
+from .claims import PolledReplica
+
+# Resultado de comprobar un token contra la lista de revocación
+VALID = 'valid'
+REVOKED = 'revoked'
+# Coincidencia sólo en el filtro de Bloom: puede ser un falso positivo
+SUSPECTED = 'suspected'
+# Réplica desactualizada: debe decidir auth_service
+UNKNOWN = 'unknown'
+
+
+def bloom_positions(jti, size, hashes):
+    """Posiciones del JTI en el filtro; debe coincidir con accounts.revocation de auth_service"""
+    digest = hashlib.sha256(jti.encode()).digest()
+    h1 = int.from_bytes(digest[:8], 'big')
+    h2 = int.from_bytes(digest[8:16], 'big') | 1
+    return [(h1 + i * h2) % size for i in range(hashes)]
+
+
+class BloomFilter:
+    """Filtro de Bloom publicado por auth_service con los JTIs revocados"""
+
+    def __init__(self, size, hashes, bits):
+        self.size = size
+        self.hashes = hashes
+        self.bits = bits
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['size'], data['hashes'], base64.b64decode(data['bits']))
+
+    def __contains__(self, jti):
+        return all(
+            self.bits[position // 8] & (1 << (position % 8))
+            for position in bloom_positions(jti, self.size, self.hashes)
+        )
+
+
+class RevocationList(PolledReplica):
+    """
+    Réplica local de la lista de revocación de auth_service: un filtro de Bloom
+    con los JTIs revocados hasta el último estado completo, más los JTIs y
+    cortes por usuario exactos recibidos después. Se consulta en O(1) sin
+    llamar a auth_service; sólo las coincidencias del filtro (posibles falsos
+    positivos) se confirman con auth_service.
+    """
+
+    def __init__(self, auth_client, async_auth_client=None):
+        super().__init__(
+            auth_client, async_auth_client,
+            poll_interval=getattr(settings, 'AUTH_REVOCATION_POLL_INTERVAL', 15),
+            max_staleness=getattr(settings, 'AUTH_REVOCATION_MAX_STALENESS', 120),
+        )
+        # Cada cierto tiempo se pide el estado completo para descartar lo expirado
+        self.snapshot_interval = getattr(settings, 'AUTH_REVOCATION_SNAPSHOT_INTERVAL', 600)
+        self._bloom = None
+        self._jtis = set()
+        self._user_cutoffs = {}
+        self._seq = None
+        self._snapshot_at = None
+
+    def _since(self):
+        if self._snapshot_at is None or time.monotonic() - self._snapshot_at >= self.snapshot_interval:
+            return None
+        return self._seq
+
+    def _fetch(self):
+        return self.auth_client.get_revocations(self._since())
+
+    async def _afetch(self):
+        return await self.async_auth_client.get_revocations(self._since())
+
+    def _apply(self, data):
+        if data['type'] == 'snapshot':
+            self._bloom = BloomFilter.from_dict(data['bloom'])
+            self._jtis = set()
+            self._user_cutoffs = dict(data['users'])
+            self._snapshot_at = time.monotonic()
+        else:
+            self._jtis.update(data['jtis'])
+            for user_id, cutoff in data['users'].items():
+                self._user_cutoffs[user_id] = max(self._user_cutoffs.get(user_id, 0), cutoff)
+        self._seq = data['seq']
+
+    def _check(self, claims):
+        if not self._is_fresh():
+            return UNKNOWN
+
+        cutoff = self._user_cutoffs.get(str(claims.get('user_id')))
+        # El corte está en segundos enteros: un token emitido en ese mismo segundo es posterior
+        if cutoff is not None and claims.get('iat', 0) < cutoff:
+            return REVOKED
+
+        jti = claims.get('jti')
+        if jti in self._jtis:
+            return REVOKED
+        if self._bloom is not None and jti in self._bloom:
+            return SUSPECTED
+        return VALID
+
+    def check(self, claims):
+        """VALID, REVOKED, SUSPECTED o UNKNOWN para los claims de un access token"""
+        self._sync()
+        return self._check(claims)
+
+    async def acheck(self, claims):
+        """Versión asíncrona de check"""
+        await self._async_sync()
+        return self._check(claims)
@@ -0,0 +1,649 @@
+import asyncio
+import base64
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+
+import jwt
+import requests
+from asgiref.sync import iscoroutinefunction
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from datetime import time as dtime
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from . import auth_service
+from .auth_service import AuthServiceClient
+from .cache import AsyncSingleFlight, SingleFlight, TTLCache
+from .claims import PERMISSION_FIELDS, PermissionVersionRegistry, decode_permission_claims
+from clinicas.models import Clinica, Doctor, Especialidad
+from .jwt_verifier import LocalTokenVerifier, LocalVerificationUnavailable
+from .loaders import UserLoader
+from .models import AuthUserReplica, SyncCursor
+from .replica import sync_auth_users, with_auth_user
+from .middleware import AuthMiddleware
+from .revocation import REVOKED, SUSPECTED, UNKNOWN, VALID, RevocationList, bloom_positions
+from .transport import (
+    MSGPACK_MEDIA_TYPE, AsyncServiceTransport, CircuitBreaker, CircuitOpenError, ServiceTransport,
+    decode_response, msgpack,
+)
+
+
+class StubAuthService:
+    """Servidor HTTP local que responde con la secuencia de respuestas indicada"""
+
+    def __init__(self):
+        self.responses = []
+        self.default = (200, {"ok": True})
+        self.delay = 0
+        self.hits = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def _respond(self):
+                stub.hits += 1
+                length = int(self.headers.get('Content-Length') or 0)
+                if length:
+                    self.rfile.read(length)
+                if stub.delay:
+                    time.sleep(stub.delay)
+                status, body = stub.responses.pop(0) if stub.responses else stub.default
+                # Negocia el formato como auth_service: MessagePack si se acepta
+                if msgpack and MSGPACK_MEDIA_TYPE in (self.headers.get('Accept') or ''):
+                    content_type, payload = MSGPACK_MEDIA_TYPE, msgpack.packb(body)
+                else:
+                    content_type, payload = 'application/json', json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                try:
+                    self.wfile.write(payload)
+                except (BrokenPipeError, ConnectionResetError):
+                    # El cliente ya se fue (timeout)
+                    pass
+
+            do_GET = _respond
+            do_POST = _respond
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class ServiceTransportTests(SimpleTestCase):
+    def setUp(self):
+        self.stub = StubAuthService().__enter__()
+        self.addCleanup(self.stub.__exit__)
+
+    def transport(self, **kwargs):
+        kwargs.setdefault('retry_backoff', 0.001)
+        return ServiceTransport(self.stub.url, **kwargs)
+
+    def test_reuses_keep_alive_connections(self):
+        transport = self.transport()
+        for _ in range(5):
+            self.assertEqual(transport.get('/api/introspect/').status_code, 200)
+
+        pool = transport.stats()['pools'][0]
+        self.assertEqual(pool['connections_created'], 1)
+        self.assertEqual(pool['requests'], 5)
+        self.assertEqual(pool['idle_connections'], 1)
+
+    def test_read_timeout_bounds_slow_responses(self):
+        self.stub.delay = 0.5
+        transport = self.transport(read_timeout=0.1, max_retries=0)
+
+        started = time.monotonic()
+        with self.assertRaises(requests.Timeout):
+            transport.get('/api/introspect/')
+        self.assertLess(time.monotonic() - started, 0.4)
+
+    def test_retries_transient_errors(self):
+        self.stub.responses = [(503, {}), (502, {})]
+        transport = self.transport(max_retries=2)
+
+        self.assertEqual(transport.get('/api/introspect/').status_code, 200)
+        self.assertEqual(self.stub.hits, 3)
+        self.assertEqual(transport.stats()['retries'], 2)
+
+    def test_post_is_not_retried_by_default(self):
+        self.stub.responses = [(503, {})]
+        transport = self.transport(max_retries=2)
+
+        self.assertEqual(transport.post('/api/verify-access/', json={}).status_code, 503)
+        self.assertEqual(self.stub.hits, 1)
+
+    def test_circuit_opens_and_fails_fast(self):
+        self.stub.default = (503, {})
+        transport = self.transport(max_retries=0, breaker=CircuitBreaker(failure_threshold=2))
+
+        transport.get('/api/introspect/')
+        transport.get('/api/introspect/')
+        with self.assertRaises(CircuitOpenError):
+            transport.get('/api/introspect/')
+        self.assertEqual(self.stub.hits, 2)
+        self.assertEqual(transport.stats()['circuit']['state'], CircuitBreaker.OPEN)
+
+    def test_circuit_closes_after_successful_probe(self):
+        self.stub.responses = [(503, {})]
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        transport = self.transport(max_retries=0, breaker=breaker)
+
+        transport.get('/api/introspect/')
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        time.sleep(0.06)
+        self.assertEqual(transport.get('/api/introspect/').status_code, 200)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_retried_call_counts_as_one_failure(self):
+        self.stub.default = (503, {})
+        breaker = CircuitBreaker(failure_threshold=2)
+        transport = self.transport(max_retries=2, breaker=breaker)
+
+        transport.get('/api/introspect/')
+        self.assertEqual(self.stub.hits, 3)
+        self.assertEqual((breaker.state, breaker.failures), (CircuitBreaker.CLOSED, 1))
+        transport.get('/api/introspect/')
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_probe_failing_with_unexpected_error_reopens_circuit(self):
+        self.stub.responses = [(503, {})]
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0.05)
+        transport = self.transport(max_retries=0, breaker=breaker)
+
+        transport.get('/api/introspect/')
+        time.sleep(0.06)
+        with mock.patch.object(transport.session, 'request', side_effect=requests.exceptions.ChunkedEncodingError):
+            with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+                transport.get('/api/introspect/')
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        time.sleep(0.06)
+        self.assertEqual(transport.get('/api/introspect/').status_code, 200)
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    async def test_cancelled_async_probe_reopens_circuit(self):
+        breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+        breaker.record_failure()
+        self.stub.delay = 0.5
+        transport = AsyncServiceTransport(self.stub.url, max_retries=0, breaker=breaker)
+
+        probe = asyncio.create_task(transport.get('/api/introspect/'))
+        await asyncio.sleep(0.05)
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        probe.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await probe
+        await transport.client.aclose()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+    def test_prefers_messagepack_and_decodes_either_format(self):
+        self.stub.default = (200, {"id": 1, "email": "doctor@clinica.com"})
+        transport = self.transport()
+
+        response = transport.get('/api/introspect/')
+        if msgpack:
+            self.assertEqual(response.headers['Content-Type'], MSGPACK_MEDIA_TYPE)
+        self.assertEqual(decode_response(response), {"id": 1, "email": "doctor@clinica.com"})
+
+        response = transport.get('/api/introspect/', headers={'Accept': 'application/json'})
+        self.assertEqual(response.headers['Content-Type'], 'application/json')
+        self.assertEqual(decode_response(response), {"id": 1, "email": "doctor@clinica.com"})
+
+
+class AuthTransportStatsViewTests(TestCase):
+    def test_only_staff_can_read_transport_internals(self):
+        self.assertEqual(self.client.get('/api/internal/auth-transport/').status_code, 403)
+
+        self.client.force_login(User.objects.create_user('operaciones', is_staff=True))
+        response = self.client.get('/api/internal/auth-transport/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('circuit', response.json())
+
+
+class AuthServiceClientFallbackTests(SimpleTestCase):
+    def setUp(self):
+        self.stub = StubAuthService().__enter__()
+        self.addCleanup(self.stub.__exit__)
+        self.transport = ServiceTransport(
+            self.stub.url, max_retries=0, breaker=CircuitBreaker(failure_threshold=1)
+        )
+        patcher = mock.patch.object(auth_service, 'get_transport', return_value=self.transport)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        auth_service._introspection_cache.clear()
+        self.addCleanup(auth_service._introspection_cache.clear)
+
+    def test_serves_last_known_result_while_circuit_is_open(self):
+        token = jwt.encode({'exp': time.time() + 60, 'user_id': '1'}, 'secreto-de-pruebas-de-32-bytes!!')
+        introspection = {
+            "active": True,
+            "user": {"id": 1, "email": "medico@example.com"},
+            "permissions": {"clinicas_service": {"permissions": {"can_view": True}, "submodules": {}}},
+        }
+        self.stub.responses = [(200, introspection)]
+        client = AuthServiceClient()
+        client.cache_ttl = 0.01
+
+        self.assertEqual(client.verify_token(token)['id'], 1)
+        time.sleep(0.02)
+
+        self.stub.default = (503, {})
+        self.assertEqual(client.verify_token(token)['id'], 1)
+        self.assertEqual(self.transport.breaker.state, CircuitBreaker.OPEN)
+        self.assertTrue(client.verify_module_access(token, 'clinicas_service')['has_access'])
+        self.assertEqual(self.stub.hits, 2)
+
+
+class TTLCacheAndSingleFlightTests(SimpleTestCase):
+    def test_entries_expire_and_stale_ones_are_kept_until_stale_ttl(self):
+        cache = TTLCache(maxsize=10, ttl=0.05)
+        cache.set('fresca', 1)
+        cache.set('obsoleta', 2, stale_ttl=5)
+        self.assertEqual(cache.get('fresca'), 1)
+
+        time.sleep(0.06)
+        self.assertIsNone(cache.get('fresca'))
+        self.assertIsNone(cache.get('obsoleta'))
+        self.assertEqual(cache.get('obsoleta', allow_stale=True), 2)
+        self.assertIsNone(cache.get('fresca', allow_stale=True))
+
+    def test_evicts_least_recently_used(self):
+        cache = TTLCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual((cache.get('a'), cache.get('b'), cache.get('c')), (1, None, 3))
+
+    def test_concurrent_callers_share_one_call(self):
+        flight = SingleFlight()
+        calls, results = [], []
+        release = threading.Event()
+
+        def slow():
+            calls.append(1)
+            release.wait(5)
+            return 'resultado'
+
+        threads = [threading.Thread(target=lambda: results.append(flight.do('k', slow))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['resultado'] * 5)
+
+    async def test_concurrent_coroutines_share_one_call(self):
+        flight = AsyncSingleFlight()
+        calls = []
+
+        async def slow():
+            calls.append(1)
+            await asyncio.sleep(0.02)
+            return 'resultado'
+
+        results = await asyncio.gather(*[flight.do('k', slow) for _ in range(5)])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, ['resultado'] * 5)
+
+        async def failing():
+            await asyncio.sleep(0.01)
+            raise ValueError('fallo')
+
+        errors = await asyncio.gather(*[flight.do('k', failing) for _ in range(3)], return_exceptions=True)
+        self.assertTrue(all(isinstance(error, ValueError) for error in errors))
+
+
+class IntrospectionCacheTests(SimpleTestCase):
+    introspection = {"active": True, "user": {"id": 1, "email": "medico@example.com"}, "permissions": {}}
+
+    def setUp(self):
+        self.stub = StubAuthService().__enter__()
+        self.addCleanup(self.stub.__exit__)
+        transport = ServiceTransport(self.stub.url, max_retries=0)
+        patcher = mock.patch.object(auth_service, 'get_transport', return_value=transport)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        auth_service._introspection_cache.clear()
+        self.addCleanup(auth_service._introspection_cache.clear)
+
+    def token(self, exp_in=60):
+        return jwt.encode({'exp': time.time() + exp_in, 'user_id': '1'}, 'secreto-de-pruebas-de-32-bytes!!')
+
+    def test_caches_valid_tokens_until_ttl_or_expiry(self):
+        self.stub.default = (200, self.introspection)
+        client = AuthServiceClient()
+        client.cache_ttl = 0.05
+        token = self.token()
+
+        client.introspect(token)
+        client.introspect(token)
+        self.assertEqual(self.stub.hits, 1)
+        time.sleep(0.06)
+        client.introspect(token)
+        self.assertEqual(self.stub.hits, 2)
+
+        # Nunca más allá de la expiración del propio token
+        expiring = self.token(exp_in=0.05)
+        client.cache_ttl = 30
+        client.introspect(expiring)
+        time.sleep(0.06)
+        client.introspect(expiring)
+        self.assertEqual(self.stub.hits, 4)
+
+    def test_caches_rejected_tokens_for_negative_ttl(self):
+        self.stub.default = (401, {"detail": "Token inválido"})
+        client = AuthServiceClient()
+        client.negative_cache_ttl = 0.05
+        token = self.token()
+
+        self.assertIsNone(client.introspect(token))
+        self.assertIsNone(client.introspect(token))
+        self.assertEqual(self.stub.hits, 1)
+        time.sleep(0.06)
+        self.assertIsNone(client.introspect(token))
+        self.assertEqual(self.stub.hits, 2)
+
+    def test_concurrent_threads_share_one_introspection(self):
+        self.stub.default = (200, self.introspection)
+        self.stub.delay = 0.05
+        client = AuthServiceClient()
+        token = self.token()
+        results = []
+
+        threads = [threading.Thread(target=lambda: results.append(client.verify_token(token))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([user['id'] for user in results], [1] * 5)
+        self.assertEqual(self.stub.hits, 1)
+
+
+class UserBatchLookupTests(SimpleTestCase):
+    def setUp(self):
+        self.stub = StubAuthService().__enter__()
+        self.addCleanup(self.stub.__exit__)
+        self.stub.default = (200, {"results": [
+            {"id": 1, "email": "medico@example.com"}, {"id": 2, "email": "paciente@example.com"}
+        ]})
+        patcher = mock.patch.object(auth_service, 'get_transport', return_value=ServiceTransport(self.stub.url))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        auth_service._user_cache.clear()
+        self.addCleanup(auth_service._user_cache.clear)
+
+    def test_loader_batches_lookups_of_one_request(self):
+        loader = UserLoader(AuthServiceClient())
+        loader.prime([1, 2, 3])
+
+        self.assertEqual(loader.load(2)['email'], 'paciente@example.com')
+        self.assertEqual(loader.load(1)['email'], 'medico@example.com')
+        self.assertIsNone(loader.load(3))
+        self.assertEqual(self.stub.hits, 1)
+
+        # Otra petición dentro del TTL se sirve de la caché, también para el inexistente
+        self.assertEqual(set(AuthServiceClient().get_users([1, 2, 3])), {1, 2})
+        self.assertEqual(AuthServiceClient().get_user_info(1)['id'], 1)
+        self.assertEqual(self.stub.hits, 1)
+
+
+class AsyncAuthMiddlewareTests(SimpleTestCase):
+    introspection = {
+        "active": True,
+        "user": {"id": 7, "email": "recepcion@example.com"},
+        "permissions": {"clinicas_service": {"permissions": {"can_view": True}, "submodules": {}}},
+    }
+
+    def setUp(self):
+        self.stub = StubAuthService().__enter__()
+        self.addCleanup(self.stub.__exit__)
+        self.stub.default = (200, self.introspection)
+        self.stub.delay = 0.05
+        auth_service._introspection_cache.clear()
+        self.addCleanup(auth_service._introspection_cache.clear)
+
+    async def test_concurrent_requests_share_one_introspection(self):
+        transport = AsyncServiceTransport(self.stub.url)
+        seen = []
+
+        async def get_response(request):
+            seen.append(request.user_data['id'])
+            return HttpResponse('ok')
+
+        with mock.patch.object(auth_service, 'get_async_transport', return_value=transport):
+            middleware = AuthMiddleware(get_response)
+            self.assertTrue(iscoroutinefunction(middleware))
+
+            token = jwt.encode({'exp': time.time() + 60, 'user_id': '7'}, 'clave-que-no-se-comparte-con-clinicas')
+            factory = RequestFactory()
+            responses = await asyncio.gather(*[
+                middleware(factory.get('/api/citas/', HTTP_AUTHORIZATION=f'Bearer {token}'))
+                for _ in range(10)
+            ])
+        await transport.client.aclose()
+
+        self.assertEqual([r.status_code for r in responses], [200] * 10)
+        self.assertEqual(seen, [7] * 10)
+        self.assertEqual(self.stub.hits, 1)
+
+    async def test_rejects_missing_token_without_calling_auth_service(self):
+        async def get_response(request):
+            return HttpResponse('ok')
+
+        middleware = AuthMiddleware(get_response)
+        response = await middleware(RequestFactory().get('/api/citas/'))
+
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(self.stub.hits, 0)
+
+
+@override_settings(AUTH_JWT_LOCAL_VERIFICATION=True, AUTH_JWT_ALGORITHM='HS256', AUTH_JWT_VERIFYING_KEY='clave-compartida')
+class LocalTokenVerifierTests(SimpleTestCase):
+    def token(self, key='clave-compartida', algorithm='HS256', **claims):
+        payload = {'exp': time.time() + 60, 'user_id': '7', 'token_type': 'access', 'jti': 'abc'}
+        payload.update(claims)
+        return jwt.encode({k: v for k, v in payload.items() if v is not None}, key, algorithm=algorithm)
+
+    def test_accepts_valid_access_token(self):
+        claims = LocalTokenVerifier().verify(self.token())
+        self.assertEqual(LocalTokenVerifier.user_data_from_claims(claims), {'id': 7, 'jti': 'abc'})
+
+    def test_rejects_expired_token_and_other_token_types(self):
+        verifier = LocalTokenVerifier()
+        self.assertIsNone(verifier.verify(self.token(exp=time.time() - 1)))
+        self.assertIsNone(verifier.verify(self.token(token_type='refresh')))
+        self.assertIsNone(verifier.verify(self.token(token_type=None)))
+
+    def test_defers_to_auth_service_on_bad_signature_or_algorithm(self):
+        verifier = LocalTokenVerifier()
+        with self.assertRaises(LocalVerificationUnavailable):
+            verifier.verify(self.token(key='otra-clave'))
+        with self.assertRaises(LocalVerificationUnavailable):
+            verifier.verify(self.token(algorithm='HS512'))
+
+    @override_settings(AUTH_JWT_ALGORITHM='RS256', AUTH_JWT_VERIFYING_KEY='')
+    def test_public_key_fetch_failure_is_retried_later(self):
+        transport = mock.Mock()
+        transport.get.side_effect = requests.ConnectionError('auth_service caído')
+        verifier = LocalTokenVerifier()
+
+        with mock.patch('authentication.jwt_verifier.get_transport', return_value=transport):
+            with self.assertRaises(LocalVerificationUnavailable):
+                verifier.verify(self.token())
+            # Dentro del intervalo de reintento no se vuelve a llamar a auth_service
+            with self.assertRaises(LocalVerificationUnavailable):
+                verifier.verify(self.token())
+        self.assertEqual(transport.get.call_count, 1)
+
+    @override_settings(AUTH_JWT_VERIFYING_KEY='')
+    def test_shared_key_is_never_fetched(self):
+        with mock.patch('authentication.jwt_verifier.get_transport') as get_transport:
+            with self.assertRaises(LocalVerificationUnavailable):
+                LocalTokenVerifier().verify(self.token())
+        get_transport.assert_not_called()
+
+
+@override_settings(AUTH_JWT_LOCAL_VERIFICATION=True, AUTH_JWT_ALGORITHM='HS256', AUTH_JWT_VERIFYING_KEY='clave-compartida')
+class PermissionClaimsTests(SimpleTestCase):
+    def versions(self, versions):
+        return {'versions': versions, 'server_time': time.time()}
+
+    def test_decodes_compact_permission_claims(self):
+        self.assertEqual(decode_permission_claims(['clinicas_service::1', 'clinicas_service:sede_centro:15']), {
+            'clinicas_service': {
+                'permissions': {'can_view': True, 'can_create': False, 'can_edit': False, 'can_delete': False},
+                'submodules': {'sede_centro': dict.fromkeys(PERMISSION_FIELDS, True)},
+            }
+        })
+
+    def test_registry_trusts_only_current_versions(self):
+        auth_client = mock.Mock()
+        auth_client.get_permission_versions.return_value = self.versions({'7': 2})
+        registry = PermissionVersionRegistry(auth_client)
+
+        self.assertTrue(registry.is_current({'user_id': '7', 'perms': [], 'pv': 2}))
+        self.assertFalse(registry.is_current({'user_id': '7', 'perms': [], 'pv': 1}))
+        self.assertFalse(registry.is_current({'user_id': '7', 'pv': 2}))
+        # Usuarios sin cambios desde que se sincroniza: versión 0
+        self.assertTrue(registry.is_current({'user_id': '8', 'perms': [], 'pv': 0}))
+
+    def test_unknown_until_first_sync(self):
+        auth_client = mock.Mock()
+        auth_client.get_permission_versions.return_value = None
+        registry = PermissionVersionRegistry(auth_client)
+        self.assertFalse(registry.is_current({'user_id': '7', 'perms': [], 'pv': 5}))
+
+    def test_middleware_falls_back_to_auth_service_after_version_bump(self):
+        seen = []
+        middleware = AuthMiddleware(lambda request: seen.append(request.user_permissions) or HttpResponse('ok'))
+        middleware.revocations.check = mock.Mock(return_value=VALID)
+        middleware.auth_client = mock.Mock()
+        middleware.auth_client.verify_module_access.return_value = {'has_access': False}
+        middleware.permission_versions.auth_client = middleware.auth_client
+        middleware.permission_versions.poll_interval = 0
+        token = jwt.encode({
+            'exp': time.time() + 60, 'user_id': '7', 'token_type': 'access', 'jti': 'abc',
+            'perms': ['clinicas_service::3'], 'pv': 1,
+        }, 'clave-compartida')
+
+        def call():
+            return middleware(RequestFactory().get('/api/citas/', HTTP_AUTHORIZATION=f'Bearer {token}'))
+
+        middleware.auth_client.get_permission_versions.return_value = self.versions({'7': 1})
+        self.assertEqual(call().status_code, 200)
+        self.assertEqual(seen, [{'can_view': True, 'can_create': True, 'can_edit': False, 'can_delete': False}])
+        middleware.auth_client.verify_module_access.assert_not_called()
+
+        # auth_service subió la versión (p. ej. se retiró el acceso): el token ya no basta
+        middleware.auth_client.get_permission_versions.return_value = self.versions({'7': 2})
+        self.assertEqual(call().status_code, 403)
+        middleware.auth_client.verify_module_access.assert_called_once_with(token, 'clinicas_service')
+
+
+class RevocationListTests(SimpleTestCase):
+    def bloom(self, jtis, size=1024, hashes=7):
+        bits = bytearray(size // 8)
+        for jti in jtis:
+            for position in bloom_positions(jti, size, hashes):
+                bits[position // 8] |= 1 << (position % 8)
+        return {"size": size, "hashes": hashes, "bits": base64.b64encode(bytes(bits)).decode()}
+
+    def test_checks_locally_with_snapshot_and_deltas(self):
+        empty_delta = {"type": "delta", "seq": 4, "jtis": [], "users": {}}
+        auth_client = mock.Mock()
+        auth_client.get_revocations.side_effect = [
+            {"type": "snapshot", "seq": 3, "bloom": self.bloom(["jti-antiguo"]), "users": {"5": 1000.0}},
+            {"type": "delta", "seq": 4, "jtis": ["jti-logout"], "users": {}},
+            empty_delta,
+            empty_delta,
+            empty_delta,
+        ]
+        revocations = RevocationList(auth_client)
+        revocations.poll_interval = 0
+
+        self.assertEqual(revocations.check({'user_id': '1', 'jti': 'jti-antiguo', 'iat': 2000}), SUSPECTED)
+        self.assertEqual(revocations.check({'user_id': '1', 'jti': 'jti-logout', 'iat': 2000}), REVOKED)
+        self.assertEqual(revocations.check({'user_id': '5', 'jti': 'otro', 'iat': 999}), REVOKED)
+        self.assertEqual(revocations.check({'user_id': '5', 'jti': 'nuevo', 'iat': 1000}), VALID)
+        self.assertEqual(revocations.check({'user_id': '5', 'jti': 'nuevo', 'iat': 1001}), VALID)
+        self.assertEqual(
+            [c.args for c in auth_client.get_revocations.call_args_list], [(None,), (3,), (4,), (4,), (4,)]
+        )
+
+    def test_unknown_until_first_sync(self):
+        auth_client = mock.Mock()
+        auth_client.get_revocations.return_value = None
+
+        revocations = RevocationList(auth_client)
+        self.assertEqual(revocations.check({'user_id': '1', 'jti': 'x', 'iat': 1}), UNKNOWN)
+
+
+class AuthUserReplicaSyncTests(TestCase):
+    def change(self, user_id, email, is_active=True, modules=('clinicas_service',)):
+        return {
+            "user_id": user_id, "deleted": False, "modules": list(modules),
+            "user": {"id": user_id, "email": email, "first_name": "", "last_name": "", "is_active": is_active},
+        }
+
+    def test_applies_pages_and_resumes_from_cursor(self):
+        auth_client = mock.Mock()
+        auth_client.get_changes.side_effect = [
+            {"changes": [self.change(1, "ana@example.com"), self.change(2, "luis@example.com")],
+             "cursor": 2, "has_more": True},
+            {"changes": [self.change(1, "ana@example.com", is_active=False)], "cursor": 3, "has_more": False},
+        ]
+        self.assertEqual(sync_auth_users(auth_client), 3)
+        self.assertEqual([c.args for c in auth_client.get_changes.call_args_list], [(0,), (2,)])
+        self.assertFalse(AuthUserReplica.objects.get(pk=1).is_active)
+        self.assertEqual(SyncCursor.objects.get(name='auth_users').position, 3)
+
+        auth_client.get_changes.side_effect = [{
+            "changes": [{"user_id": 2, "deleted": True, "user": None, "modules": []},
+                        self.change(4, "sin-acceso@example.com", modules=())],
+            "cursor": 5, "has_more": False,
+        }]
+        sync_auth_users(auth_client)
+        auth_client.get_changes.assert_called_with(3)
+        self.assertEqual(
+            list(AuthUserReplica.objects.order_by('id').values_list('id', 'has_module_access')),
+            [(1, True), (4, False)]
+        )
+
+    def test_filters_doctors_by_replicated_user_attributes(self):
+        clinica = Clinica.objects.create(
+            nombre='Central', direccion='Av. Sol 1', telefono='1', horario_apertura=dtime(8),
+            horario_cierre=dtime(18), auth_module_id=1, auth_submodule_id=1
+        )
+        especialidad = Especialidad.objects.create(nombre='Pediatría', clinica=clinica)
+        for user_id, activo in ((1, True), (2, False)):
+            AuthUserReplica.objects.create(id=user_id, email=f'medico{user_id}@example.com', is_active=activo)
+            Doctor.objects.create(
+                nombre=f'Medico{user_id}', apellidos='Quispe', email=f'medico{user_id}@example.com',
+                especialidad=especialidad, clinica=clinica, auth_user_id=user_id
+            )
+
+        with self.assertNumQueries(1):
+            doctores = list(with_auth_user(Doctor.objects.all()).filter(auth_is_active=True))
+        self.assertEqual([d.auth_email for d in doctores], ['medico1@example.com'])
@@ -0,0 +1,315 @@
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+try:
+    import httpx
+except ImportError:  # httpx es opcional: sin él el cliente asíncrono delega en el síncrono
+    httpx = None
+
+try:
+    import msgpack
+except ImportError:  # msgpack es opcional: sin él se pide y se recibe JSON
+    msgpack = None
+
+MSGPACK_MEDIA_TYPE = 'application/x-msgpack'
+# Sólo MessagePack: DRF ignora los q y, a igual especificidad, elige por el
+# orden de sus renderers (JSON primero en auth_service, que lo publica cuando
+# tiene msgpack instalado)
+ACCEPT = MSGPACK_MEDIA_TYPE if msgpack else 'application/json'
+
+
+def decode_response(response):
+    """Cuerpo de una respuesta (requests o httpx) según su Content-Type"""
+    if response.headers.get('Content-Type', '').startswith(MSGPACK_MEDIA_TYPE):
+        return msgpack.unpackb(response.content, raw=False)
+    return response.json()
+
+
+class CircuitOpenError(requests.ConnectionError):
+    """auth_service se considera caído: la llamada se rechaza sin intentarla"""
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker clásico: tras `failure_threshold` llamadas fallidas
+    consecutivas (una llamada con sus reintentos cuenta una vez) se abre y
+    rechaza llamadas durante `reset_timeout` segundos; después deja pasar una
+    llamada de prueba (semiabierto) que lo cierra si tiene éxito y lo vuelve a
+    abrir si falla por cualquier motivo.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Sólo una llamada de prueba mientras está semiabierto
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class BaseServiceTransport:
+    """Política común de reintentos, contadores y circuit breaker de los transportes"""
+
+    # Respuestas que indican un fallo transitorio del servicio remoto
+    RETRY_STATUSES = (502, 503, 504)
+
+    def __init__(self, base_url, max_retries=2, retry_backoff=0.1, breaker=None):
+        self.base_url = base_url.rstrip('/')
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.breaker = breaker or CircuitBreaker()
+
+        self._counters = {'requests': 0, 'retries': 0, 'failures': 0, 'short_circuited': 0}
+        self._counters_lock = threading.Lock()
+
+    def _count(self, name):
+        with self._counters_lock:
+            self._counters[name] += 1
+
+    def _attempts(self, method, retry):
+        if retry is None:
+            retry = method.upper() in ('GET', 'HEAD', 'OPTIONS')
+        return 1 + (self.max_retries if retry else 0)
+
+    def _retry_delay(self, attempt):
+        # "Full jitter": evita que los reintentos de varios workers se sincronicen
+        return random.uniform(0, self.retry_backoff * (2 ** attempt))
+
+    def _admit(self):
+        """Una vez por llamada lógica: CircuitOpenError si el circuito no la deja pasar"""
+        if not self.breaker.allow_request():
+            self._count('short_circuited')
+            raise CircuitOpenError("auth_service no disponible (circuito abierto)")
+
+    def _before_attempt(self, attempt):
+        if attempt:
+            self._count('retries')
+        self._count('requests')
+
+    def _record_outcome(self, healthy):
+        """Resultado de la llamada completa; también si terminó con una excepción inesperada"""
+        if healthy:
+            self.breaker.record_success()
+        else:
+            self._count('failures')
+            self.breaker.record_failure()
+
+    def _counter_stats(self):
+        with self._counters_lock:
+            counters = dict(self._counters)
+        return {
+            **counters,
+            'circuit': {
+                'state': self.breaker.state,
+                'consecutive_failures': self.breaker.failures,
+            },
+        }
+
+
+class ServiceTransport(BaseServiceTransport):
+    """
+    Transporte HTTP compartido para llamadas entre servicios: sesión con pool
+    de conexiones keep-alive, timeouts de conexión/lectura, reintentos acotados
+    con backoff exponencial y jitter, y circuit breaker.
+    """
+
+    def __init__(self, base_url, pool_size=20, connect_timeout=1.0, read_timeout=3.0,
+                 max_retries=2, retry_backoff=0.1, breaker=None):
+        super().__init__(base_url, max_retries, retry_backoff, breaker)
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.session.headers['Accept'] = ACCEPT
+        self.session.mount('http://', self.adapter)
+        self.session.mount('https://', self.adapter)
+
+    def request(self, method, path, retry=None, **kwargs):
+        """
+        Realiza la petición y retorna la respuesta. Sólo se reintentan los
+        métodos idempotentes (o si `retry=True`) ante errores de conexión,
+        timeouts y respuestas 502/503/504. Lanza CircuitOpenError sin tocar la
+        red si el circuito está abierto.
+        """
+        attempts = self._attempts(method, retry)
+        kwargs.setdefault('timeout', self.timeout)
+
+        self._admit()
+        healthy = False
+        try:
+            for attempt in range(attempts):
+                self._before_attempt(attempt)
+                try:
+                    response = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+                except (requests.ConnectionError, requests.Timeout):
+                    if attempt + 1 >= attempts:
+                        raise
+                    time.sleep(self._retry_delay(attempt))
+                    continue
+
+                if response.status_code in self.RETRY_STATUSES and attempt + 1 < attempts:
+                    time.sleep(self._retry_delay(attempt))
+                    continue
+
+                healthy = response.status_code not in self.RETRY_STATUSES
+                return response
+        finally:
+            self._record_outcome(healthy)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def stats(self):
+        """Uso del pool de conexiones, contadores de peticiones y estado del circuito"""
+        pools = []
+        for key in list(self.adapter.poolmanager.pools.keys()):
+            pool = self.adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+            idle = sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool else 0
+            pools.append({
+                'host': f"{pool.scheme}://{pool.host}:{pool.port}",
+                'maxsize': pool.pool.maxsize if pool.pool else 0,
+                'connections_created': pool.num_connections,
+                'requests': pool.num_requests,
+                'idle_connections': idle,
+            })
+
+        return {'pools': pools, **self._counter_stats()}
+
+
+class AsyncServiceTransport(BaseServiceTransport):
+    """Equivalente asíncrono de ServiceTransport sobre httpx, sin ocupar un hilo por petición"""
+
+    def __init__(self, base_url, pool_size=20, connect_timeout=1.0, read_timeout=3.0,
+                 max_retries=2, retry_backoff=0.1, breaker=None):
+        super().__init__(base_url, max_retries, retry_backoff, breaker)
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            headers={'Accept': ACCEPT},
+        )
+
+    async def request(self, method, path, retry=None, **kwargs):
+        """Mismas reglas de reintento y circuit breaker que ServiceTransport.request"""
+        attempts = self._attempts(method, retry)
+
+        self._admit()
+        healthy = False
+        try:
+            for attempt in range(attempts):
+                self._before_attempt(attempt)
+                try:
+                    response = await self.client.request(method, f"{self.base_url}{path}", **kwargs)
+                except httpx.TransportError:
+                    if attempt + 1 >= attempts:
+                        raise
+                    await asyncio.sleep(self._retry_delay(attempt))
+                    continue
+
+                if response.status_code in self.RETRY_STATUSES and attempt + 1 < attempts:
+                    await asyncio.sleep(self._retry_delay(attempt))
+                    continue
+
+                healthy = response.status_code not in self.RETRY_STATUSES
+                return response
+        finally:
+            # Incluye la cancelación de la tarea durante la llamada de prueba
+            self._record_outcome(healthy)
+
+    async def get(self, path, **kwargs):
+        return await self.request('GET', path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request('POST', path, **kwargs)
+
+    def stats(self):
+        return self._counter_stats()
+
+
+_transport = None
+_transport_pid = None
+_transport_lock = threading.Lock()
+
+
+def get_transport():
+    """Transporte compartido del proceso hacia auth_service (se recrea tras un fork)"""
+    global _transport, _transport_pid
+    with _transport_lock:
+        if _transport is None or _transport_pid != os.getpid():
+            _transport = ServiceTransport(
+                settings.AUTH_SERVICE_URL,
+                pool_size=getattr(settings, 'AUTH_SERVICE_POOL_SIZE', 20),
+                connect_timeout=getattr(settings, 'AUTH_SERVICE_CONNECT_TIMEOUT', 1.0),
+                read_timeout=getattr(settings, 'AUTH_SERVICE_READ_TIMEOUT', 3.0),
+                max_retries=getattr(settings, 'AUTH_SERVICE_MAX_RETRIES', 2),
+                retry_backoff=getattr(settings, 'AUTH_SERVICE_RETRY_BACKOFF', 0.1),
+                breaker=CircuitBreaker(
+                    failure_threshold=getattr(settings, 'AUTH_SERVICE_CIRCUIT_FAILURE_THRESHOLD', 5),
+                    reset_timeout=getattr(settings, 'AUTH_SERVICE_CIRCUIT_RESET_TIMEOUT', 30),
+                ),
+            )
+            _transport_pid = os.getpid()
+        return _transport
+
+
+_async_transports = weakref.WeakKeyDictionary()
+
+
+def get_async_transport():
+    """
+    Transporte asíncrono del event loop en curso (los clientes httpx no pueden
+    compartirse entre loops). Comparte el circuit breaker con el transporte
+    síncrono para que ambos vean el mismo estado de salud de auth_service.
+    """
+    loop = asyncio.get_running_loop()
+    transport = _async_transports.get(loop)
+    if transport is None:
+        sync_transport = get_transport()
+        transport = _async_transports[loop] = AsyncServiceTransport(
+            settings.AUTH_SERVICE_URL,
+            pool_size=getattr(settings, 'AUTH_SERVICE_POOL_SIZE', 20),
+            connect_timeout=sync_transport.timeout[0],
+            read_timeout=sync_transport.timeout[1],
+            max_retries=sync_transport.max_retries,
+            retry_backoff=sync_transport.retry_backoff,
+            breaker=sync_transport.breaker,
+        )
+    return transport
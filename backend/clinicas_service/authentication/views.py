@@ -0,0 +1,12 @@
+from django.http import JsonResponse
+from .transport import get_transport
+
+
+def auth_transport_stats(request):
+    """
+    Uso del pool de conexiones y estado del circuito hacia auth_service en
+    este proceso. Sólo para staff (sesión del admin de Django).
+    """
+    if not request.user.is_staff:
+        return JsonResponse({"error": "No autorizado"}, status=403)
+    return JsonResponse(get_transport().stats())
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from clinicas.models import Clinica, Especialidad, Doctor, Paciente, Horario, Cita
+from clinicas.models import Clinica, Especialidad, Doctor, Paciente, Horario, Cita, ReservaTemporal, Turno, ExcepcionHorario
 
 @admin.register(Clinica)
 class ClinicaAdmin(admin.ModelAdmin):
@@ -40,4 +40,22 @@ class CitaAdmin(admin.ModelAdmin):
     list_display = ('paciente', 'doctor', 'fecha', 'hora_inicio', 'estado')
     list_filter = ('estado', 'fecha', 'doctor')
     search_fields = ('paciente__nombre', 'paciente__apellidos', 'doctor__nombre', 'doctor__apellidos')
-    date_hierarchy = 'fecha'
\ No newline at end of file
+    date_hierarchy = 'fecha'
+
+@admin.register(ReservaTemporal)
+class ReservaTemporalAdmin(admin.ModelAdmin):
+    list_display = ('doctor', 'fecha', 'hora_inicio', 'chat_session_id', 'expira')
+    list_filter = ('doctor',)
+    search_fields = ('chat_session_id',)
+
+@admin.register(Turno)
+class TurnoAdmin(admin.ModelAdmin):
+    list_display = ('doctor', 'fecha', 'hora_inicio', 'hora_fin', 'cita')
+    list_filter = ('doctor', 'fecha')
+    raw_id_fields = ('cita',)
+
+@admin.register(ExcepcionHorario)
+class ExcepcionHorarioAdmin(admin.ModelAdmin):
+    list_display = ('tipo', 'doctor', 'clinica', 'fecha_inicio', 'fecha_fin', 'hora_inicio', 'hora_fin', 'motivo')
+    list_filter = ('tipo', 'clinica', 'doctor')
+    date_hierarchy = 'fecha_inicio'
@@ -0,0 +1,430 @@
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import time as dtime, timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import DateTimeField, F, Q, Value
+from django.utils import timezone
+from .models import ESTADOS_OCUPADOS, Cita, Doctor, ExcepcionHorario, Horario, ReservaTemporal, Turno
+
+SEGUNDOS_DIA = 24 * 60 * 60
+# Días cuyas citas se cargan juntas al buscar el próximo turno libre
+DIAS_POR_LOTE = 7
+
+# Máximo de días del calendario de disponibilidad
+MAX_DIAS_CALENDARIO = 90
+
+# Mientras un proceso calcula un día, los demás esperan su resultado hasta este tiempo (s)
+LOCK_TIMEOUT = 5
+LOCK_WAIT = 1.0
+LOCK_POLL = 0.02
+
+
+def duracion_slot():
+    """Duración de los turnos en segundos (CLINICAS_SLOT_MINUTES)"""
+    return getattr(settings, 'CLINICAS_SLOT_MINUTES', 30) * 60
+
+
+def duracion_doctor(doctor):
+    """Duración de las citas del doctor en segundos: la suya, la de su especialidad o duracion_slot()"""
+    minutos = doctor.duracion_cita or doctor.especialidad.duracion_cita
+    return minutos * 60 if minutos else duracion_slot()
+
+
+def duraciones(doctor_ids):
+    """duracion_doctor() de varios doctores con una consulta: {doctor_id: segundos}"""
+    por_defecto = duracion_slot()
+    return {
+        pk: (propia or de_especialidad or 0) * 60 or por_defecto
+        for pk, propia, de_especialidad in Doctor.objects.filter(pk__in=doctor_ids).values_list(
+            'pk', 'duracion_cita', 'especialidad__duracion_cita'
+        )
+    }
+
+
+def inventario_activo():
+    """Si la disponibilidad se lee del inventario de turnos (CLINICAS_SLOT_INVENTORY)"""
+    return getattr(settings, 'CLINICAS_SLOT_INVENTORY', False)
+
+
+def fin_inventario():
+    """Último día cubierto por el inventario: hoy + CLINICAS_SLOT_INVENTORY_DAYS - 1"""
+    return timezone.localdate() + timedelta(days=getattr(settings, 'CLINICAS_SLOT_INVENTORY_DAYS', 60) - 1)
+
+
+def en_inventario(desde, hasta=None):
+    """
+    Si el inventario cubre el rango de fechas. Sus turnos tienen la duración
+    de cada doctor: una duración distinta se calcula con los horarios.
+    """
+    return inventario_activo() and timezone.localdate() <= desde and (hasta or desde) <= fin_inventario()
+
+
+def _segundos(hora):
+    return hora.hour * 3600 + hora.minute * 60 + hora.second
+
+
+def _hora(segundos):
+    # Como datetime + timedelta: un turno que pasa la medianoche termina al día siguiente
+    segundos %= SEGUNDOS_DIA
+    return dtime(segundos // 3600, segundos % 3600 // 60, segundos % 60)
+
+
+def intervalos_ocupados(citas, duracion):
+    """Une los intervalos [inicio, fin) de las citas en una lista ordenada y sin solapes"""
+    intervalos = []
+    for hora_inicio, hora_fin in sorted(citas):
+        inicio, fin = _segundos(hora_inicio), _segundos(hora_fin)
+        if fin <= inicio:
+            # Cita sin duración válida: ocupa un turno completo desde su inicio
+            fin = inicio + duracion
+        if intervalos and inicio <= intervalos[-1][1]:
+            intervalos[-1][1] = max(intervalos[-1][1], fin)
+        else:
+            intervalos.append([inicio, fin])
+    return intervalos
+
+
+def _ocupado(ocupados, inicios, inicio, fin):
+    # Primer intervalo que podría solaparse: el anterior al que empieza en o después de `fin`
+    posicion = bisect_left(inicios, fin) - 1
+    return posicion >= 0 and ocupados[posicion][1] > inicio
+
+
+def calcular_slots(horarios, ocupados, duracion):
+    """
+    Turnos libres de `duracion` segundos dentro de los horarios (pares de
+    TimeField) que no se solapan con ningún intervalo ocupado. Ningún turno
+    termina después del fin de su horario.
+    """
+    inicios = [inicio for inicio, _ in ocupados]
+    slots = []
+    for hora_inicio, hora_fin in horarios:
+        inicio, limite = _segundos(hora_inicio), _segundos(hora_fin)
+        while inicio + duracion <= limite:
+            if not _ocupado(ocupados, inicios, inicio, inicio + duracion):
+                slots.append((inicio, inicio + duracion))
+            inicio += duracion
+    return slots
+
+
+def formatear_slots(slots):
+    return [
+        {"hora_inicio": _hora(inicio).strftime('%H:%M'), "hora_fin": _hora(fin).strftime('%H:%M')}
+        for inicio, fin in slots
+    ]
+
+
+def ocupacion(**filtros):
+    """
+    Citas activas y reservas temporales vigentes que cumplen los filtros, en
+    una sola consulta: tuplas (doctor_id, fecha, hora_inicio, hora_fin,
+    expira); `expira` es None para las citas.
+    """
+    campos = ('doctor_id', 'fecha', 'hora_inicio', 'hora_fin', 'expira_reserva')
+    citas = Cita.objects.filter(estado__in=ESTADOS_OCUPADOS, **filtros).annotate(
+        expira_reserva=Value(None, output_field=DateTimeField())
+    ).values_list(*campos)
+    reservas = ReservaTemporal.objects.filter(expira__gt=timezone.now(), **filtros).annotate(
+        expira_reserva=F('expira')
+    ).values_list(*campos)
+    return citas.union(reservas, all=True)
+
+
+def excepciones(doctores, desde, hasta):
+    """
+    Excepciones de horario que afectan a los doctores entre `desde` y `hasta`,
+    con una consulta para todo el rango (índices por doctor y por clínica y
+    fecha_fin). Retorna (días cerrados, tramos bloqueados): un conjunto de
+    pares (doctor_id, fecha) y {(doctor_id, fecha): [(hora_inicio, hora_fin)]}.
+    """
+    por_clinica = defaultdict(list)
+    for doctor in doctores:
+        por_clinica[doctor.clinica_id].append(doctor.pk)
+    doctor_ids = [doctor_id for ids in por_clinica.values() for doctor_id in ids]
+
+    cerrados, bloqueos = set(), defaultdict(list)
+    for doctor_id, clinica_id, fecha_inicio, fecha_fin, hora_inicio, hora_fin in ExcepcionHorario.objects.filter(
+        Q(doctor_id__in=doctor_ids) | Q(clinica_id__in=list(por_clinica)) | Q(doctor__isnull=True, clinica__isnull=True),
+        fecha_fin__gte=desde, fecha_inicio__lte=hasta,
+    ).values_list('doctor_id', 'clinica_id', 'fecha_inicio', 'fecha_fin', 'hora_inicio', 'hora_fin'):
+        afectados = [doctor_id] if doctor_id else por_clinica[clinica_id] if clinica_id else doctor_ids
+        fecha = max(fecha_inicio, desde)
+        while fecha <= min(fecha_fin, hasta):
+            for afectado in afectados:
+                if hora_inicio is None:
+                    cerrados.add((afectado, fecha))
+                else:
+                    bloqueos[afectado, fecha].append((hora_inicio, hora_fin))
+            fecha += timedelta(days=1)
+    return cerrados, bloqueos
+
+
+def _turnos_inventario(doctores, desde, hasta):
+    """
+    Turnos libres del inventario entre `desde` y `hasta`, con tres consultas
+    por rango de índice: {(doctor_id, fecha): [(inicio, fin)]} con todos los
+    días que el doctor atiende (aunque no le quede ninguno libre) y la
+    expiración de la primera reserva temporal. Las reservas vigentes y las
+    excepciones de horario ocupan los turnos con los que se solapan.
+    """
+    doctor_ids = [doctor.pk for doctor in doctores]
+    libres = {}
+    for doctor_id, fecha, hora_inicio, hora_fin, cita_id in (
+        Turno.objects.filter(doctor_id__in=doctor_ids, fecha__range=(desde, hasta))
+        .order_by('fecha', 'hora_inicio')
+        .values_list('doctor_id', 'fecha', 'hora_inicio', 'hora_fin', 'cita_id')
+    ):
+        dia = libres.setdefault((doctor_id, fecha), [])
+        if cita_id is None:
+            inicio = _segundos(hora_inicio)
+            dia.append((inicio, inicio + (_segundos(hora_fin) - inicio) % SEGUNDOS_DIA))
+
+    cerrados, bloqueos = excepciones(doctores, desde, hasta)
+    for clave in cerrados:
+        if clave in libres:
+            libres[clave] = []
+    expira = None
+    for doctor_id, fecha, hora_inicio, hora_fin, vence in ReservaTemporal.objects.filter(
+        doctor_id__in=doctor_ids, fecha__range=(desde, hasta), expira__gt=timezone.now()
+    ).values_list('doctor_id', 'fecha', 'hora_inicio', 'hora_fin', 'expira'):
+        bloqueos[doctor_id, fecha].append((hora_inicio, hora_fin))
+        expira = vence if expira is None else min(expira, vence)
+    for clave, bloqueados in bloqueos.items():
+        if libres.get(clave):
+            ocupados = intervalos_ocupados(bloqueados, duracion_slot())
+            inicios = [inicio for inicio, _ in ocupados]
+            libres[clave] = [
+                (inicio, fin) for inicio, fin in libres[clave] if not _ocupado(ocupados, inicios, inicio, fin)
+            ]
+    return libres, expira
+
+
+def _calcular_dia(doctor, fecha, duracion, inventario=False):
+    """Turnos libres del día y la expiración de la primera reserva temporal (o None)"""
+    if inventario:
+        libres, expira = _turnos_inventario([doctor], fecha, fecha)
+        slots = libres.get((doctor.pk, fecha))
+        return (formatear_slots(slots) if slots is not None else None), expira
+
+    horarios = list(
+        Horario.objects.filter(doctor=doctor, dia_semana=fecha.weekday(), activo=True)
+        .order_by('hora_inicio')
+        .values_list('hora_inicio', 'hora_fin')
+    )
+    if not horarios:
+        return None, None
+    cerrados, bloqueos = excepciones([doctor], fecha, fecha)
+    if cerrados:
+        return [], None
+
+    ocupados = list(ocupacion(doctor_id=doctor.pk, fecha=fecha))
+    expira = min((fila[4] for fila in ocupados if fila[4] is not None), default=None)
+    intervalos = intervalos_ocupados(
+        [(fila[2], fila[3]) for fila in ocupados] + bloqueos[doctor.pk, fecha], duracion
+    )
+    return formatear_slots(calcular_slots(horarios, intervalos, duracion)), expira
+
+
+def _version_key(doctor_id, fecha=None):
+    return f'disponibilidad:version:{doctor_id}' + (f':{fecha}' if fecha else '')
+
+
+def _cache_key(doctor_id, fecha):
+    """
+    Clave del día con la versión del doctor (horarios) y la del día (citas y
+    reservas). Las versiones nuevas parten de un valor único, de modo que
+    perder una versión de la caché nunca vuelve a exponer resultados antiguos.
+    """
+    keys = [_version_key(doctor_id), _version_key(doctor_id, fecha)]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), timeout=None)
+            versions[key] = cache.get(key)
+    return f'disponibilidad:{doctor_id}:{fecha}:{versions[keys[0]]}:{versions[keys[1]]}'
+
+
+def _bump(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, time.time_ns(), timeout=None)
+
+
+def invalidar_dia(doctor_id, fecha):
+    """Descarta los turnos en caché del doctor en esa fecha (cambios de citas o reservas)"""
+    transaction.on_commit(lambda: _bump(_version_key(doctor_id, fecha)))
+
+
+def invalidar_doctor(doctor_id):
+    """Descarta todos los días en caché del doctor (cambios de horarios o del doctor)"""
+    transaction.on_commit(lambda: _bump(_version_key(doctor_id)))
+
+
+def slots_en_cache(doctor_id, fecha):
+    """
+    Turnos del día si están en caché, sin consultar la base de datos. Retorna
+    una tupla (encontrado, slots); slots es None si el doctor no atiende ese día.
+    """
+    cached = cache.get(_cache_key(doctor_id, fecha))
+    if cached is None:
+        return False, None
+    return True, cached[1]
+
+
+def slots_disponibles(doctor, fecha):
+    """
+    Turnos libres del doctor en la fecha, con tres consultas (horarios,
+    excepciones y ocupación, o inventario, excepciones y reservas) sea cual
+    sea el número de turnos. Los turnos duran lo que las citas del doctor
+    (duracion_doctor). Retorna None si el doctor no atiende ese día de la
+    semana y [] si una excepción lo cierra.
+
+    Las reservas temporales vigentes cuentan como ocupadas. El resultado se
+    guarda en caché por (doctor, fecha) hasta que cambian sus citas, reservas,
+    horarios o excepciones, o hasta que vence la primera reserva. Si varios
+    procesos piden el mismo día a la vez, sólo uno lo calcula y los demás
+    esperan su resultado.
+    """
+    duracion = duracion_doctor(doctor)
+    key = _cache_key(doctor.pk, fecha)
+    cached = cache.get(key)
+    if cached is not None and cached[0] == duracion:
+        return cached[1]
+
+    lock_key = f'{key}:lock'
+    locked = cache.add(lock_key, 1, timeout=LOCK_TIMEOUT)
+    if not locked:
+        deadline = time.monotonic() + LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL)
+            cached = cache.get(key)
+            if cached is not None and cached[0] == duracion:
+                return cached[1]
+        # El otro proceso tarda demasiado: se calcula sin esperar más
+
+    try:
+        slots, expira = _calcular_dia(doctor, fecha, duracion, en_inventario(fecha))
+        timeout = getattr(settings, 'CLINICAS_AVAILABILITY_CACHE_TTL', 300)
+        if expira is not None:
+            timeout = max(1, min(timeout, int((expira - timezone.now()).total_seconds()) + 1))
+        cache.set(key, (duracion, slots), timeout=timeout)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return slots
+
+
+def _horarios_por_doctor_y_dia(doctor_ids):
+    horarios = defaultdict(list)
+    for doctor_id, dia_semana, hora_inicio, hora_fin in (
+        Horario.objects.filter(doctor_id__in=doctor_ids, activo=True)
+        .order_by('hora_inicio')
+        .values_list('doctor_id', 'dia_semana', 'hora_inicio', 'hora_fin')
+    ):
+        horarios[doctor_id, dia_semana].append((hora_inicio, hora_fin))
+    return horarios
+
+
+def _ocupacion_por_doctor_y_fecha(doctores, desde, hasta):
+    """
+    Días cerrados por excepciones y tramos ocupados por (doctor_id, fecha):
+    citas activas, reservas vigentes y bloqueos parciales
+    """
+    cerrados, ocupados = excepciones(doctores, desde, hasta)
+    for doctor_id, fecha, hora_inicio, hora_fin, _ in ocupacion(
+        doctor_id__in=[doctor.pk for doctor in doctores], fecha__range=(desde, hasta)
+    ):
+        ocupados[doctor_id, fecha].append((hora_inicio, hora_fin))
+    return cerrados, ocupados
+
+
+def proximos_slots(doctores, desde, hasta, limite):
+    """
+    Los `limite` primeros turnos libres entre `desde` y `hasta` (inclusive) de
+    cualquiera de los doctores, ordenados por fecha, hora y doctor; cada uno
+    con la duración de citas de su doctor. Los horarios se cargan en una
+    consulta y las citas y excepciones (o los turnos del inventario) por lotes
+    de días; la búsqueda termina en cuanto se completa un día con turnos
+    suficientes. Nunca ofrece turnos que ya empezaron.
+    Retorna tuplas (fecha, doctor_id, {"hora_inicio", "hora_fin"}).
+    """
+    doctores = list(doctores)
+    por_doctor = {doctor.pk: duracion_doctor(doctor) for doctor in doctores}
+    doctor_ids = list(por_doctor)
+    ahora = timezone.localtime()
+    desde = max(desde, ahora.date())
+    horarios = _horarios_por_doctor_y_dia(doctor_ids)
+    dias_con_horario = {dia_semana for _, dia_semana in horarios}
+
+    encontrados = []
+    lote_desde = desde
+    while lote_desde <= hasta and len(encontrados) < limite:
+        lote_hasta = min(lote_desde + timedelta(days=DIAS_POR_LOTE - 1), hasta)
+        if en_inventario(lote_desde, lote_hasta):
+            libres, _ = _turnos_inventario(doctores, lote_desde, lote_hasta)
+            fechas = sorted({fecha for _, fecha in libres})
+        else:
+            libres = None
+            fechas = [
+                lote_desde + timedelta(days=dias) for dias in range((lote_hasta - lote_desde).days + 1)
+                if (lote_desde + timedelta(days=dias)).weekday() in dias_con_horario
+            ]
+            cerrados, citas = _ocupacion_por_doctor_y_fecha(doctores, lote_desde, lote_hasta) if fechas else ((), {})
+
+        for fecha in fechas:
+            minimo = _segundos(ahora.time()) if fecha == ahora.date() else 0
+            del_dia = []
+            for doctor_id in doctor_ids:
+                if libres is not None:
+                    slots = libres.get((doctor_id, fecha), ())
+                else:
+                    horarios_dia = horarios.get((doctor_id, fecha.weekday()))
+                    if not horarios_dia or (doctor_id, fecha) in cerrados:
+                        continue
+                    ocupados = intervalos_ocupados(citas.get((doctor_id, fecha), ()), por_doctor[doctor_id])
+                    slots = calcular_slots(horarios_dia, ocupados, por_doctor[doctor_id])
+                del_dia.extend((inicio, doctor_id, fin) for inicio, fin in slots if inicio >= minimo)
+            del_dia.sort()
+            encontrados.extend(
+                (fecha, doctor_id, formatear_slots([(inicio, fin)])[0]) for inicio, doctor_id, fin in del_dia
+            )
+            if len(encontrados) >= limite:
+                break
+        lote_desde = lote_hasta + timedelta(days=1)
+
+    return encontrados[:limite]
+
+
+def calendario(doctor, desde, hasta):
+    """
+    Turnos libres por día del doctor entre `desde` y `hasta` (inclusive), con
+    tres consultas para todo el rango: horarios, excepciones y ocupación (o
+    inventario, excepciones y reservas). Retorna pares (fecha, turnos
+    libres); los días sin horario o cerrados por una excepción tienen 0.
+    """
+    duracion = duracion_doctor(doctor)
+    doctor_id = doctor.pk
+    if en_inventario(desde, hasta):
+        libres, _ = _turnos_inventario([doctor], desde, hasta)
+        return [
+            (fecha, len(libres.get((doctor_id, fecha), ())))
+            for fecha in (desde + timedelta(days=dias) for dias in range((hasta - desde).days + 1))
+        ]
+
+    horarios = _horarios_por_doctor_y_dia([doctor_id])
+    cerrados, citas = _ocupacion_por_doctor_y_fecha([doctor], desde, hasta) if horarios else ((), {})
+
+    dias = []
+    for dias_desde in range((hasta - desde).days + 1):
+        fecha = desde + timedelta(days=dias_desde)
+        horarios_dia = horarios.get((doctor_id, fecha.weekday()))
+        libres = 0
+        if horarios_dia and (doctor_id, fecha) not in cerrados:
+            ocupados = intervalos_ocupados(citas.get((doctor_id, fecha), ()), duracion)
+            libres = len(calcular_slots(horarios_dia, ocupados, duracion))
+        dias.append((fecha, libres))
+    return dias
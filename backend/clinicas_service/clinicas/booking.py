@@ -0,0 +1,246 @@
+import secrets
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Exists, Q, Value, When
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from rest_framework.exceptions import APIException
+from .availability import (
+    _horarios_por_doctor_y_dia, en_inventario, excepciones, invalidar_dia, inventario_activo, ocupacion,
+    slots_disponibles,
+)
+from .models import ESTADOS_OCUPADOS, Cita, Doctor, ExcepcionHorario, ReservaTemporal, Turno
+
+# Máximo de citas de una serie
+MAX_CITAS_SERIE = 52
+
+
+class TurnoOcupado(APIException):
+    status_code = 409
+    default_detail = 'La hora seleccionada ya no está disponible'
+    default_code = 'turno_ocupado'
+
+
+class ReservaAjena(APIException):
+    status_code = 403
+    default_detail = 'La conversación ya tiene una reserva y el token no corresponde'
+    default_code = 'reserva_ajena'
+
+
+class LimiteReservas(APIException):
+    status_code = 429
+    default_detail = 'Demasiadas reservas temporales activas desde este origen'
+    default_code = 'limite_reservas'
+
+
+def _viola_turno_unico(exc):
+    """True si el IntegrityError lo provocó la restricción cita_turno_unico"""
+    # PostgreSQL (psycopg) informa el nombre de la restricción
+    diag = getattr(exc.__cause__, 'diag', None)
+    if getattr(diag, 'constraint_name', None):
+        return diag.constraint_name == 'cita_turno_unico'
+
+    # MySQL cita el índice por su nombre; SQLite sólo las columnas
+    restriccion = next(c for c in Cita._meta.constraints if c.name == 'cita_turno_unico')
+    columnas = ', '.join(
+        f"{Cita._meta.db_table}.{Cita._meta.get_field(campo).column}" for campo in restriccion.fields
+    )
+    mensaje = str(exc)
+    return 'cita_turno_unico' in mensaje or mensaje == f'UNIQUE constraint failed: {columnas}'
+
+
+@contextmanager
+def agenda_bloqueada(doctor_id):
+    """
+    Transacción con la fila del doctor bloqueada (SELECT ... FOR UPDATE): las
+    reservas de un mismo doctor se atienden de una en una en lugar de competir
+    y fallar. Si aun así la restricción cita_turno_unico rechaza la cita, se
+    responde 409; cualquier otro error de integridad se propaga.
+    """
+    try:
+        with transaction.atomic():
+            list(Doctor.objects.select_for_update().filter(pk=doctor_id).values_list('pk', flat=True))
+            yield
+    except IntegrityError as exc:
+        if not _viola_turno_unico(exc):
+            raise
+        raise TurnoOcupado() from exc
+
+
+def verificar_turno_libre(doctor_id, fecha, hora_inicio, hora_fin, excluir=None, chat_session_id=None):
+    """
+    Lanza TurnoOcupado si otra cita activa, una reserva temporal vigente o
+    una excepción de horario del doctor se solapa con [hora_inicio, hora_fin).
+    Las reservas de `chat_session_id` no cuentan: son de quien está
+    reservando. Si la fecha está en el inventario de turnos, las citas las
+    comprueba ocupar_turnos.
+    """
+    solapa = Q(doctor_id=doctor_id, fecha=fecha, hora_inicio__lt=hora_fin, hora_fin__gt=hora_inicio)
+    reservas = ReservaTemporal.objects.filter(solapa, expira__gt=timezone.now())
+    if chat_session_id:
+        reservas = reservas.exclude(chat_session_id=chat_session_id)
+    if reservas.exists():
+        raise TurnoOcupado()
+    if ExcepcionHorario.objects.filter(
+        Q(doctor_id=doctor_id) | Q(clinica__doctores=doctor_id) | Q(doctor__isnull=True, clinica__isnull=True),
+        Q(hora_inicio__isnull=True) | Q(hora_inicio__lt=hora_fin, hora_fin__gt=hora_inicio),
+        fecha_inicio__lte=fecha, fecha_fin__gte=fecha,
+    ).exists():
+        raise TurnoOcupado()
+    if not en_inventario(fecha):
+        citas = Cita.objects.filter(solapa, estado__in=ESTADOS_OCUPADOS)
+        if excluir is not None:
+            citas = citas.exclude(pk=excluir)
+        if citas.exists():
+            raise TurnoOcupado()
+
+
+def ocupar_turnos(cita, nueva=False):
+    """
+    Con el inventario activo, la cita toma los turnos que cubre con un solo
+    UPDATE condicional, que no asigna nada si alguno ya tiene otra cita. Si
+    no toma ninguno (ocupados o fuera del horario) lanza TurnoOcupado y
+    agenda_bloqueada deshace la transacción. Una cita existente suelta antes
+    los turnos que tenía.
+    """
+    if not inventario_activo():
+        return
+    if not nueva:
+        Turno.objects.filter(cita=cita).update(cita=None)
+    if cita.estado not in ESTADOS_OCUPADOS or not en_inventario(cita.fecha):
+        return
+    solapa = Q(
+        doctor_id=cita.doctor_id, fecha=cita.fecha, hora_inicio__lt=cita.hora_fin, hora_fin__gt=cita.hora_inicio
+    )
+    tomados = Turno.objects.filter(solapa, cita__isnull=True).filter(
+        ~Exists(Turno.objects.filter(solapa, cita__isnull=False))
+    ).update(cita=cita)
+    if not tomados:
+        raise TurnoOcupado()
+
+
+def retener_turno(doctor, fecha, hora_inicio, hora_fin, chat_session_id, token=None, ip=''):
+    """
+    Reserva el turno para la conversación durante CLINICAS_HOLD_TTL segundos.
+    Cada conversación retiene un solo turno: el anterior se libera, pero sólo
+    si se presenta su `token` (ReservaAjena si no). Un mismo `ip` no puede
+    tener más de CLINICAS_MAX_HOLDS_PER_IP reservas vigentes (LimiteReservas).
+    Sólo se retienen turnos que aún no han empezado y que slots_disponibles
+    ofrece (dentro del horario, sin excepciones ni otras citas o reservas).
+    La reserva creada lleva el token que la identifica ante los demás
+    endpoints: el chat_session_id lo elige el cliente y puede adivinarse.
+    """
+    ahora = timezone.now()
+    if timezone.make_aware(datetime.combine(fecha, hora_inicio)) <= ahora:
+        raise TurnoOcupado('La hora seleccionada ya pasó')
+
+    with agenda_bloqueada(doctor.pk):
+        vigentes = ReservaTemporal.objects.filter(expira__gt=ahora)
+        anterior = vigentes.filter(chat_session_id=chat_session_id).first()
+        if anterior is not None and not (token and constant_time_compare(anterior.token, token)):
+            raise ReservaAjena()
+        maximo = getattr(settings, 'CLINICAS_MAX_HOLDS_PER_IP', 3)
+        if ip and vigentes.filter(ip=ip).exclude(chat_session_id=chat_session_id).count() >= maximo:
+            raise LimiteReservas()
+
+        liberadas, _ = ReservaTemporal.objects.filter(
+            Q(chat_session_id=chat_session_id) | Q(doctor_id=doctor.pk, fecha=fecha, expira__lte=ahora)
+        ).delete()
+        if liberadas:
+            # La caché del día aún cuenta la reserva anterior de la conversación
+            invalidar_dia(doctor.pk, fecha)
+        turno = {"hora_inicio": hora_inicio.strftime('%H:%M'), "hora_fin": hora_fin.strftime('%H:%M')}
+        if turno not in (slots_disponibles(doctor, fecha) or []):
+            raise TurnoOcupado()
+        verificar_turno_libre(doctor.pk, fecha, hora_inicio, hora_fin, chat_session_id=chat_session_id)
+        return ReservaTemporal.objects.create(
+            doctor_id=doctor.pk, fecha=fecha, hora_inicio=hora_inicio, hora_fin=hora_fin,
+            chat_session_id=chat_session_id, ip=ip,
+            token=anterior.token if anterior is not None else secrets.token_urlsafe(24),
+            expira=ahora + timedelta(seconds=getattr(settings, 'CLINICAS_HOLD_TTL', 180)),
+        )
+
+
+def reserva_propia(chat_session_id, token):
+    """True si la conversación tiene una reserva y `token` es el suyo"""
+    return bool(chat_session_id and token) and ReservaTemporal.objects.filter(
+        chat_session_id=chat_session_id, token=token
+    ).exists()
+
+
+def liberar_turnos(chat_session_id, token):
+    """Libera los turnos retenidos por la conversación si `token` es el suyo; retorna cuántos había"""
+    if not token:
+        return 0
+    liberados, _ = ReservaTemporal.objects.filter(chat_session_id=chat_session_id, token=token).delete()
+    return liberados
+
+
+def guardar_cita(serializer):
+    """Crea o actualiza una cita desde CitaSerializer comprobando el turno con la agenda bloqueada"""
+    instance = serializer.instance
+    datos = {
+        campo: serializer.validated_data.get(campo, getattr(instance, campo, None))
+        for campo in ('doctor', 'fecha', 'hora_inicio', 'hora_fin', 'estado')
+    }
+    with agenda_bloqueada(datos['doctor'].pk):
+        if (datos['estado'] or 'programada') in ESTADOS_OCUPADOS:
+            verificar_turno_libre(
+                datos['doctor'].pk, datos['fecha'], datos['hora_inicio'], datos['hora_fin'],
+                excluir=instance.pk if instance else None
+            )
+        cita = serializer.save()
+        ocupar_turnos(cita, nueva=instance is None)
+        return cita
+
+
+def reservar_serie(doctor, paciente, fechas, hora_inicio, hora_fin, motivo, notas='', omitir_conflictos=False):
+    """
+    Reserva la misma hora del doctor en todas las fechas de una serie con la
+    agenda bloqueada: una consulta de horarios, una de excepciones, una de
+    ocupación y un solo bulk_create, sean cuantas sean las fechas. Retorna (citas creadas,
+    conflictos), con los conflictos como pares (fecha, motivo). Si hay
+    conflictos y no se omiten no se crea ninguna cita.
+    """
+    with agenda_bloqueada(doctor.pk):
+        horarios = _horarios_por_doctor_y_dia([doctor.pk])
+        cerrados, bloqueos = excepciones([doctor], min(fechas), max(fechas))
+        ocupadas = defaultdict(list)
+        for _, fecha, ocupada_inicio, ocupada_fin, _ in ocupacion(doctor_id=doctor.pk, fecha__in=fechas):
+            ocupadas[fecha].append((ocupada_inicio, ocupada_fin))
+
+        libres, conflictos = [], []
+        for fecha in fechas:
+            # La cita entera debe caber en uno de los horarios del día
+            horarios_dia = horarios.get((doctor.pk, fecha.weekday()), ())
+            if not any(inicio <= hora_inicio and hora_fin <= fin for inicio, fin in horarios_dia):
+                conflictos.append((fecha, 'fuera_de_horario'))
+            elif (doctor.pk, fecha) in cerrados or any(
+                inicio < hora_fin and fin > hora_inicio for inicio, fin in bloqueos[doctor.pk, fecha]
+            ):
+                conflictos.append((fecha, 'excepcion'))
+            elif any(inicio < hora_fin and fin > hora_inicio for inicio, fin in ocupadas[fecha]):
+                conflictos.append((fecha, 'ocupado'))
+            else:
+                libres.append(fecha)
+        if not libres or (conflictos and not omitir_conflictos):
+            return [], conflictos
+
+        # bulk_create no envía señales: la caché y el inventario se actualizan aquí
+        citas = Cita.objects.bulk_create([
+            Cita(paciente=paciente, doctor=doctor, fecha=fecha, hora_inicio=hora_inicio, hora_fin=hora_fin,
+                 motivo=motivo, notas=notas)
+            for fecha in libres
+        ])
+        for fecha in libres:
+            invalidar_dia(doctor.pk, fecha)
+        if inventario_activo():
+            # Un solo UPDATE asigna a cada turno la cita de su fecha
+            Turno.objects.filter(
+                doctor_id=doctor.pk, fecha__in=libres, hora_inicio__lt=hora_fin, hora_fin__gt=hora_inicio,
+                cita__isnull=True
+            ).update(cita=Case(*(When(fecha=cita.fecha, then=Value(cita.pk)) for cita in citas)))
+    return citas, conflictos
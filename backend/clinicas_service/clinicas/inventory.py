@@ -0,0 +1,86 @@
+from datetime import timedelta
+from django.db.models import Q
+from django.utils import timezone
+from .availability import (
+    _horarios_por_doctor_y_dia, _hora, _segundos, calcular_slots, duraciones, fin_inventario, invalidar_doctor,
+)
+from .booking import agenda_bloqueada
+from .models import ESTADOS_OCUPADOS, Cita, Doctor, Turno
+
+LOTE = 1000
+
+
+def regenerar_turnos(doctor_ids=None, desde=None, hasta=None, dias_semana=None):
+    """
+    Expande los horarios activos en turnos del inventario, con la duración de
+    citas de cada doctor, entre `desde` (hoy por defecto; nunca antes) y
+    `hasta` (fin_inventario() por defecto), sólo para los días de la semana
+    indicados si se pasan. Es incremental: crea los turnos que faltan, borra
+    los libres que ya no están en el horario y corrige los que cubren una
+    cita activa o apuntan a una que ya no lo está.
+    Los turnos con una cita activa nunca se borran. Cada doctor se procesa con
+    su agenda bloqueada. Retorna (creados, eliminados).
+    """
+    hoy = timezone.localdate()
+    desde = max(desde or hoy, hoy)
+    hasta = hasta or fin_inventario()
+    if doctor_ids is None:
+        doctor_ids = list(Doctor.objects.values_list('pk', flat=True))
+    horarios = _horarios_por_doctor_y_dia(doctor_ids)
+    por_doctor = duraciones(doctor_ids)
+
+    filtro = Q(fecha__range=(desde, hasta))
+    fechas = [desde + timedelta(days=dias) for dias in range((hasta - desde).days + 1)]
+    if dias_semana is not None:
+        # iso_week_day: 1 es lunes, como dia_semana 0
+        filtro &= Q(fecha__iso_week_day__in=[dia + 1 for dia in dias_semana])
+        fechas = [fecha for fecha in fechas if fecha.weekday() in dias_semana]
+
+    creados = eliminados = 0
+    for doctor_id, duracion in por_doctor.items():
+        with agenda_bloqueada(doctor_id):
+            citas = {}
+            for pk, fecha, hora_inicio, hora_fin in Cita.objects.filter(
+                filtro, doctor_id=doctor_id, estado__in=ESTADOS_OCUPADOS
+            ).values_list('pk', 'fecha', 'hora_inicio', 'hora_fin'):
+                citas.setdefault(fecha, []).append((_segundos(hora_inicio), _segundos(hora_fin), pk))
+
+            def cita_de(fecha, inicio, fin):
+                return next(
+                    (pk for cita_inicio, cita_fin, pk in citas.get(fecha, ()) if cita_inicio < fin and cita_fin > inicio),
+                    None
+                )
+
+            existentes = {
+                (turno.fecha, turno.hora_inicio): turno
+                for turno in Turno.objects.filter(filtro, doctor_id=doctor_id)
+            }
+            nuevos, cambiados = [], []
+            for fecha in fechas:
+                horarios_dia = horarios.get((doctor_id, fecha.weekday()))
+                if not horarios_dia:
+                    continue
+                for inicio, fin in calcular_slots(horarios_dia, [], duracion):
+                    hora_inicio, hora_fin, cita_id = _hora(inicio), _hora(fin), cita_de(fecha, inicio, fin)
+                    turno = existentes.pop((fecha, hora_inicio), None)
+                    if turno is None:
+                        nuevos.append(Turno(
+                            doctor_id=doctor_id, fecha=fecha, hora_inicio=hora_inicio, hora_fin=hora_fin,
+                            cita_id=cita_id
+                        ))
+                    elif (turno.hora_fin, turno.cita_id) != (hora_fin, cita_id):
+                        turno.hora_fin, turno.cita_id = hora_fin, cita_id
+                        cambiados.append(turno)
+
+            # Lo que queda fuera del horario se borra salvo que lo ocupe una cita activa
+            activas = {pk for dia in citas.values() for _, _, pk in dia}
+            obsoletos = [turno.pk for turno in existentes.values() if turno.cita_id not in activas]
+
+            for inicio in range(0, len(obsoletos), LOTE):
+                eliminados += Turno.objects.filter(pk__in=obsoletos[inicio:inicio + LOTE]).delete()[0]
+            Turno.objects.bulk_update(cambiados, ['hora_fin', 'cita'], batch_size=LOTE)
+            creados += len(Turno.objects.bulk_create(nuevos, batch_size=LOTE))
+            if obsoletos or cambiados or nuevos:
+                # Las operaciones en bloque no envían señales
+                invalidar_doctor(doctor_id)
+    return creados, eliminados
@@ -0,0 +1,24 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from clinicas.availability import fin_inventario
+from clinicas.inventory import regenerar_turnos
+from clinicas.models import Turno
+
+
+class Command(BaseCommand):
+    help = 'Genera el inventario de turnos de los próximos días a partir de los horarios (ejecutar a diario)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dias', type=int, help='Días a cubrir desde hoy (por defecto CLINICAS_SLOT_INVENTORY_DAYS)')
+        parser.add_argument('--doctor', type=int, action='append', dest='doctores', help='Sólo este doctor (repetible)')
+
+    def handle(self, *args, **options):
+        hoy = timezone.localdate()
+        hasta = hoy + timedelta(days=options['dias'] - 1) if options['dias'] else fin_inventario()
+        # Los turnos libres de días pasados ya no sirven
+        pasados, _ = Turno.objects.filter(fecha__lt=hoy, cita__isnull=True).delete()
+        creados, eliminados = regenerar_turnos(options['doctores'], hasta=hasta)
+        self.stdout.write(self.style.SUCCESS(
+            f'{creados} turnos creados, {eliminados + pasados} eliminados (hasta {hasta})'
+        ))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from clinicas.models import ReservaTemporal
+
+
+class Command(BaseCommand):
+    help = 'Elimina las reservas temporales de turnos que ya expiraron'
+
+    def handle(self, *args, **options):
+        deleted, _ = ReservaTemporal.objects.filter(expira__lte=timezone.now()).delete()
+        self.stdout.write(self.style.SUCCESS(f'{deleted} reservas temporales expiradas eliminadas'))
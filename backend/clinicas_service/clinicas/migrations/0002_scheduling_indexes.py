@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinicas', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(fields=['doctor', 'fecha', 'hora_inicio'], name='cita_doctor_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(fields=['-fecha', 'hora_inicio'], name='cita_fecha_hora_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cita',
+            index=models.Index(condition=models.Q(('chat_session_id__isnull', False)), fields=['chat_session_id'], name='cita_chat_session_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='horario',
+            index=models.Index(condition=models.Q(('activo', True)), fields=['doctor', 'dia_semana', 'hora_inicio'], name='horario_activo_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paciente',
+            index=models.Index(fields=['email'], name='paciente_email_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paciente',
+            index=models.Index(condition=models.Q(('auth_user_id__isnull', False)), fields=['auth_user_id'], name='paciente_auth_user_idx'),
+        ),
+    ]
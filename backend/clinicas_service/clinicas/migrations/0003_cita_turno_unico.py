@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinicas', '0002_scheduling_indexes'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='cita',
+            constraint=models.UniqueConstraint(condition=models.Q(('estado__in', ('programada', 'confirmada', 'reprogramada'))), fields=('doctor', 'fecha', 'hora_inicio'), name='cita_turno_unico'),
+        ),
+    ]
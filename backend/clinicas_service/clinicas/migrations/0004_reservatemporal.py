@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinicas', '0003_cita_turno_unico'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReservaTemporal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('hora_inicio', models.TimeField()),
+                ('hora_fin', models.TimeField()),
+                ('chat_session_id', models.CharField(db_index=True, max_length=100)),
+                ('expira', models.DateTimeField(db_index=True)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservas_temporales', to='clinicas.doctor')),
+            ],
+            options={
+                'verbose_name': 'Reserva temporal',
+                'verbose_name_plural': 'Reservas temporales',
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'fecha', 'hora_inicio'), name='reserva_temporal_turno_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinicas', '0004_reservatemporal'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Turno',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('hora_inicio', models.TimeField()),
+                ('hora_fin', models.TimeField()),
+                ('cita', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='turnos', to='clinicas.cita')),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='turnos', to='clinicas.doctor')),
+            ],
+            options={
+                'verbose_name': 'Turno',
+                'verbose_name_plural': 'Turnos',
+                'ordering': ['fecha', 'hora_inicio'],
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'fecha', 'hora_inicio'), name='turno_inventario_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinicas', '0005_turno_inventario'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctor',
+            name='duracion_cita',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Duración de las citas en minutos (vacío: la de la especialidad)', null=True),
+        ),
+        migrations.AddField(
+            model_name='especialidad',
+            name='duracion_cita',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Duración de las citas en minutos (vacío: CLINICAS_SLOT_MINUTES)', null=True),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinicas', '0006_duracion_cita'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExcepcionHorario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('vacaciones', 'Vacaciones'), ('feriado', 'Feriado'), ('cierre', 'Cierre'), ('bloqueo', 'Bloqueo')], default='bloqueo', max_length=20)),
+                ('fecha_inicio', models.DateField()),
+                ('fecha_fin', models.DateField()),
+                ('hora_inicio', models.TimeField(blank=True, null=True)),
+                ('hora_fin', models.TimeField(blank=True, null=True)),
+                ('motivo', models.CharField(blank=True, max_length=200)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('clinica', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='excepciones', to='clinicas.clinica')),
+                ('doctor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='excepciones', to='clinicas.doctor')),
+            ],
+            options={
+                'verbose_name': 'Excepción de horario',
+                'verbose_name_plural': 'Excepciones de horario',
+                'indexes': [models.Index(fields=['doctor', 'fecha_fin'], name='excepcion_doctor_fecha_idx'), models.Index(fields=['clinica', 'fecha_fin'], name='excepcion_clinica_fecha_idx')],
+                'constraints': [models.CheckConstraint(condition=models.Q(('fecha_fin__gte', models.F('fecha_inicio'))), name='excepcion_fechas_validas'), models.CheckConstraint(condition=models.Q(('doctor__isnull', True), ('clinica__isnull', True), _connector='OR'), name='excepcion_doctor_o_clinica'), models.CheckConstraint(condition=models.Q(models.Q(('hora_fin__isnull', True), ('hora_inicio__isnull', True)), ('hora_inicio__lt', models.F('hora_fin')), _connector='OR'), name='excepcion_horas_validas')],
+            },
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:17
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinicas', '0007_excepcionhorario'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='doctor',
+            name='duracion_cita',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Duración de las citas en minutos (vacío: la de la especialidad)', null=True, validators=[django.core.validators.MinValueValidator(5)]),
+        ),
+        migrations.AlterField(
+            model_name='especialidad',
+            name='duracion_cita',
+            field=models.PositiveSmallIntegerField(blank=True, help_text='Duración de las citas en minutos (vacío: CLINICAS_SLOT_MINUTES)', null=True, validators=[django.core.validators.MinValueValidator(5)]),
+        ),
+    ]
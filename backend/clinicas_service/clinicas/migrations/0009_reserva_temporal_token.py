@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 10:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinicas', '0008_duracion_cita_minima'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='reservatemporal',
+            name='ip',
+            field=models.CharField(blank=True, db_index=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='reservatemporal',
+            name='token',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
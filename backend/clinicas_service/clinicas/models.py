@@ -1,4 +1,12 @@
+from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models import F, Q
+
+# Estados de cita que ocupan el turno del doctor
+ESTADOS_OCUPADOS = ('programada', 'confirmada', 'reprogramada')
+
+# Duración mínima configurable de una cita, en minutos
+DURACION_MINIMA_CITA = 5
 
 class Clinica(models.Model):
     """Modelo principal para clínicas/consultorios médicos"""
@@ -32,6 +40,10 @@ class Especialidad(models.Model):
     descripcion = models.TextField(blank=True, null=True)
     icono = models.CharField(max_length=50, blank=True, null=True)
     clinica = models.ForeignKey(Clinica, on_delete=models.CASCADE, related_name='especialidades')
+    duracion_cita = models.PositiveSmallIntegerField(
+        blank=True, null=True, validators=[MinValueValidator(DURACION_MINIMA_CITA)],
+        help_text="Duración de las citas en minutos (vacío: CLINICAS_SLOT_MINUTES)"
+    )
     activo = models.BooleanField(default=True)
     
     class Meta:
@@ -56,6 +68,10 @@ class Doctor(models.Model):
     clinica = models.ForeignKey(Clinica, on_delete=models.CASCADE, related_name='doctores')
     numero_colegiado = models.CharField(max_length=50, blank=True, null=True)
     biografia = models.TextField(blank=True, null=True)
+    duracion_cita = models.PositiveSmallIntegerField(
+        blank=True, null=True, validators=[MinValueValidator(DURACION_MINIMA_CITA)],
+        help_text="Duración de las citas en minutos (vacío: la de la especialidad)"
+    )
     
     # Estado
     activo = models.BooleanField(default=True)
@@ -101,6 +117,12 @@ class Paciente(models.Model):
     class Meta:
         verbose_name = "Paciente"
         verbose_name_plural = "Pacientes"
+        indexes = [
+            # Búsqueda del paciente por email al reservar desde el chatbot
+            models.Index(fields=['email'], name='paciente_email_idx'),
+            models.Index(fields=['auth_user_id'], condition=Q(auth_user_id__isnull=False),
+                         name='paciente_auth_user_idx'),
+        ]
     
     def __str__(self):
         return f"{self.nombre} {self.apellidos}"
@@ -125,11 +147,60 @@ class Horario(models.Model):
         verbose_name = "Horario"
         verbose_name_plural = "Horarios"
         unique_together = ('doctor', 'dia_semana', 'hora_inicio')
+        indexes = [
+            # Horarios vigentes de un día de la semana, ya ordenados por hora
+            models.Index(fields=['doctor', 'dia_semana', 'hora_inicio'], condition=Q(activo=True),
+                         name='horario_activo_idx'),
+        ]
     
     def __str__(self):
         dias = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo']
         return f"{self.doctor} - {dias[self.dia_semana]} {self.hora_inicio} a {self.hora_fin}"
 
+class ExcepcionHorario(models.Model):
+    """
+    Cierre o bloqueo de la agenda entre dos fechas (inclusive): de un doctor
+    (vacaciones), de una clínica o, sin ninguno de los dos, de todas
+    (feriados). Sin horas se cierra el día completo; con horas, sólo ese tramo
+    de cada día.
+    """
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, null=True, blank=True, related_name='excepciones')
+    clinica = models.ForeignKey(Clinica, on_delete=models.CASCADE, null=True, blank=True, related_name='excepciones')
+    tipo = models.CharField(max_length=20, choices=[
+        ('vacaciones', 'Vacaciones'),
+        ('feriado', 'Feriado'),
+        ('cierre', 'Cierre'),
+        ('bloqueo', 'Bloqueo')
+    ], default='bloqueo')
+    fecha_inicio = models.DateField()
+    fecha_fin = models.DateField()
+    hora_inicio = models.TimeField(blank=True, null=True)
+    hora_fin = models.TimeField(blank=True, null=True)
+    motivo = models.CharField(max_length=200, blank=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "Excepción de horario"
+        verbose_name_plural = "Excepciones de horario"
+        indexes = [
+            # Excepciones que siguen vigentes en un rango: fecha_fin >= desde
+            models.Index(fields=['doctor', 'fecha_fin'], name='excepcion_doctor_fecha_idx'),
+            models.Index(fields=['clinica', 'fecha_fin'], name='excepcion_clinica_fecha_idx'),
+        ]
+        constraints = [
+            models.CheckConstraint(condition=Q(fecha_fin__gte=F('fecha_inicio')), name='excepcion_fechas_validas'),
+            models.CheckConstraint(condition=Q(doctor__isnull=True) | Q(clinica__isnull=True),
+                                   name='excepcion_doctor_o_clinica'),
+            models.CheckConstraint(
+                condition=Q(hora_inicio__isnull=True, hora_fin__isnull=True) | Q(hora_inicio__lt=F('hora_fin')),
+                name='excepcion_horas_validas'
+            ),
+        ]
+    
+    def __str__(self):
+        ambito = self.doctor or self.clinica or 'Todas las clínicas'
+        return f"{ambito} - {self.get_tipo_display()} {self.fecha_inicio} a {self.fecha_fin}"
+
 class Cita(models.Model):
     """Citas médicas programadas"""
     paciente = models.ForeignKey(Paciente, on_delete=models.CASCADE, related_name='citas')
@@ -157,6 +228,71 @@ class Cita(models.Model):
     class Meta:
         verbose_name = "Cita"
         verbose_name_plural = "Citas"
+        indexes = [
+            # Ocupación de un doctor por día. No es parcial por estado: SQLite no
+            # usa índices parciales cuando la condición llega como parámetro
+            models.Index(fields=['doctor', 'fecha', 'hora_inicio'], name='cita_doctor_fecha_idx'),
+            # Orden del listado de CitaViewSet
+            models.Index(fields=['-fecha', 'hora_inicio'], name='cita_fecha_hora_idx'),
+            models.Index(fields=['chat_session_id'], condition=Q(chat_session_id__isnull=False),
+                         name='cita_chat_session_idx'),
+        ]
+        constraints = [
+            # Un turno del doctor sólo puede tener una cita activa
+            models.UniqueConstraint(fields=['doctor', 'fecha', 'hora_inicio'], condition=Q(estado__in=ESTADOS_OCUPADOS),
+                                    name='cita_turno_unico'),
+        ]
+    
+    def __str__(self):
+        return f"{self.paciente} con {self.doctor} - {self.fecha} {self.hora_inicio}"
+
+class ReservaTemporal(models.Model):
+    """
+    Turno retenido para una conversación del chatbot mientras el paciente
+    completa sus datos. Cuenta como ocupado hasta `expira`; al crear la cita
+    desde la misma conversación, con su token, la reserva se elimina.
+    """
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='reservas_temporales')
+    fecha = models.DateField()
+    hora_inicio = models.TimeField()
+    hora_fin = models.TimeField()
+    chat_session_id = models.CharField(max_length=100, db_index=True)
+    # Secreto que se entrega al crear la reserva: el chat_session_id lo elige el cliente
+    token = models.CharField(max_length=64, blank=True, default='')
+    ip = models.CharField(max_length=100, blank=True, default='', db_index=True)
+    expira = models.DateTimeField(db_index=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        verbose_name = "Reserva temporal"
+        verbose_name_plural = "Reservas temporales"
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'fecha', 'hora_inicio'], name='reserva_temporal_turno_unico'),
+        ]
+    
+    def __str__(self):
+        return f"{self.doctor} - {self.fecha} {self.hora_inicio} ({self.chat_session_id})"
+
+
+class Turno(models.Model):
+    """
+    Turno concreto del inventario (CLINICAS_SLOT_INVENTORY): los horarios
+    semanales expandidos en filas para los próximos días. Está libre mientras
+    `cita` sea nula; reservar es asignarle la cita con un UPDATE condicional.
+    """
+    doctor = models.ForeignKey(Doctor, on_delete=models.CASCADE, related_name='turnos')
+    fecha = models.DateField()
+    hora_inicio = models.TimeField()
+    hora_fin = models.TimeField()
+    cita = models.ForeignKey(Cita, on_delete=models.SET_NULL, null=True, blank=True, related_name='turnos')
+    
+    class Meta:
+        verbose_name = "Turno"
+        verbose_name_plural = "Turnos"
+        ordering = ['fecha', 'hora_inicio']
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'fecha', 'hora_inicio'], name='turno_inventario_unico'),
+        ]
     
     def __str__(self):
-        return f"{self.paciente} con {self.doctor} - {self.fecha} {self.hora_inicio}"
\ No newline at end of file
+        return f"{self.doctor} - {self.fecha} {self.hora_inicio}"
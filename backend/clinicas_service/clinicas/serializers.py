@@ -1,6 +1,35 @@
+from datetime import datetime, timedelta
+from django.utils import timezone
 from rest_framework import serializers
+from authentication.loaders import get_user_loader
+from .availability import duracion_doctor
+from .booking import MAX_CITAS_SERIE
 from .models import Clinica, Especialidad, Doctor, Paciente, Horario, Cita
 
+def expand_auth_user(request):
+    return request is not None and 'auth_user' in request.query_params.get('expand', '').split(',')
+
+class AuthUserListSerializer(serializers.ListSerializer):
+    """Pide a auth_service los usuarios de toda la lista en un solo lote"""
+    def to_representation(self, data):
+        request = self.context.get('request')
+        if expand_auth_user(request):
+            # Se evalúa una sola vez: la misma lista se serializa después
+            data = list(data.all() if hasattr(data, 'all') else data)
+            get_user_loader(request).prime(item.auth_user_id for item in data)
+        return super().to_representation(data)
+
+class AuthUserMixin:
+    """Con ?expand=auth_user añade `auth_user`, los datos de la cuenta en auth_service"""
+    def get_fields(self):
+        fields = super().get_fields()
+        if expand_auth_user(self.context.get('request')):
+            fields['auth_user'] = serializers.SerializerMethodField()
+        return fields
+    
+    def get_auth_user(self, obj):
+        return get_user_loader(self.context['request']).load(obj.auth_user_id)
+
 class ClinicaSerializer(serializers.ModelSerializer):
     class Meta:
         model = Clinica
@@ -10,7 +39,7 @@ class ClinicaSerializer(serializers.ModelSerializer):
 class EspecialidadSerializer(serializers.ModelSerializer):
     class Meta:
         model = Especialidad
-        fields = ['id', 'nombre', 'descripcion', 'icono', 'clinica', 'activo']
+        fields = ['id', 'nombre', 'descripcion', 'icono', 'clinica', 'duracion_cita', 'activo']
 
 class HorarioSerializer(serializers.ModelSerializer):
     dia_semana_nombre = serializers.SerializerMethodField()
@@ -23,7 +52,7 @@ class HorarioSerializer(serializers.ModelSerializer):
         dias = ['Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes', 'Sábado', 'Domingo']
         return dias[obj.dia_semana]
 
-class DoctorSerializer(serializers.ModelSerializer):
+class DoctorSerializer(AuthUserMixin, serializers.ModelSerializer):
     especialidad_nombre = serializers.ReadOnlyField(source='especialidad.nombre')
     clinica_nombre = serializers.ReadOnlyField(source='clinica.nombre')
     horarios = HorarioSerializer(many=True, read_only=True)
@@ -32,14 +61,16 @@ class DoctorSerializer(serializers.ModelSerializer):
         model = Doctor
         fields = ['id', 'nombre', 'apellidos', 'email', 'telefono', 'foto',
                   'especialidad', 'especialidad_nombre', 'clinica', 'clinica_nombre',
-                  'numero_colegiado', 'biografia', 'activo', 'horarios']
+                  'numero_colegiado', 'biografia', 'duracion_cita', 'activo', 'horarios']
+        list_serializer_class = AuthUserListSerializer
 
-class PacienteSerializer(serializers.ModelSerializer):
+class PacienteSerializer(AuthUserMixin, serializers.ModelSerializer):
     class Meta:
         model = Paciente
         fields = ['id', 'nombre', 'apellidos', 'fecha_nacimiento', 'genero',
                   'email', 'telefono', 'direccion', 'tipo_sangre', 'alergias',
                   'clinica', 'fecha_registro']
+        list_serializer_class = AuthUserListSerializer
 
 class CitaSerializer(serializers.ModelSerializer):
     doctor_nombre = serializers.SerializerMethodField()
@@ -55,4 +86,49 @@ class CitaSerializer(serializers.ModelSerializer):
         return f"Dr. {obj.doctor.nombre} {obj.doctor.apellidos}"
     
     def get_paciente_nombre(self, obj):
-        return f"{obj.paciente.nombre} {obj.paciente.apellidos}"
\ No newline at end of file
+        return f"{obj.paciente.nombre} {obj.paciente.apellidos}"
+
+class SerieCitasSerializer(serializers.Serializer):
+    """
+    Serie de citas a la misma hora cada `intervalo_semanas` semanas desde
+    `fecha_inicio`: `repeticiones` veces o hasta `fecha_fin`. Cada cita dura
+    lo que las citas del doctor; `hora_fin`, si se indica, debe coincidir.
+    """
+    paciente = serializers.PrimaryKeyRelatedField(queryset=Paciente.objects.all())
+    doctor = serializers.PrimaryKeyRelatedField(queryset=Doctor.objects.filter(activo=True).select_related('especialidad'))
+    fecha_inicio = serializers.DateField()
+    hora_inicio = serializers.TimeField()
+    hora_fin = serializers.TimeField(required=False)
+    intervalo_semanas = serializers.IntegerField(min_value=1, max_value=52, default=1)
+    repeticiones = serializers.IntegerField(min_value=1, max_value=MAX_CITAS_SERIE, required=False)
+    fecha_fin = serializers.DateField(required=False)
+    motivo = serializers.CharField()
+    notas = serializers.CharField(required=False, allow_blank=True, default='')
+    omitir_conflictos = serializers.BooleanField(default=False)
+    
+    def validate(self, data):
+        if ('repeticiones' in data) == ('fecha_fin' in data):
+            raise serializers.ValidationError("Indique 'repeticiones' o 'fecha_fin'")
+        if data['fecha_inicio'] < timezone.localdate():
+            raise serializers.ValidationError("'fecha_inicio' no puede ser una fecha pasada")
+        
+        paso = timedelta(weeks=data['intervalo_semanas'])
+        if 'fecha_fin' in data:
+            if data['fecha_fin'] < data['fecha_inicio']:
+                raise serializers.ValidationError("'fecha_fin' no puede ser anterior a 'fecha_inicio'")
+            repeticiones = (data['fecha_fin'] - data['fecha_inicio']) // paso + 1
+            if repeticiones > MAX_CITAS_SERIE:
+                raise serializers.ValidationError(f"Una serie no puede tener más de {MAX_CITAS_SERIE} citas")
+        else:
+            repeticiones = data['repeticiones']
+        data['fechas'] = [data['fecha_inicio'] + paso * i for i in range(repeticiones)]
+        
+        duracion = timedelta(seconds=duracion_doctor(data['doctor']))
+        hora_fin = (datetime.combine(data['fecha_inicio'], data['hora_inicio']) + duracion).time()
+        if hora_fin <= data['hora_inicio']:
+            raise serializers.ValidationError("La cita debe terminar el mismo día")
+        if data.setdefault('hora_fin', hora_fin) != hora_fin:
+            raise serializers.ValidationError(
+                f"Las citas del doctor duran {int(duracion.total_seconds()) // 60} minutos"
+            )
+        return data
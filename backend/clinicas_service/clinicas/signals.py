@@ -0,0 +1,117 @@
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .availability import inventario_activo, invalidar_dia, invalidar_doctor
+from .inventory import regenerar_turnos
+from .models import ESTADOS_OCUPADOS, Cita, Doctor, Especialidad, ExcepcionHorario, Horario, ReservaTemporal, Turno
+
+
+@receiver(pre_save, sender=Cita)
+def remember_previous_day(sender, instance, **kwargs):
+    """Guarda el día anterior de la cita para invalidarlo también si se reprograma"""
+    instance._dia_anterior = (
+        Cita.objects.filter(pk=instance.pk).values_list('doctor_id', 'fecha').first()
+        if instance.pk is not None else None
+    )
+
+
+@receiver(post_save, sender=Cita)
+@receiver(post_delete, sender=Cita)
+def cita_changed(sender, instance, **kwargs):
+    """Crear, cambiar de estado, reprogramar o borrar una cita invalida sólo los días afectados"""
+    invalidar_dia(instance.doctor_id, instance.fecha)
+    anterior = getattr(instance, '_dia_anterior', None)
+    if anterior and anterior != (instance.doctor_id, instance.fecha):
+        invalidar_dia(*anterior)
+
+
+@receiver(post_save, sender=Cita)
+def release_inventory_slots(sender, instance, **kwargs):
+    """Una cita cancelada o completada (también desde el admin) suelta sus turnos del inventario"""
+    if inventario_activo() and instance.estado not in ESTADOS_OCUPADOS:
+        Turno.objects.filter(cita=instance).update(cita=None)
+
+
+@receiver(post_save, sender=ReservaTemporal)
+@receiver(post_delete, sender=ReservaTemporal)
+def reserva_temporal_changed(sender, instance, **kwargs):
+    invalidar_dia(instance.doctor_id, instance.fecha)
+
+
+@receiver(post_save, sender=Horario)
+@receiver(post_delete, sender=Horario)
+@receiver(post_save, sender=Doctor)
+@receiver(post_delete, sender=Doctor)
+def doctor_schedule_changed(sender, instance, **kwargs):
+    invalidar_doctor(instance.doctor_id if sender is Horario else instance.pk)
+
+
+@receiver(pre_save, sender=Horario)
+def remember_previous_weekday(sender, instance, **kwargs):
+    instance._dia_semana_anterior = (
+        Horario.objects.filter(pk=instance.pk).values_list('doctor_id', 'dia_semana').first()
+        if instance.pk is not None else None
+    )
+
+
+@receiver(post_save, sender=Horario)
+@receiver(post_delete, sender=Horario)
+def horario_changed(sender, instance, **kwargs):
+    """Con el inventario activo, regenera sólo los turnos futuros de los días de la semana afectados"""
+    if not inventario_activo():
+        return
+    anterior = getattr(instance, '_dia_semana_anterior', None)
+    if anterior and anterior != (instance.doctor_id, instance.dia_semana):
+        regenerar_turnos([anterior[0]], dias_semana=[anterior[1]])
+    regenerar_turnos([instance.doctor_id], dias_semana=[instance.dia_semana])
+
+
+@receiver(pre_save, sender=Doctor)
+@receiver(pre_save, sender=Especialidad)
+def remember_previous_duration(sender, instance, **kwargs):
+    instance._duracion_anterior = (
+        sender.objects.filter(pk=instance.pk).values_list('duracion_cita', flat=True).first()
+        if instance.pk is not None else None
+    )
+
+
+@receiver(post_save, sender=Doctor)
+@receiver(post_save, sender=Especialidad)
+def duration_changed(sender, instance, created, **kwargs):
+    """Otra duración de citas cambia todos los turnos de los doctores afectados"""
+    if created or instance._duracion_anterior == instance.duracion_cita:
+        return
+    if sender is Doctor:
+        doctor_ids = [instance.pk]
+    else:
+        # Los doctores con duración propia no cambian
+        doctor_ids = list(instance.doctores.filter(duracion_cita__isnull=True).values_list('pk', flat=True))
+        for doctor_id in doctor_ids:
+            invalidar_doctor(doctor_id)
+    if inventario_activo() and doctor_ids:
+        regenerar_turnos(doctor_ids)
+
+
+@receiver(pre_save, sender=ExcepcionHorario)
+def remember_previous_scope(sender, instance, **kwargs):
+    instance._ambito_anterior = (
+        ExcepcionHorario.objects.filter(pk=instance.pk).values_list('doctor_id', 'clinica_id').first()
+        if instance.pk is not None else None
+    )
+
+
+@receiver(post_save, sender=ExcepcionHorario)
+@receiver(post_delete, sender=ExcepcionHorario)
+def excepcion_changed(sender, instance, **kwargs):
+    """Descarta los días en caché de los doctores afectados: el doctor, los de la clínica o todos"""
+    ambitos = {(instance.doctor_id, instance.clinica_id), getattr(instance, '_ambito_anterior', None)} - {None}
+    doctores = Doctor.objects.none()
+    for doctor_id, clinica_id in ambitos:
+        if doctor_id:
+            doctores |= Doctor.objects.filter(pk=doctor_id)
+        elif clinica_id:
+            doctores |= Doctor.objects.filter(clinica_id=clinica_id)
+        else:
+            doctores = Doctor.objects.all()
+            break
+    for doctor_id in doctores.values_list('pk', flat=True):
+        invalidar_doctor(doctor_id)
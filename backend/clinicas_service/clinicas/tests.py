@@ -1,3 +1,566 @@
-from django.test import TestCase
+import re
+import threading
+from datetime import date, datetime, time, timedelta
+from unittest import mock, skipUnless
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection
+from django.db.models import Q
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory
 
-# Create your tests here.
+from . import availability
+from .booking import TurnoOcupado, agenda_bloqueada, verificar_turno_libre
+from .inventory import regenerar_turnos
+from .models import (
+    ESTADOS_OCUPADOS, Cita, Clinica, Doctor, Especialidad, ExcepcionHorario, Horario, Paciente, Turno,
+)
+from .views import CitaViewSet
+
+# Lunes
+FECHA = date(2030, 1, 7)
+
+
+def slots_por_cita_exacta(doctor, fecha):
+    """
+    Algoritmo anterior (una consulta por turno), como referencia de la salida
+    esperada, sin el turno que terminaba después del fin del horario
+    """
+    horarios = Horario.objects.filter(doctor=doctor, dia_semana=fecha.weekday(), activo=True)
+    citas = Cita.objects.filter(doctor=doctor, fecha=fecha, estado__in=['programada', 'confirmada', 'reprogramada'])
+    slots = []
+    for horario in horarios:
+        hora_actual = horario.hora_inicio
+        while hora_actual < horario.hora_fin:
+            siguiente = (datetime.combine(fecha, hora_actual) + timedelta(minutes=30)).time()
+            if siguiente > horario.hora_fin:
+                break
+            if not citas.filter(hora_inicio=hora_actual).exists():
+                slots.append({"hora_inicio": hora_actual.strftime('%H:%M'), "hora_fin": siguiente.strftime('%H:%M')})
+            hora_actual = siguiente
+    return slots
+
+
+class ClinicaTestData(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.clinica = Clinica.objects.create(
+            nombre='Clínica Central', direccion='Av. Principal 123', telefono='999888777',
+            horario_apertura=time(8), horario_cierre=time(20), auth_module_id=1, auth_submodule_id=1,
+        )
+        cls.especialidad = Especialidad.objects.create(nombre='Cardiología', clinica=cls.clinica)
+        cls.doctor = cls.crear_doctor('ana@clinica.pe')
+        cls.paciente = Paciente.objects.create(
+            nombre='Luis', apellidos='Quispe', fecha_nacimiento=date(1990, 5, 1), genero='M',
+            email='luis@example.com', telefono='987654321', clinica=cls.clinica,
+        )
+
+    def setUp(self):
+        # La caché de disponibilidad no se deshace con la transacción de cada test
+        cache.clear()
+        self.client = APIClient()
+
+    @classmethod
+    def crear_doctor(cls, email):
+        return Doctor.objects.create(
+            nombre='Ana', apellidos='Rojas', email=email, especialidad=cls.especialidad,
+            clinica=cls.clinica, auth_user_id=1,
+        )
+
+    def crear_cita(self, hora_inicio, hora_fin, estado='programada', doctor=None, fecha=FECHA):
+        return Cita.objects.create(
+            paciente=self.paciente, doctor=doctor or self.doctor, fecha=fecha,
+            hora_inicio=hora_inicio, hora_fin=hora_fin, motivo='Control', estado=estado,
+        )
+
+
+class AvailabilityEngineTests(ClinicaTestData):
+    def setUp(self):
+        super().setUp()
+        Horario.objects.create(doctor=self.doctor, dia_semana=0, hora_inicio=time(9), hora_fin=time(12))
+        Horario.objects.create(doctor=self.doctor, dia_semana=0, hora_inicio=time(15), hora_fin=time(16, 45))
+        self.crear_cita(time(9), time(9, 30))
+        self.crear_cita(time(10, 30), time(11), estado='confirmada')
+        self.crear_cita(time(15, 30), time(16), estado='cancelada')
+
+    def citas_disponibles(self, doctor):
+        return self.client.get(f'/api/doctores/{doctor.id}/citas_disponibles/', {'fecha': FECHA.isoformat()})
+
+    def test_both_endpoints_match_previous_output(self):
+        esperado = slots_por_cita_exacta(self.doctor, FECHA)
+        # El horario termina a las 16:45: el turno de 16:30 ya no cabe
+        self.assertEqual(esperado[-1], {"hora_inicio": "16:00", "hora_fin": "16:30"})
+
+        response = self.citas_disponibles(self.doctor)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, esperado)
+
+        response = self.client.get(
+            f'/api/clinicas/public/horarios-disponibles/doctor/{self.doctor.id}/', {'fecha': FECHA.isoformat()}
+        )
+        self.assertEqual(response.data['disponible'], esperado)
+
+        response = self.client.get(
+            f'/api/clinicas/public/horarios-disponibles/doctor/{self.doctor.id}/', {'fecha': '2030-01-08'}
+        )
+        self.assertEqual(response.data, {"disponible": [], "mensaje": "El doctor no atiende este día"})
+
+    def test_query_count_does_not_depend_on_slots(self):
+        otro = self.crear_doctor('luis@clinica.pe')
+        Horario.objects.create(doctor=otro, dia_semana=0, hora_inicio=time(7), hora_fin=time(22))
+        for hora in range(8, 20, 2):
+            self.crear_cita(time(hora), time(hora, 30), doctor=otro)
+
+        with CaptureQueriesContext(connection) as pocos:
+            self.citas_disponibles(self.doctor)
+        with CaptureQueriesContext(connection) as muchos:
+            response = self.citas_disponibles(otro)
+        self.assertEqual(len(response.data), 30 - 6)
+        self.assertEqual(len(muchos.captured_queries), len(pocos.captured_queries))
+        self.assertLessEqual(len(muchos.captured_queries), 4)
+
+    def test_longer_appointments_block_every_overlapping_slot(self):
+        self.crear_cita(time(11), time(12))
+        with self.settings(CLINICAS_SLOT_MINUTES=60):
+            response = self.citas_disponibles(self.doctor)
+        # 9:00, 10:00 y 11:00 se solapan con citas; la de 15:30 está cancelada y 16:00 no cabe
+        self.assertEqual(response.data, [{"hora_inicio": "15:00", "hora_fin": "16:00"}])
+
+    def test_durations_come_from_doctor_or_especialidad(self):
+        self.especialidad.duracion_cita = 45
+        self.especialidad.save()
+        horas = lambda: [slot['hora_inicio'] for slot in self.citas_disponibles(self.doctor).data]
+        self.assertEqual(horas(), ['09:45', '11:15', '15:00', '15:45'])
+
+        # Una cita de 45 minutos bloquea cualquier reserva que se solape, no sólo la de su misma hora
+        response = self.client.post('/api/clinicas/public/crear-cita/', {
+            'doctor_id': self.doctor.id, 'fecha': FECHA.isoformat(), 'hora_inicio': '09:45', 'nombre': 'Luis',
+            'apellidos': 'Quispe', 'email': 'luis@example.com', 'telefono': '987654321', 'motivo': 'Control',
+        }, format='json')
+        self.assertEqual(response.data['cita']['hora_fin'], '10:30:00')
+        self.assertRaises(TurnoOcupado, verificar_turno_libre, self.doctor.id, FECHA, time(10), time(10, 30))
+
+        self.doctor.duracion_cita = 60
+        with self.captureOnCommitCallbacks(execute=True):
+            self.doctor.save()
+        self.assertEqual(horas(), ['11:00', '15:00'])
+
+    def test_duration_has_a_minimum(self):
+        self.especialidad.duracion_cita = 4
+        with self.assertRaises(ValidationError):
+            self.especialidad.full_clean()
+        self.doctor.duracion_cita = 0
+        with self.assertRaises(ValidationError):
+            self.doctor.full_clean()
+        self.doctor.duracion_cita = 5
+        self.doctor.full_clean()
+
+
+class AgendaBloqueadaTests(ClinicaTestData):
+    def test_only_duplicate_slots_become_409(self):
+        self.crear_cita(time(9), time(9, 30))
+        with self.assertRaises(TurnoOcupado), agenda_bloqueada(self.doctor.id):
+            self.crear_cita(time(9), time(9, 30))
+
+        Turno.objects.create(doctor=self.doctor, fecha=FECHA, hora_inicio=time(10), hora_fin=time(10, 30))
+        with self.assertRaises(IntegrityError), agenda_bloqueada(self.doctor.id):
+            Turno.objects.create(doctor=self.doctor, fecha=FECHA, hora_inicio=time(10), hora_fin=time(10, 30))
+
+
+class AuthUserExpansionTests(ClinicaTestData):
+    def test_expanding_auth_user_adds_one_batch_call_and_no_queries(self):
+        self.crear_doctor('luis@clinica.pe')
+        with CaptureQueriesContext(connection) as sin_expandir:
+            self.client.get('/api/doctores/')
+
+        with mock.patch(
+            'authentication.auth_service.AuthServiceClient.get_users', return_value={1: {"id": 1}}
+        ) as get_users, CaptureQueriesContext(connection) as expandido:
+            response = self.client.get('/api/doctores/', {'expand': 'auth_user'})
+        self.assertEqual([doctor['auth_user'] for doctor in response.data], [{"id": 1}, {"id": 1}])
+        get_users.assert_called_once_with({1})
+        self.assertEqual(len(expandido.captured_queries), len(sin_expandir.captured_queries))
+
+
+class CambiarEstadoTests(ClinicaTestData):
+    def cambiar_estado(self, cita, estado):
+        request = APIRequestFactory().post(f'/api/citas/{cita.id}/cambiar_estado/', {'estado': estado})
+        # Lo que añade AuthMiddleware
+        request.user_permissions = {'can_view': True}
+        return CitaViewSet.as_view({'post': 'cambiar_estado'})(request, pk=cita.id)
+
+    def test_reactivating_checks_overlapping_citas(self):
+        Horario.objects.create(doctor=self.doctor, dia_semana=0, hora_inicio=time(9), hora_fin=time(12))
+        cancelada = self.crear_cita(time(9), time(10), estado='cancelada')
+        # Otra cita con distinto inicio ocupa parte del turno
+        self.crear_cita(time(9, 30), time(10))
+
+        response = self.cambiar_estado(cancelada, 'programada')
+        self.assertEqual(response.status_code, 409)
+        cancelada.refresh_from_db()
+        self.assertEqual(cancelada.estado, 'cancelada')
+
+        # Cambiar entre estados activos no vuelve a comprobar el turno
+        activa = self.crear_cita(time(11), time(11, 30))
+        response = self.cambiar_estado(activa, 'confirmada')
+        self.assertEqual(response.status_code, 200)
+
+
+class AvailabilityCacheTests(ClinicaTestData):
+    def setUp(self):
+        super().setUp()
+        Horario.objects.create(doctor=self.doctor, dia_semana=0, hora_inicio=time(9), hora_fin=time(10))
+
+    def horas(self, fecha=FECHA):
+        response = self.client.get(f'/api/doctores/{self.doctor.id}/citas_disponibles/', {'fecha': fecha.isoformat()})
+        return [slot['hora_inicio'] for slot in response.data]
+
+    def test_cache_hit_serves_both_endpoints_without_queries(self):
+        self.assertEqual(self.horas(), ['09:00', '09:30'])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.horas(), ['09:00', '09:30'])
+            response = self.client.get(
+                f'/api/clinicas/public/horarios-disponibles/doctor/{self.doctor.id}/', {'fecha': FECHA.isoformat()}
+            )
+        self.assertEqual(len(response.data['disponible']), 2)
+
+    def test_cita_and_horario_writes_invalidate_affected_days(self):
+        siguiente = FECHA + timedelta(days=7)
+        self.assertEqual(self.horas(), ['09:00', '09:30'])
+        self.assertEqual(self.horas(siguiente), ['09:00', '09:30'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            cita = self.crear_cita(time(9), time(9, 30))
+        self.assertEqual(self.horas(), ['09:30'])
+
+        # Reprogramar libera el día anterior y ocupa el nuevo
+        cita.fecha = siguiente
+        with self.captureOnCommitCallbacks(execute=True):
+            cita.save()
+        self.assertEqual(self.horas(), ['09:00', '09:30'])
+        self.assertEqual(self.horas(siguiente), ['09:30'])
+
+        # Como en CitaViewSet.cambiar_estado
+        cita.estado = 'cancelada'
+        with self.captureOnCommitCallbacks(execute=True):
+            cita.save()
+        self.assertEqual(self.horas(siguiente), ['09:00', '09:30'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Horario.objects.filter(doctor=self.doctor).first().delete()
+        self.assertEqual(self.horas(), [])
+
+    def test_concurrent_misses_wait_for_a_single_computation(self):
+        key = availability._cache_key(self.doctor.id, FECHA)
+        cache.add(f'{key}:lock', 1)
+        # Otro proceso termina el cálculo mientras esta petición espera
+        threading.Timer(0.1, cache.set, (key, (30 * 60, [{"hora_inicio": "09:00", "hora_fin": "09:30"}]))).start()
+
+        with mock.patch.object(availability, '_calcular_dia', wraps=availability._calcular_dia) as calcular:
+            slots = availability.slots_disponibles(self.doctor, FECHA)
+        calcular.assert_not_called()
+        self.assertEqual(slots, [{"hora_inicio": "09:00", "hora_fin": "09:30"}])
+
+
+class AvailabilityCalendarTests(ClinicaTestData):
+    def setUp(self):
+        super().setUp()
+        Horario.objects.create(doctor=self.doctor, dia_semana=0, hora_inicio=time(9), hora_fin=time(10))
+        Horario.objects.create(doctor=self.doctor, dia_semana=2, hora_inicio=time(9), hora_fin=time(9, 30))
+
+    def test_counts_free_slots_per_day_with_constant_queries(self):
+        self.crear_cita(time(9), time(9, 30))
+        self.crear_cita(time(9), time(9, 30), fecha=FECHA + timedelta(days=2))
+
+        # Doctor, horarios, excepciones y ocupación de todo el rango
+        with self.assertNumQueries(4):
+            response = self.client.get(
+                f'/api/doctores/{self.doctor.id}/fechas-disponibles/',
+                {'desde': FECHA.isoformat(), 'hasta': (FECHA + timedelta(days=89)).isoformat()}
+            )
+        self.assertEqual(len(response.data), 90)
+        self.assertEqual(
+            [(d['date'], d['available'], d['slots']) for d in response.data[:3]],
+            [('2030-01-07', True, 1), ('2030-01-08', False, 0), ('2030-01-09', False, 0)]
+        )
+        self.assertEqual(response.data[7], {"doctor": self.doctor.id, "date": "2030-01-14", "available": True, "slots": 2})
+
+        response = self.client.get(
+            '/api/available-dates/', {'doctor': self.doctor.id, 'desde': FECHA.isoformat(), 'hasta': FECHA.isoformat()}
+        )
+        self.assertEqual(response.data, [{"doctor": self.doctor.id, "date": "2030-01-07", "available": True, "slots": 1}])
+
+        response = self.client.get('/api/available-dates/', {'doctor': self.doctor.id, 'desde': FECHA.isoformat(),
+                                                             'hasta': (FECHA + timedelta(days=90)).isoformat()})
+        self.assertEqual(response.status_code, 400)
+
+    def test_frontend_route_only_offers_days_with_free_slots(self):
+        # El miércoles tiene horario pero su único turno está ocupado; el martes no tiene horario
+        self.crear_cita(time(9), time(9, 30), fecha=FECHA + timedelta(days=2))
+        response = self.client.get('/api/available-dates/', {
+            'doctor': self.doctor.id, 'desde': FECHA.isoformat(), 'hasta': (FECHA + timedelta(days=7)).isoformat()
+        })
+        self.assertEqual(
+            [(d['date'], d['available'], d['slots']) for d in response.data],
+            [('2030-01-07', True, 2), ('2030-01-14', True, 2)]
+        )
+
+
+class CitaSerieTests(ClinicaTestData):
+    def setUp(self):
+        super().setUp()
+        Horario.objects.create(doctor=self.doctor, dia_semana=0, hora_inicio=time(9), hora_fin=time(12))
+        self.crear_cita(time(9), time(9, 30), fecha=FECHA + timedelta(weeks=2))
+
+    def serie(self, **datos):
+        datos = {
+            'paciente': self.paciente.id, 'doctor': self.doctor.id, 'fecha_inicio': FECHA.isoformat(),
+            'hora_inicio': '09:00', 'motivo': 'Fisioterapia', **datos,
+        }
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/citas/serie/', datos, format='json')
+
+    def test_conflicts_are_reported_without_booking_anything(self):
+        response = self.serie(repeticiones=4)
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.data['conflictos'], [{"fecha": "2030-01-21", "motivo": "ocupado"}])
+        self.assertEqual(Cita.objects.count(), 1)
+
+        # Un martes no está en el horario del doctor
+        response = self.serie(fecha_inicio='2030-01-08', repeticiones=1)
+        self.assertEqual(response.data['conflictos'], [{"fecha": "2030-01-08", "motivo": "fuera_de_horario"}])
+        self.assertEqual(self.serie(repeticiones=2, fecha_fin='2030-02-01').status_code, 400)
+
+    def test_each_cita_must_fit_the_horario_and_the_doctor_duration(self):
+        # 11:45-12:15 empieza dentro del horario pero termina después
+        response = self.serie(hora_inicio='11:45', repeticiones=1)
+        self.assertEqual(response.data['conflictos'], [{"fecha": "2030-01-07", "motivo": "fuera_de_horario"}])
+
+        self.assertEqual(self.serie(hora_inicio='10:00', hora_fin='11:00', repeticiones=1).status_code, 400)
+        self.assertEqual(self.serie(hora_inicio='10:00', hora_fin='10:30', repeticiones=1).status_code, 201)
+
+        # Un lunes que ya pasó
+        self.assertEqual(self.serie(fecha_inicio='2020-01-06', repeticiones=1).status_code, 400)
+        self.assertEqual(Cita.objects.count(), 2)
+
+    def test_books_every_free_occurrence_with_constant_queries(self):
+        availability.slots_disponibles(self.doctor, FECHA)
+        with CaptureQueriesContext(connection) as pocas:
+            self.serie(hora_inicio='10:00', repeticiones=2)
+        with CaptureQueriesContext(connection) as muchas:
+            response = self.serie(hora_inicio='11:00', repeticiones=12)
+        self.assertEqual(len(muchas.captured_queries), len(pocas.captured_queries))
+        self.assertEqual(len(response.data['citas']), 12)
+
+        response = self.serie(fecha_fin='2030-02-04', intervalo_semanas=2, omitir_conflictos=True)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([cita['fecha'] for cita in response.data['citas']], ['2030-01-07', '2030-02-04'])
+        self.assertEqual(response.data['conflictos'], [{"fecha": "2030-01-21", "motivo": "ocupado"}])
+        self.assertEqual(response.data['citas'][0]['hora_fin'], '09:30:00')
+        # bulk_create no envía señales: la caché del día se invalida igual
+        self.assertEqual(
+            [slot['hora_inicio'] for slot in availability.slots_disponibles(self.doctor, FECHA)][:2],
+            ['09:30', '10:30']
+        )
+
+
+class ExcepcionHorarioTests(ClinicaTestData):
+    def setUp(self):
+        super().setUp()
+        otra_clinica = Clinica.objects.create(
+            nombre='Clínica Norte', direccion='Av. Norte 456', telefono='999777666',
+            horario_apertura=time(8), horario_cierre=time(20), auth_module_id=1, auth_submodule_id=1,
+        )
+        self.otro = Doctor.objects.create(
+            nombre='Luis', apellidos='Soto', email='luis@clinica.pe', especialidad=self.especialidad,
+            clinica=otra_clinica, auth_user_id=2,
+        )
+        for doctor in (self.doctor, self.otro):
+            Horario.objects.create(doctor=doctor, dia_semana=0, hora_inicio=time(9), hora_fin=time(11))
+
+    def horas(self, doctor=None, fecha=FECHA):
+        doctor = doctor or self.doctor
+        response = self.client.get(f'/api/doctores/{doctor.id}/citas_disponibles/', {'fecha': fecha.isoformat()})
+        return [slot['hora_inicio'] for slot in response.data]
+
+    def excepcion(self, **datos):
+        with self.captureOnCommitCallbacks(execute=True):
+            return ExcepcionHorario.objects.create(**datos)
+
+    def test_closures_and_blocks_apply_to_every_availability_path(self):
+        self.assertEqual(self.horas(), ['09:00', '09:30', '10:00', '10:30'])
+        self.excepcion(doctor=self.doctor, tipo='vacaciones', fecha_inicio=FECHA, fecha_fin=FECHA + timedelta(days=7))
+        self.excepcion(clinica=self.clinica, fecha_inicio=FECHA + timedelta(weeks=2),
+                       fecha_fin=FECHA + timedelta(weeks=2), hora_inicio=time(9, 30), hora_fin=time(10, 15))
+        self.excepcion(tipo='feriado', fecha_inicio=FECHA + timedelta(weeks=3), fecha_fin=FECHA + timedelta(weeks=3))
+
+        # La caché del día se invalida al crear la excepción
+        self.assertEqual(self.horas(), [])
+        self.assertEqual(self.horas(self.otro), ['09:00', '09:30', '10:00', '10:30'])
+        response = self.client.get(
+            f'/api/clinicas/public/horarios-disponibles/doctor/{self.doctor.id}/', {'fecha': FECHA.isoformat()}
+        )
+        self.assertEqual(response.data['disponible'], [])
+
+        self.assertEqual(
+            [libres for _, libres in availability.calendario(self.doctor, FECHA, FECHA + timedelta(weeks=3))[::7]],
+            [0, 0, 2, 0]
+        )
+        self.assertEqual(
+            [(fecha, slot['hora_inicio']) for fecha, doctor_id, slot in availability.proximos_slots(
+                [self.doctor, self.otro], FECHA + timedelta(days=1), FECHA + timedelta(weeks=3), 10
+            ) if doctor_id == self.doctor.id],
+            [(FECHA + timedelta(weeks=2), '09:00'), (FECHA + timedelta(weeks=2), '10:30')]
+        )
+
+    def test_booking_rejects_blocked_slots(self):
+        self.excepcion(doctor=self.doctor, fecha_inicio=FECHA, fecha_fin=FECHA,
+                       hora_inicio=time(10), hora_fin=time(11))
+        verificar_turno_libre(self.doctor.id, FECHA, time(9), time(9, 30))
+        self.assertRaises(TurnoOcupado, verificar_turno_libre, self.doctor.id, FECHA, time(9, 45), time(10, 15))
+
+        response = self.client.post('/api/citas/serie/', {
+            'paciente': self.paciente.id, 'doctor': self.doctor.id, 'fecha_inicio': FECHA.isoformat(),
+            'hora_inicio': '10:00', 'repeticiones': 2, 'motivo': 'Fisioterapia', 'omitir_conflictos': True,
+        }, format='json')
+        self.assertEqual(response.data['conflictos'], [{"fecha": "2030-01-07", "motivo": "excepcion"}])
+
+
+@override_settings(CLINICAS_SLOT_INVENTORY=True)
+class SlotInventoryTests(ClinicaTestData):
+    def setUp(self):
+        super().setUp()
+        # El inventario sólo cubre los próximos días: el lunes que viene
+        hoy = timezone.localdate()
+        self.lunes = hoy + timedelta(days=7 - hoy.weekday())
+        self.horario = Horario.objects.create(doctor=self.doctor, dia_semana=0, hora_inicio=time(9), hora_fin=time(10))
+        Horario.objects.create(doctor=self.doctor, dia_semana=2, hora_inicio=time(9), hora_fin=time(10))
+
+    def horas(self, **filtros):
+        return [hora.strftime('%H:%M') for hora in Turno.objects.filter(
+            doctor=self.doctor, **filtros
+        ).values_list('hora_inicio', flat=True)]
+
+    def reservar(self, hora_inicio, email='luis@example.com'):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post('/api/clinicas/public/crear-cita/', {
+                'doctor_id': self.doctor.id, 'fecha': self.lunes.isoformat(), 'hora_inicio': hora_inicio,
+                'nombre': 'Luis', 'apellidos': 'Quispe', 'email': email, 'telefono': '987654321', 'motivo': 'Control',
+            }, format='json')
+
+    def test_horario_writes_regenerate_only_affected_weekdays(self):
+        self.assertEqual(self.horas(fecha=self.lunes), ['09:00', '09:30'])
+        self.assertLessEqual(max(Turno.objects.values_list('fecha', flat=True)), availability.fin_inventario())
+        miercoles = set(Turno.objects.filter(fecha__iso_week_day=3).values_list('pk', flat=True))
+
+        self.horario.hora_fin = time(10, 30)
+        self.horario.save()
+        self.assertEqual(self.horas(fecha=self.lunes), ['09:00', '09:30', '10:00'])
+        self.assertEqual(set(Turno.objects.filter(fecha__iso_week_day=3).values_list('pk', flat=True)), miercoles)
+
+        # Sin horario se borran los turnos libres, pero no el de una cita activa
+        cita = self.crear_cita(time(9), time(9, 30), fecha=self.lunes)
+        self.assertEqual(regenerar_turnos([self.doctor.id]), (0, 0))
+        self.horario.delete()
+        self.assertEqual(list(Turno.objects.filter(fecha__iso_week_day=1).values_list('cita', flat=True)), [cita.pk])
+
+    def test_booking_claims_slots_and_availability_reads_the_inventory(self):
+        with self.assertNumQueries(3):
+            self.assertEqual(
+                [slot['hora_inicio'] for slot in availability.slots_disponibles(self.doctor, self.lunes)],
+                ['09:00', '09:30']
+            )
+
+        self.assertEqual(self.reservar('09:00').status_code, 201)
+        cita = Cita.objects.get()
+        self.assertEqual(self.horas(cita=cita), ['09:00'])
+        self.assertEqual(self.reservar('09:00', email='otra@example.com').status_code, 409)
+        # Fuera del horario no hay turno que reservar
+        self.assertEqual(self.reservar('11:00', email='otra@example.com').status_code, 409)
+        self.assertEqual(
+            [slot['hora_inicio'] for slot in availability.slots_disponibles(self.doctor, self.lunes)], ['09:30']
+        )
+
+        hasta = self.lunes + timedelta(days=6)
+        inventario = availability.calendario(self.doctor, self.lunes, hasta)
+        with self.settings(CLINICAS_SLOT_INVENTORY=False):
+            self.assertEqual(availability.calendario(self.doctor, self.lunes, hasta), inventario)
+        self.assertEqual(inventario[0], (self.lunes, 1))
+
+        # Cancelar la cita devuelve el turno al inventario
+        cita.estado = 'cancelada'
+        cita.save()
+        self.assertFalse(Turno.objects.filter(cita__isnull=False).exists())
+
+    def test_series_claim_their_slots(self):
+        response = self.client.post('/api/citas/serie/', {
+            'paciente': self.paciente.id, 'doctor': self.doctor.id, 'fecha_inicio': self.lunes.isoformat(),
+            'hora_inicio': '09:30', 'repeticiones': 3, 'motivo': 'Fisioterapia',
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            list(Turno.objects.filter(cita__isnull=False).values_list('fecha', 'cita__fecha')),
+            [(self.lunes + timedelta(weeks=semanas),) * 2 for semanas in range(3)]
+        )
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Los planes se comprueban con EXPLAIN QUERY PLAN de SQLite')
+class QueryPlanTests(ClinicaTestData):
+    """Las consultas frecuentes de agenda deben resolverse con índices, no recorriendo la tabla"""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        doctores = [cls.doctor] + [cls.crear_doctor(f'doctor{i}@clinica.pe') for i in range(4)]
+        Horario.objects.bulk_create([
+            Horario(doctor=doctor, dia_semana=dia, hora_inicio=time(9), hora_fin=time(13), activo=dia != 6)
+            for doctor in doctores for dia in range(7)
+        ])
+        estados = ['programada', 'confirmada', 'cancelada', 'completada']
+        Cita.objects.bulk_create([
+            Cita(paciente=cls.paciente, doctor=doctores[i % 5], fecha=FECHA + timedelta(days=i // 20),
+                 hora_inicio=time(9 + i // 5 % 4), hora_fin=time(9 + i // 5 % 4, 30), motivo='Control',
+                 estado=estados[i % 4], chat_session_id=f'chat-{i}' if i % 3 == 0 else None)
+            for i in range(600)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def assertUsesIndexes(self, queryset, sorted_by_index=False):
+        plan = queryset.explain()
+        scans = [line for line in plan.splitlines() if re.search(r'\bSCAN \w+$', line)]
+        self.assertEqual(scans, [], f'Recorrido completo de la tabla:\n{plan}')
+        if sorted_by_index:
+            self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_hot_queries_use_indexes(self):
+        self.assertUsesIndexes(Cita.objects.filter(
+            doctor=self.doctor, fecha=FECHA, estado__in=ESTADOS_OCUPADOS
+        ).values_list('hora_inicio', 'hora_fin'))
+        self.assertUsesIndexes(Cita.objects.filter(
+            doctor_id__in=[self.doctor.id], fecha__range=(FECHA, FECHA + timedelta(days=6)),
+            estado__in=ESTADOS_OCUPADOS
+        ))
+        self.assertUsesIndexes(Cita.objects.filter(
+            doctor=self.doctor, fecha=FECHA, hora_inicio=time(9), estado__in=ESTADOS_OCUPADOS
+        ))
+        self.assertUsesIndexes(availability.ocupacion(doctor_id=self.doctor.id, fecha=FECHA))
+        self.assertUsesIndexes(Cita.objects.filter(chat_session_id='chat-3'))
+        self.assertUsesIndexes(Cita.objects.order_by('-fecha', 'hora_inicio'), sorted_by_index=True)
+        self.assertUsesIndexes(
+            Horario.objects.filter(doctor=self.doctor, dia_semana=0, activo=True).order_by('hora_inicio')
+        )
+        self.assertUsesIndexes(Horario.objects.filter(doctor_id__in=[self.doctor.id], activo=True))
+        self.assertUsesIndexes(Turno.objects.filter(
+            doctor_id__in=[self.doctor.id], fecha__range=(FECHA, FECHA + timedelta(days=6))
+        ).values_list('hora_inicio', 'cita_id'))
+        self.assertUsesIndexes(ExcepcionHorario.objects.filter(
+            Q(doctor_id__in=[self.doctor.id]) | Q(clinica_id__in=[self.clinica.id])
+            | Q(doctor__isnull=True, clinica__isnull=True),
+            fecha_fin__gte=FECHA, fecha_inicio__lte=FECHA + timedelta(days=6)
+        ))
+        self.assertUsesIndexes(Paciente.objects.filter(email='luis@example.com'))
+        self.assertUsesIndexes(Paciente.objects.filter(auth_user_id=7))
@@ -1,13 +1,57 @@
 from rest_framework import viewsets, permissions, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view
 from rest_framework.response import Response
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from datetime import datetime, timedelta
-from .models import Clinica, Especialidad, Doctor, Paciente, Horario, Cita
+from .availability import MAX_DIAS_CALENDARIO, calendario, slots_disponibles, slots_en_cache
+from .booking import agenda_bloqueada, guardar_cita, ocupar_turnos, reservar_serie, verificar_turno_libre
+from .models import ESTADOS_OCUPADOS, Clinica, Especialidad, Doctor, Paciente, Horario, Cita
 from .serializers import (
     ClinicaSerializer, EspecialidadSerializer, DoctorSerializer,
-    PacienteSerializer, HorarioSerializer, CitaSerializer
+    PacienteSerializer, HorarioSerializer, CitaSerializer, SerieCitasSerializer
 )
 
+def _calendario_response(doctor, request, solo_disponibles=False):
+    """
+    Turnos libres por día del doctor en el rango `desde`-`hasta` (por defecto,
+    30 días desde hoy); con `solo_disponibles`, sólo los días con alguno libre
+    """
+    try:
+        desde = request.query_params.get('desde')
+        desde = datetime.strptime(desde, '%Y-%m-%d').date() if desde else timezone.localdate()
+        hasta = request.query_params.get('hasta')
+        hasta = datetime.strptime(hasta, '%Y-%m-%d').date() if hasta else desde + timedelta(days=29)
+    except ValueError:
+        return Response({"error": "Formato de fecha inválido. Use YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if hasta < desde or (hasta - desde).days >= MAX_DIAS_CALENDARIO:
+        return Response(
+            {"error": f"El rango de fechas debe ser de 1 a {MAX_DIAS_CALENDARIO} días"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    # Mismo formato que AvailableDate del frontend, más el número de turnos libres
+    return Response([
+        {"doctor": doctor.id, "date": fecha.isoformat(), "available": libres > 0, "slots": libres}
+        for fecha, libres in calendario(doctor, desde, hasta)
+        if libres or not solo_disponibles
+    ])
+
+@api_view(['GET'])
+def available_dates(request):
+    """
+    Días con turnos libres en la ruta que usa el frontend:
+    /api/available-dates/?doctor=<id>. El chatbot ofrece cada día que recibe,
+    así que se omiten los días sin horario o sin turnos libres.
+    """
+    doctor_id = request.query_params.get('doctor')
+    if not doctor_id or not doctor_id.isdigit():
+        return Response({"error": "Debe proporcionar el doctor"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    doctor = get_object_or_404(Doctor.objects.select_related('especialidad'), pk=doctor_id, activo=True)
+    return _calendario_response(doctor, request, solo_disponibles=True)
+
 class ClinicaViewSet(viewsets.ModelViewSet):
     queryset = Clinica.objects.filter(activo=True)
     serializer_class = ClinicaSerializer
@@ -54,7 +98,7 @@ class EspecialidadViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 class DoctorViewSet(viewsets.ModelViewSet):
-    queryset = Doctor.objects.filter(activo=True)
+    queryset = Doctor.objects.filter(activo=True).select_related('especialidad', 'clinica')
     serializer_class = DoctorSerializer
     
     def get_queryset(self):
@@ -79,50 +123,34 @@ class DoctorViewSet(viewsets.ModelViewSet):
         serializer = HorarioSerializer(horarios, many=True)
         return Response(serializer.data)
     
+    @action(detail=True, methods=['get'], url_path='fechas-disponibles')
+    def fechas_disponibles(self, request, pk=None):
+        return _calendario_response(self.get_object(), request)
+    
     @action(detail=True, methods=['get'])
     def citas_disponibles(self, request, pk=None):
-        doctor = self.get_object()
         fecha = request.query_params.get('fecha')
         
+        # Los días en caché sólo existen para doctores activos: un acierto no necesita cargar el doctor
+        try:
+            fecha_obj = datetime.strptime(fecha, '%Y-%m-%d').date() if fecha else None
+        except ValueError:
+            fecha_obj = None
+        if fecha_obj:
+            encontrado, slots = slots_en_cache(pk, fecha_obj)
+            if encontrado:
+                return Response(slots or [])
+        
+        doctor = self.get_object()
+        
         if not fecha:
             return Response({"error": "Debe proporcionar una fecha"}, status=status.HTTP_400_BAD_REQUEST)
         
         try:
             fecha_obj = datetime.strptime(fecha, '%Y-%m-%d').date()
-            dia_semana = fecha_obj.weekday()  # 0 es lunes, 6 es domingo
+            slots = slots_disponibles(doctor, fecha_obj)
             
-            # Obtener los horarios para ese día de la semana
-            horarios = Horario.objects.filter(doctor=doctor, dia_semana=dia_semana, activo=True)
-            
-            # Obtener citas ya programadas para ese día
-            citas_existentes = Cita.objects.filter(
-                doctor=doctor,
-                fecha=fecha_obj,
-                estado__in=['programada', 'confirmada', 'reprogramada']
-            )
-            
-            # Generar slots disponibles (asumiendo citas de 30 minutos)
-            slots_disponibles = []
-            
-            for horario in horarios:
-                hora_actual = horario.hora_inicio
-                while hora_actual < horario.hora_fin:
-                    # Verificar si ya existe una cita en este horario
-                    cita_existente = citas_existentes.filter(hora_inicio=hora_actual).exists()
-                    
-                    if not cita_existente:
-                        # Calcular hora de fin (30 minutos después)
-                        hora_fin = (datetime.combine(fecha_obj, hora_actual) + timedelta(minutes=30)).time()
-                        
-                        slots_disponibles.append({
-                            "hora_inicio": hora_actual.strftime('%H:%M'),
-                            "hora_fin": hora_fin.strftime('%H:%M')
-                        })
-                    
-                    # Avanzar 30 minutos
-                    hora_actual = (datetime.combine(fecha_obj, hora_actual) + timedelta(minutes=30)).time()
-            
-            return Response(slots_disponibles)
+            return Response(slots or [])
             
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
@@ -176,6 +204,38 @@ class CitaViewSet(viewsets.ModelViewSet):
         
         return queryset
     
+    def perform_create(self, serializer):
+        guardar_cita(serializer)
+    
+    def perform_update(self, serializer):
+        guardar_cita(serializer)
+    
+    @action(detail=False, methods=['post'])
+    def serie(self, request):
+        """
+        Reserva una serie de citas (p. ej. terapia semanal) en una transacción.
+        Con conflictos responde 409 con sus fechas y no crea ninguna, salvo
+        que `omitir_conflictos` pida reservar las demás.
+        """
+        serializer = SerieCitasSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        datos = serializer.validated_data
+        citas, conflictos = reservar_serie(
+            datos['doctor'], datos['paciente'], datos['fechas'], datos['hora_inicio'], datos['hora_fin'],
+            datos['motivo'], datos['notas'], datos['omitir_conflictos']
+        )
+        conflictos = [{"fecha": fecha.isoformat(), "motivo": motivo} for fecha, motivo in conflictos]
+        
+        if not citas:
+            return Response(
+                {"error": "Hay fechas de la serie sin turno disponible", "conflictos": conflictos},
+                status=status.HTTP_409_CONFLICT
+            )
+        return Response(
+            {"citas": CitaSerializer(citas, many=True).data, "conflictos": conflictos},
+            status=status.HTTP_201_CREATED
+        )
+    
     @action(detail=True, methods=['post'])
     def cambiar_estado(self, request, pk=None):
         cita = self.get_object()
@@ -187,7 +247,12 @@ class CitaViewSet(viewsets.ModelViewSet):
         if estado not in [e[0] for e in Cita._meta.get_field('estado').choices]:
             return Response({"error": "Estado inválido"}, status=status.HTTP_400_BAD_REQUEST)
         
-        cita.estado = estado
-        cita.save()
+        # Reactivar una cita puede chocar con otra que ocupó el turno (409)
+        with agenda_bloqueada(cita.doctor_id):
+            if estado in ESTADOS_OCUPADOS and cita.estado not in ESTADOS_OCUPADOS:
+                verificar_turno_libre(cita.doctor_id, cita.fecha, cita.hora_inicio, cita.hora_fin, excluir=cita.pk)
+            cita.estado = estado
+            cita.save()
+            ocupar_turnos(cita)
         
         return Response(CitaSerializer(cita).data)
\ No newline at end of file
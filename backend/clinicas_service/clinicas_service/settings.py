@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 from pathlib import Path
 import os
+from importlib.util import find_spec
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -31,8 +32,64 @@ ALLOWED_HOSTS = []
 
 # Configuración para auth_service
 AUTH_SERVICE_URL = 'http://localhost:8000'  # Cambia por la URL correcta
+# Access token de una cuenta de servicio (staff) de auth_service: los feeds internos lo exigen
 AUTH_SERVICE_TOKEN = 'esjmkhIWBHVRCqOrOGnLfMHVJ8VI4+puTIpRDXeEGDh2CcLlXHECFBZNCUpLPt9ISPo='  
 
+# Verificación local de los access tokens emitidos por auth_service.
+# Con HS256 se usa la clave compartida (JWT_SIGNING_KEY de auth_service); con
+# RS256/ES256 la clave pública, que se descarga de auth_service si no se define.
+# Si el token no puede verificarse localmente se consulta a auth_service.
+AUTH_JWT_LOCAL_VERIFICATION = True
+AUTH_JWT_ALGORITHM = os.environ.get('AUTH_JWT_ALGORITHM', 'HS256')
+AUTH_JWT_VERIFYING_KEY = os.environ.get('AUTH_JWT_VERIFYING_KEY', '')
+
+# Caché de introspección de tokens (segundos / número máximo de tokens)
+AUTH_INTROSPECTION_CACHE_TTL = 30
+AUTH_INTROSPECTION_NEGATIVE_TTL = 5
+AUTH_INTROSPECTION_CACHE_SIZE = 10000
+# Si auth_service no responde se sirve el último resultado durante este tiempo
+AUTH_INTROSPECTION_STALE_TTL = 300
+
+# Caché corta de los datos de usuario pedidos a auth_service (segundos / número máximo)
+AUTH_USER_CACHE_TTL = 10
+AUTH_USER_CACHE_SIZE = 10000
+
+# Transporte HTTP hacia auth_service (pool keep-alive, timeouts en segundos,
+# reintentos con jitter y circuit breaker)
+AUTH_SERVICE_POOL_SIZE = 20
+AUTH_SERVICE_CONNECT_TIMEOUT = 1.0
+AUTH_SERVICE_READ_TIMEOUT = 3.0
+AUTH_SERVICE_MAX_RETRIES = 2
+AUTH_SERVICE_RETRY_BACKOFF = 0.1
+AUTH_SERVICE_CIRCUIT_FAILURE_THRESHOLD = 5
+AUTH_SERVICE_CIRCUIT_RESET_TIMEOUT = 30
+
+# Los permisos incluidos en el token se usan mientras su versión sea la vigente;
+# las versiones se sincronizan con auth_service cada AUTH_PERMISSIONS_POLL_INTERVAL s
+AUTH_PERMISSIONS_POLL_INTERVAL = 15
+AUTH_PERMISSIONS_MAX_STALENESS = 120
+# Lista de revocación de tokens: sincronización incremental y estado completo
+AUTH_REVOCATION_POLL_INTERVAL = 15
+AUTH_REVOCATION_MAX_STALENESS = 120
+AUTH_REVOCATION_SNAPSHOT_INTERVAL = 600
+
+# Duración (minutos) de las citas por defecto; Especialidad.duracion_cita y
+# Doctor.duracion_cita la reemplazan
+CLINICAS_SLOT_MINUTES = 30
+# Turnos libres por (doctor, fecha) en caché; las señales de Cita, Horario y
+# Doctor los invalidan (segundos)
+CLINICAS_AVAILABILITY_CACHE_TTL = 300
+# Tiempo (segundos) que el chatbot retiene un turno mientras el paciente completa sus datos
+CLINICAS_HOLD_TTL = 180
+# Reservas temporales vigentes por IP y peticiones anónimas a sus endpoints
+CLINICAS_MAX_HOLDS_PER_IP = 3
+CLINICAS_HOLD_THROTTLE_RATE = '20/min'
+# Inventario de turnos: los horarios se expanden en filas (tabla Turno) para los
+# próximos CLINICAS_SLOT_INVENTORY_DAYS días y la disponibilidad se lee de ahí.
+# Requiere ejecutar a diario `python manage.py generar_turnos` para extender la ventana
+CLINICAS_SLOT_INVENTORY = False
+CLINICAS_SLOT_INVENTORY_DAYS = 60
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -50,6 +107,24 @@ INSTALLED_APPS = [
     'api_chat'
 ]
 
+# JSON por defecto; MessagePack para los servicios que lo pidan con Accept
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'rest_framework.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# MessagePack sólo se anuncia si el paquete opcional msgpack está instalado
+if find_spec('msgpack'):
+    REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].append('authentication.renderers.MessagePackRenderer')
+    REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'].append('authentication.renderers.MessagePackParser')
+
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -87,6 +162,16 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Las transacciones toman el bloqueo de escritura al empezar: las
+        # reservas concurrentes esperan su turno en vez de fallar con
+        # "database is locked" al pasar de lectura a escritura
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
+        # Base de tests en archivo: SQLite en memoria compartida no espera los
+        # bloqueos entre conexiones y las pruebas de concurrencia fallarían
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
     }
 }
 
@@ -136,5 +221,15 @@ MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Caché de disponibilidad. LocMemCache es por proceso; con varios workers usar
+# Redis/Memcached para que la invalidación por señales llegue a todos
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'clinicas-availability',
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    }
+}
+
 SESSION_COOKIE_NAME = "sessionid_clinicas"
 CSRF_COOKIE_NAME = "csrftoken_clinicas"
\ No newline at end of file
@@ -3,9 +3,10 @@ from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework.routers import DefaultRouter
+from authentication.views import auth_transport_stats
 from clinicas.views import (
     ClinicaViewSet, EspecialidadViewSet, DoctorViewSet,
-    PacienteViewSet, CitaViewSet
+    PacienteViewSet, CitaViewSet, available_dates
 )
 
 router = DefaultRouter()
@@ -17,8 +18,10 @@ router.register(r'citas', CitaViewSet)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('api/available-dates/', available_dates, name='available-dates'),
     path('api/', include(router.urls)),
     path('api/clinicas/', include('api_chat.urls')), 
+    path('api/internal/auth-transport/', auth_transport_stats, name='auth-transport-stats'),
 ]
 
 if settings.DEBUG: